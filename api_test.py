@@ -1,5 +1,6 @@
 import requests
 import json
+import time
 from datetime import datetime
 
 def test_api_endpoints():
@@ -32,7 +33,7 @@ def test_api_endpoints():
     response = requests.get(f"{base_url}/owner/companies", headers=headers)
     
     if response.status_code == 200:
-        companies = response.json()
+        companies = response.json()["companies"]
         print(f"✅ Retrieved {len(companies)} companies")
         
         # Print company details
@@ -163,9 +164,20 @@ def test_api_endpoints():
     headers = {"Authorization": f"Bearer {owner_token}"}
     response = requests.delete(f"{base_url}/owner/companies/{company_id}", headers=headers)
     
-    if response.status_code == 200:
-        data = response.json()
-        print(f"✅ Deleted company: {data['message']}")
+    if response.status_code == 202:
+        print(f"✅ Company deletion started: job {response.json()['job_id']}")
+        # The data is deleted in the background; wait for the job to finish
+        deadline = time.monotonic() + 60
+        while True:
+            job = requests.get(f"{base_url}/owner/companies/{company_id}/deletion", headers=headers).json()
+            if job["status"] in ("completed", "failed") or time.monotonic() > deadline:
+                break
+            time.sleep(0.5)
+        response = requests.get(f"{base_url}/owner/companies", headers=headers)
+        if job["status"] == "completed" and company_id not in [c["id"] for c in response.json()["companies"]]:
+            print(f"✅ Deleted company: {job['progress']}")
+        else:
+            print(f"❌ Delete company did not complete: {job}")
     else:
         print(f"❌ Delete company failed: {response.text}")
     
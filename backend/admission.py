@@ -0,0 +1,388 @@
+"""Per-company admission control for the API, in priority lanes.
+
+Company requests are sorted into lanes by route (LANE_ROUTES), each with its
+own pool, so one class of work cannot take capacity reserved for another:
+
+- `scan`: kiosk scans; SCAN_LANE_CONCURRENCY slots nothing else can use and a
+  short SCAN_LANE_DEADLINE_SECONDS to wait for one, since people are queueing
+  at the door.
+- `report`: heavy reads (time entry reports); REPORT_LANE_CONCURRENCY slots.
+- `default`: everything else; ADMISSION_MAX_CONCURRENCY slots.
+
+Within a lane every request carrying a company user's token (the `company_id`
+claim of the JWT) is admitted against limits for its company:
+
+- at most TENANT_MAX_CONCURRENCY of the company's requests run at once,
+- a token bucket refilled at TENANT_RATE_PER_SECOND, holding up to
+  TENANT_BURST requests.
+
+A request over a limit waits in its company's queue. When capacity frees up,
+companies with waiting requests take turns, one request each, so a company
+with hundreds queued does not delay another company's single scan. A request
+that waits past its lane's deadline, or finds its company's queue full, is
+answered with 429.
+
+While the 95th percentile of recent scans is above SCAN_LATENCY_SLO_MS,
+report requests are shed right away with 503 and Retry-After, leaving the
+event loop and the Mongo pool to the scans.
+
+Owner and unauthenticated requests are not limited. Limits apply per worker
+process.
+"""
+from collections import deque
+from typing import Dict, Optional
+import asyncio
+import json
+import math
+import os
+import re
+import time
+
+import jwt
+
+import metrics
+
+ADMISSION_CONTROL = os.environ.get('ADMISSION_CONTROL', 'true').lower() == 'true'
+ADMISSION_MAX_CONCURRENCY = int(os.environ.get('ADMISSION_MAX_CONCURRENCY', 64))
+TENANT_MAX_CONCURRENCY = int(os.environ.get('TENANT_MAX_CONCURRENCY', 16))
+TENANT_RATE_PER_SECOND = float(os.environ.get('TENANT_RATE_PER_SECOND', 50))
+TENANT_BURST = float(os.environ.get('TENANT_BURST', 100))
+TENANT_MAX_QUEUE = int(os.environ.get('TENANT_MAX_QUEUE', 200))
+ADMISSION_QUEUE_TIMEOUT_SECONDS = float(os.environ.get('ADMISSION_QUEUE_TIMEOUT_SECONDS', 10))
+SCAN_LANE_CONCURRENCY = int(os.environ.get('SCAN_LANE_CONCURRENCY', 32))
+SCAN_LANE_DEADLINE_SECONDS = float(os.environ.get('SCAN_LANE_DEADLINE_SECONDS', 2))
+REPORT_LANE_CONCURRENCY = int(os.environ.get('REPORT_LANE_CONCURRENCY', 4))
+REPORT_LANE_DEADLINE_SECONDS = float(os.environ.get('REPORT_LANE_DEADLINE_SECONDS', 15))
+SCAN_LATENCY_SLO_MS = float(os.environ.get('SCAN_LATENCY_SLO_MS', 300))
+# Scans older than this no longer count towards the SLO check
+SCAN_LATENCY_WINDOW_SECONDS = float(os.environ.get('SCAN_LATENCY_WINDOW_SECONDS', 10))
+# Fewer recent scans than this are not enough to judge the lane by
+SCAN_LATENCY_MIN_SAMPLES = int(os.environ.get('SCAN_LATENCY_MIN_SAMPLES', 20))
+SHED_RETRY_AFTER_SECONDS = int(os.environ.get('SHED_RETRY_AFTER_SECONDS', 5))
+
+# (method, path pattern, lane); the first match wins, anything else is "default"
+LANE_ROUTES = (
+    ("POST", re.compile(r"^/api/time/scan$"), "scan"),
+    ("GET", re.compile(r"^/api/time/entries(/[^/]+)?$"), "report"),
+    ("GET", re.compile(r"^/api/(timesheets|employees/[^/]+/timesheet)$"), "report"),
+)
+
+QUEUE_BUCKETS = (0, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+admission_queue_seconds = metrics.registry.register(metrics.Histogram(
+    "admission_queue_seconds", "Time company requests waited for admission", ("lane", "outcome"),
+    buckets=QUEUE_BUCKETS
+))
+admission_queued = metrics.registry.register(metrics.Gauge(
+    "admission_queued_requests", "Company requests waiting for admission", ("lane",)
+))
+admission_in_flight = metrics.registry.register(metrics.Gauge(
+    "admission_in_flight_requests", "Admitted company requests being served", ("lane",)
+))
+admission_rejected_total = metrics.registry.register(metrics.Counter(
+    "admission_rejected_total", "Company requests refused admission by lane and reason", ("lane", "reason")
+))
+admission_scan_latency_p95_seconds = metrics.registry.register(metrics.Gauge(
+    "admission_scan_latency_p95_seconds", "95th percentile of recent scan latency, queueing included", ()
+))
+
+class AdmissionRejected(Exception):
+    def __init__(self, reason: str, retry_after: float):
+        super().__init__(reason)
+        self.reason = reason
+        self.retry_after = retry_after
+
+class _Tenant:
+    __slots__ = ("tokens", "refilled_at", "in_flight", "waiters", "admitted", "rejected", "queued_seconds")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.refilled_at = now
+        self.in_flight = 0
+        self.waiters = deque()
+        self.admitted = 0
+        self.rejected = 0
+        self.queued_seconds = 0.0
+
+class AdmissionController:
+    """Token buckets, concurrency limits and round-robin queues, one set per company"""
+
+    def __init__(
+        self,
+        lane: str = "default",
+        max_concurrency: int = ADMISSION_MAX_CONCURRENCY,
+        tenant_concurrency: int = TENANT_MAX_CONCURRENCY,
+        rate: float = TENANT_RATE_PER_SECOND,
+        burst: float = TENANT_BURST,
+        max_queue: int = TENANT_MAX_QUEUE,
+        queue_timeout: float = ADMISSION_QUEUE_TIMEOUT_SECONDS
+    ):
+        self.lane = lane
+        self.max_concurrency = max_concurrency
+        self.tenant_concurrency = tenant_concurrency
+        self.rate = rate
+        self.burst = max(burst, 1)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        self.in_flight = 0
+        self.tenants: Dict[str, _Tenant] = {}
+        # Companies with waiting requests, in the order they get their next turn
+        self._turns = deque()
+        self._refill_timer: Optional[asyncio.TimerHandle] = None
+
+    def tenant(self, company_id: str) -> _Tenant:
+        tenant = self.tenants.get(company_id)
+        if tenant is None:
+            tenant = self.tenants[company_id] = _Tenant(self.burst, time.monotonic())
+        return tenant
+
+    def _refill(self, tenant: _Tenant, now: float):
+        tenant.tokens = min(self.burst, tenant.tokens + (now - tenant.refilled_at) * self.rate)
+        tenant.refilled_at = now
+
+    def _can_start(self, tenant: _Tenant, now: float) -> bool:
+        if self.in_flight >= self.max_concurrency or tenant.in_flight >= self.tenant_concurrency:
+            return False
+        self._refill(tenant, now)
+        return tenant.tokens >= 1
+
+    def _start(self, tenant: _Tenant):
+        tenant.tokens -= 1
+        tenant.in_flight += 1
+        tenant.admitted += 1
+        self.in_flight += 1
+        admission_in_flight.inc(self.lane)
+
+    def _dispatch(self):
+        """Admit waiting requests, one per company per turn, while there is capacity"""
+        now = time.monotonic()
+        refill_wait = None
+        blocked = 0
+        while self._turns and blocked < len(self._turns) and self.in_flight < self.max_concurrency:
+            company_id = self._turns.popleft()
+            tenant = self.tenants[company_id]
+            while tenant.waiters and tenant.waiters[0].done():
+                tenant.waiters.popleft()  # Gave up waiting
+            if not tenant.waiters:
+                continue
+            if not self._can_start(tenant, now):
+                if tenant.in_flight < self.tenant_concurrency:
+                    wait = (1 - tenant.tokens) / self.rate
+                    refill_wait = wait if refill_wait is None else min(refill_wait, wait)
+                self._turns.append(company_id)
+                blocked += 1
+                continue
+            blocked = 0
+            self._start(tenant)
+            tenant.waiters.popleft().set_result(None)
+            if tenant.waiters:
+                self._turns.append(company_id)
+        if refill_wait is not None and self._refill_timer is None:
+            self._refill_timer = asyncio.get_running_loop().call_later(refill_wait, self._on_refill)
+
+    def _on_refill(self):
+        self._refill_timer = None
+        self._dispatch()
+
+    async def acquire(self, company_id: str) -> float:
+        """Wait for the company's turn; returns the seconds spent queued"""
+        tenant = self.tenant(company_id)
+        now = time.monotonic()
+        if not tenant.waiters and self._can_start(tenant, now):
+            self._start(tenant)
+            admission_queue_seconds.observe(self.lane, "admitted", value=0)
+            return 0.0
+        if len(tenant.waiters) >= self.max_queue:
+            tenant.rejected += 1
+            admission_rejected_total.inc(self.lane, "queue_full")
+            raise AdmissionRejected("queue_full", retry_after=max(1.0, len(tenant.waiters) / self.rate))
+
+        waiter = asyncio.get_running_loop().create_future()
+        tenant.waiters.append(waiter)
+        if company_id not in self._turns:
+            self._turns.append(company_id)
+        admission_queued.inc(self.lane)
+        self._dispatch()
+        try:
+            await asyncio.wait_for(waiter, self.queue_timeout)
+        except asyncio.TimeoutError:
+            tenant.rejected += 1
+            admission_rejected_total.inc(self.lane, "timeout")
+            admission_queue_seconds.observe(self.lane, "rejected", value=time.monotonic() - now)
+            raise AdmissionRejected("timeout", retry_after=max(1.0, len(tenant.waiters) / self.rate))
+        except asyncio.CancelledError:
+            # The client went away; if its turn had already come, give the slot back
+            if waiter.done() and not waiter.cancelled():
+                self.release(company_id)
+            raise
+        finally:
+            admission_queued.dec(self.lane)
+            if waiter in tenant.waiters:
+                tenant.waiters.remove(waiter)
+        queued = time.monotonic() - now
+        tenant.queued_seconds += queued
+        admission_queue_seconds.observe(self.lane, "admitted", value=queued)
+        return queued
+
+    def release(self, company_id: str):
+        tenant = self.tenants[company_id]
+        tenant.in_flight -= 1
+        self.in_flight -= 1
+        admission_in_flight.dec(self.lane)
+        self._dispatch()
+
+    def snapshot(self, limit: int = 20) -> dict:
+        """Companies with the most requests queued or in flight, then the most queueing so far"""
+        tenants = sorted(
+            self.tenants.items(),
+            key=lambda item: (len(item[1].waiters) + item[1].in_flight, item[1].queued_seconds),
+            reverse=True
+        )[:limit]
+        return {
+            "limits": {
+                "max_concurrency": self.max_concurrency,
+                "tenant_concurrency": self.tenant_concurrency,
+                "rate_per_second": self.rate,
+                "burst": self.burst,
+                "max_queue": self.max_queue,
+                "queue_timeout_seconds": self.queue_timeout,
+            },
+            "in_flight": self.in_flight,
+            "queued": sum(len(tenant.waiters) for tenant in self.tenants.values()),
+            "tenants": [
+                {"company_id": company_id, "in_flight": tenant.in_flight, "queued": len(tenant.waiters),
+                 "admitted": tenant.admitted, "rejected": tenant.rejected,
+                 "queued_seconds": round(tenant.queued_seconds, 3)}
+                for company_id, tenant in tenants
+            ]
+        }
+
+class LatencyWindow:
+    """Latencies of the last `window` seconds, for a percentile over recent requests"""
+
+    def __init__(self, window: float = SCAN_LATENCY_WINDOW_SECONDS, max_samples: int = 1000):
+        self.window = window
+        self.samples = deque(maxlen=max_samples)  # (monotonic time, seconds)
+
+    def observe(self, seconds: float):
+        self.samples.append((time.monotonic(), seconds))
+
+    def percentile(self, fraction: float, min_samples: int = 1) -> Optional[float]:
+        horizon = time.monotonic() - self.window
+        while self.samples and self.samples[0][0] < horizon:
+            self.samples.popleft()
+        if len(self.samples) < max(min_samples, 1):
+            return None
+        values = sorted(seconds for _, seconds in self.samples)
+        return values[min(len(values) - 1, int(len(values) * fraction))]
+
+class Lanes:
+    """One AdmissionController per lane, plus the scan latency that decides when reports are shed"""
+
+    def __init__(self, controllers: Optional[Dict[str, AdmissionController]] = None,
+                 scan_slo_ms: float = SCAN_LATENCY_SLO_MS):
+        self.controllers = controllers or {
+            "scan": AdmissionController("scan", max_concurrency=SCAN_LANE_CONCURRENCY,
+                                        queue_timeout=SCAN_LANE_DEADLINE_SECONDS),
+            "report": AdmissionController("report", max_concurrency=REPORT_LANE_CONCURRENCY,
+                                          queue_timeout=REPORT_LANE_DEADLINE_SECONDS),
+            "default": AdmissionController("default"),
+        }
+        self.scan_slo_ms = scan_slo_ms
+        self.scan_latency = LatencyWindow()
+
+    @staticmethod
+    def lane_for(method: str, path: str) -> str:
+        for route_method, pattern, lane in LANE_ROUTES:
+            if method == route_method and pattern.match(path):
+                return lane
+        return "default"
+
+    def scan_p95(self) -> Optional[float]:
+        p95 = self.scan_latency.percentile(0.95, SCAN_LATENCY_MIN_SAMPLES)
+        admission_scan_latency_p95_seconds.set(value=p95 or 0)
+        return p95
+
+    def shedding(self) -> bool:
+        """Whether scans are over their latency objective, so low-priority work should wait"""
+        p95 = self.scan_p95()
+        return p95 is not None and p95 * 1000 > self.scan_slo_ms
+
+    async def acquire(self, lane: str, company_id: str):
+        if lane == "report" and self.shedding():
+            admission_rejected_total.inc(lane, "shed")
+            self.controllers[lane].tenant(company_id).rejected += 1
+            raise AdmissionRejected("shed", retry_after=SHED_RETRY_AFTER_SECONDS)
+        await self.controllers[lane].acquire(company_id)
+
+    def release(self, lane: str, company_id: str):
+        self.controllers[lane].release(company_id)
+
+    def snapshot(self, limit: int = 20) -> dict:
+        p95 = self.scan_p95()
+        return {
+            "scan_latency_p95_ms": round(p95 * 1000, 1) if p95 is not None else None,
+            "scan_latency_slo_ms": self.scan_slo_ms,
+            "shedding": p95 is not None and p95 * 1000 > self.scan_slo_ms,
+            "lanes": {lane: controller.snapshot(limit) for lane, controller in self.controllers.items()},
+        }
+
+def company_from_scope(scope, secret_key: str, algorithm: str) -> Optional[str]:
+    """The company_id claim of a valid company user bearer token, if the request has one"""
+    for name, value in scope.get("headers", ()):
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() != "bearer":
+                return None
+            try:
+                payload = jwt.decode(token, secret_key, algorithms=[algorithm])
+            except jwt.PyJWTError:
+                return None  # Rejected by the endpoint's own authentication
+            if payload.get("type", "user") != "user":
+                return None
+            return payload.get("company_id")
+    return None
+
+class AdmissionMiddleware:
+    def __init__(self, app, lanes: Lanes, secret_key: str, algorithm: str):
+        self.app = app
+        self.lanes = lanes
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not ADMISSION_CONTROL:
+            await self.app(scope, receive, send)
+            return
+        company_id = company_from_scope(scope, self.secret_key, self.algorithm)
+        if company_id is None:
+            await self.app(scope, receive, send)
+            return
+
+        lane = self.lanes.lane_for(scope["method"], scope["path"])
+        started = time.monotonic()
+        try:
+            await self.lanes.acquire(lane, company_id)
+        except AdmissionRejected as rejected:
+            if lane == "scan":
+                self.lanes.scan_latency.observe(time.monotonic() - started)
+            if rejected.reason == "shed":
+                status, detail = 503, "Serwer jest przeciążony, spróbuj ponownie za chwilę"
+            else:
+                status, detail = 429, "Zbyt wiele żądań, spróbuj ponownie za chwilę"
+            body = json.dumps({"detail": detail}, ensure_ascii=False).encode()
+            await send({
+                "type": "http.response.start",
+                "status": status,
+                "headers": [(b"content-type", b"application/json"),
+                            (b"content-length", str(len(body)).encode()),
+                            (b"retry-after", str(math.ceil(rejected.retry_after)).encode())],
+            })
+            await send({"type": "http.response.body", "body": body})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            self.lanes.release(lane, company_id)
+            if lane == "scan":
+                self.lanes.scan_latency.observe(time.monotonic() - started)
@@ -0,0 +1,205 @@
+"""Hot/cold tiering of time entries.
+
+Completed entries older than ARCHIVE_AFTER_DAYS are moved out of
+`time_entries` into `time_entries_archive`, one bucket document per employee
+per month. Entries are stored in the bucket keyed by their id, so re-running
+an interrupted batch only overwrites what is already there. Buckets also list
+their entry ids in `entry_ids`, so an archived entry can still be found by id
+and edited or deleted where it is.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Iterable, List, Optional
+from pymongo import UpdateOne
+import asyncio
+import os
+
+ARCHIVE_AFTER_DAYS = int(os.environ.get('ARCHIVE_AFTER_DAYS', 90))
+ARCHIVE_BATCH_SIZE = int(os.environ.get('ARCHIVE_BATCH_SIZE', 1000))
+ARCHIVE_BATCH_PAUSE_SECONDS = float(os.environ.get('ARCHIVE_BATCH_PAUSE_SECONDS', 0.05))
+ARCHIVE_INTERVAL_SECONDS = int(os.environ.get('ARCHIVE_INTERVAL_SECONDS', 6 * 60 * 60))
+
+# Fields of a time entry kept inside a bucket; employee_id lives on the bucket itself
+ARCHIVED_FIELDS = ("id", "check_in", "check_out", "date", "status", "last_scan_time", "auto_closed")
+
+# Databases whose buckets all have entry_ids, checked once per process by the archive job
+_entry_ids_backfilled = set()
+
+def archive_horizon(now: Optional[datetime] = None) -> str:
+    """Entries dated before this YYYY-MM-DD day belong in the archive"""
+    now = now or datetime.now()
+    return (now - timedelta(days=ARCHIVE_AFTER_DAYS)).strftime("%Y-%m-%d")
+
+def reaches_archive(date_from: Optional[str]) -> bool:
+    """Whether a date range starting at date_from (None = unbounded) needs archived data"""
+    return date_from is None or date_from < archive_horizon()
+
+async def ensure_indexes(db):
+    await db.time_entries.create_index([("status", 1), ("date", 1)])
+    await db.time_entries_archive.create_index("id", unique=True)
+    await db.time_entries_archive.create_index([("employee_id", 1), ("month", 1)])
+    await db.time_entries_archive.create_index([("company_id", 1), ("month", 1)])
+    await db.time_entries_archive.create_index("entry_ids")
+
+def _bucket_write(employee_id: str, month: str, entries: List[dict], company_id: Optional[str], now: datetime):
+    """Upsert of entries into the bucket of an employee and month"""
+    return UpdateOne(
+        {"id": f"{employee_id}:{month}"},
+        {
+            "$set": {
+                **{f"entries.{entry['id']}": {field: entry[field] for field in ARCHIVED_FIELDS if field in entry}
+                   for entry in entries},
+                "updated_at": now
+            },
+            "$addToSet": {"entry_ids": {"$each": [entry["id"] for entry in entries]}},
+            "$setOnInsert": {"employee_id": employee_id, "company_id": company_id, "month": month}
+        },
+        upsert=True
+    )
+
+async def archive_completed_entries(
+    db,
+    horizon: Optional[str] = None,
+    on_batch=None,
+    exclude_employee_ids: Optional[List[str]] = None
+) -> dict:
+    """Move completed entries dated before horizon into monthly buckets, batch by batch"""
+    if db.name not in _entry_ids_backfilled:
+        await backfill_entry_ids(db)
+        _entry_ids_backfilled.add(db.name)
+    horizon = horizon or archive_horizon()
+    stats = {"entries_archived": 0, "buckets_updated": 0}
+    query = {"status": "completed", "date": {"$lt": horizon}}
+    if exclude_employee_ids:
+        query["employee_id"] = {"$nin": exclude_employee_ids}
+
+    while True:
+        entries = await db.time_entries.find(query).limit(ARCHIVE_BATCH_SIZE).to_list(ARCHIVE_BATCH_SIZE)
+        if not entries:
+            return stats
+
+        employee_ids = list({entry["employee_id"] for entry in entries})
+        employees = await db.employees.find(
+            {"id": {"$in": employee_ids}}, {"id": 1, "company_id": 1}
+        ).to_list(None)
+        company_by_employee = {emp["id"]: emp["company_id"] for emp in employees}
+
+        buckets = {}
+        for entry in entries:
+            buckets.setdefault((entry["employee_id"], entry["date"][:7]), []).append(entry)
+
+        now = datetime.utcnow()
+        operations = [
+            _bucket_write(employee_id, month, bucket_entries,
+                          bucket_entries[0].get("company_id") or company_by_employee.get(employee_id), now)
+            for (employee_id, month), bucket_entries in buckets.items()
+        ]
+        await db.time_entries_archive.bulk_write(operations, ordered=False)
+        # Only remove the hot copies once their buckets are written
+        await db.time_entries.delete_many({"_id": {"$in": [entry["_id"] for entry in entries]}})
+
+        stats["entries_archived"] += len(entries)
+        stats["buckets_updated"] += len(operations)
+        if on_batch:
+            await on_batch(len(entries), len(operations))
+        await asyncio.sleep(ARCHIVE_BATCH_PAUSE_SECONDS)
+
+async def backfill_entry_ids(db) -> int:
+    """List the entry ids of buckets written before `entry_ids` existed"""
+    filled = 0
+    async for bucket in db.time_entries_archive.find({"entry_ids": {"$exists": False}}, {"_id": 0, "id": 1, "entries": 1}):
+        await db.time_entries_archive.update_one(
+            {"id": bucket["id"]}, {"$set": {"entry_ids": list(bucket.get("entries", {}))}}
+        )
+        filled += 1
+    return filled
+
+async def find_archived_entries(
+    db,
+    employee_ids: List[str],
+    date_from: Optional[str] = None,
+    date_to: Optional[str] = None,
+    limit: Optional[int] = None,
+    exclude_ids: Iterable[str] = ()
+) -> List[dict]:
+    """Unpack archived entries of the given employees within [date_from, date_to], newest first.
+
+    Buckets are read month by month from the newest and reading stops at the
+    first month that completes `limit` entries, so an unbounded range does not
+    load an employee's whole history.
+    """
+    query = {"employee_id": {"$in": employee_ids}}
+    month_range = {}
+    if date_from:
+        month_range["$gte"] = date_from[:7]
+    if date_to:
+        month_range["$lte"] = date_to[:7]
+    if month_range:
+        query["month"] = month_range
+    exclude_ids = set(exclude_ids)
+
+    result = []
+    month = None
+    cursor = db.time_entries_archive.find(
+        query, {"_id": 0, "employee_id": 1, "month": 1, "entries": 1}
+    ).sort("month", -1)
+    async for bucket in cursor:
+        # Months of several employees interleave; only stop between months so none is cut short
+        if limit is not None and len(result) >= limit and bucket["month"] != month:
+            break
+        month = bucket["month"]
+        for entry in bucket.get("entries", {}).values():
+            if entry["id"] in exclude_ids:
+                continue
+            if date_from and entry["date"] < date_from:
+                continue
+            if date_to and entry["date"] > date_to:
+                continue
+            result.append({**entry, "employee_id": bucket["employee_id"], "archived": True})
+    result.sort(key=lambda entry: entry["date"], reverse=True)
+    return result[:limit] if limit is not None else result
+
+async def find_archived_by_ids(db, entry_ids: List[str]) -> Dict[str, dict]:
+    """Archived entries by id, for edits of entries that have left time_entries"""
+    if not entry_ids:
+        return {}
+    projection = {"_id": 0, "employee_id": 1, "company_id": 1, **{f"entries.{entry_id}": 1 for entry_id in entry_ids}}
+    found = {}
+    async for bucket in db.time_entries_archive.find({"entry_ids": {"$in": entry_ids}}, projection):
+        for entry_id, entry in bucket.get("entries", {}).items():
+            found[entry_id] = {**entry, "employee_id": bucket["employee_id"], "company_id": bucket.get("company_id"),
+                               "archived": True}
+    return found
+
+async def delete_archived_entry(db, entry: dict) -> bool:
+    result = await db.time_entries_archive.update_one(
+        {"id": f"{entry['employee_id']}:{entry['date'][:7]}", "entry_ids": entry["id"]},
+        {"$unset": {f"entries.{entry['id']}": ""}, "$pull": {"entry_ids": entry["id"]}}
+    )
+    return result.modified_count > 0
+
+async def update_archived_entry(db, entry: dict, update_fields: dict) -> dict:
+    """Apply an edit to an archived entry; returns the entry as it is stored afterwards.
+
+    An entry whose new date is in another month moves to that month's bucket,
+    and one dated after the archive horizon goes back to time_entries.
+    """
+    updated = {**entry, **update_fields}
+    if updated["date"][:7] == entry["date"][:7] and updated["date"] < archive_horizon():
+        await db.time_entries_archive.update_one(
+            {"id": f"{entry['employee_id']}:{entry['date'][:7]}"},
+            {"$set": {**{f"entries.{entry['id']}.{field}": value for field, value in update_fields.items()
+                         if field in ARCHIVED_FIELDS}, "updated_at": datetime.utcnow()}}
+        )
+        return updated
+
+    await delete_archived_entry(db, entry)
+    stored = {field: updated[field] for field in ARCHIVED_FIELDS if field in updated}
+    stored["employee_id"] = entry["employee_id"]
+    if updated["date"] < archive_horizon():
+        await db.time_entries_archive.bulk_write([
+            _bucket_write(entry["employee_id"], updated["date"][:7], [stored], entry.get("company_id"),
+                          datetime.utcnow())
+        ])
+        return {**stored, "archived": True}
+    await db.time_entries.insert_one({**stored, "company_id": entry.get("company_id")})
+    return stored
@@ -0,0 +1,157 @@
+"""Signed employee badges.
+
+A badge QR code carries `E1.<kid>.<ids>.<signature>`: the company and employee
+ids packed as 32 bytes, and a truncated HMAC-SHA256 over the rest of the
+payload made with the signing key named by `kid`. `verify` checks it in
+constant time without any database access, so forged codes and codes of
+another company are turned away before the scan touches MongoDB, and the
+employee is then read by id.
+
+QR_SIGNING_KEYS holds the keys as `kid:secret,kid:secret`; QR_SIGNING_KID
+picks the one new badges are signed with (the first by default). To rotate,
+add a new key, make it current, run the `badge_reissue` job so every badge
+is redrawn with it, then drop the old key. Without QR_SIGNING_KEYS a key
+derived from the JWT secret is used, with a warning at startup: rotating
+JWT_SECRET then invalidates every printed badge.
+
+Badges printed before signing (`EMP_<company>_<number>_<random>`) are still
+accepted while QR_ACCEPT_LEGACY is on; `badge_reissue` replaces them too.
+"""
+from typing import Dict, List, Optional, Tuple
+import asyncio
+import base64
+import binascii
+import hashlib
+import hmac
+import io
+import logging
+import os
+import re
+import uuid
+
+import metrics
+
+QR_ACCEPT_LEGACY = os.environ.get('QR_ACCEPT_LEGACY', 'true').lower() == 'true'
+BADGE_REISSUE_BATCH_SIZE = int(os.environ.get('BADGE_REISSUE_BATCH_SIZE', 100))
+BADGE_REISSUE_BATCH_PAUSE_SECONDS = float(os.environ.get('BADGE_REISSUE_BATCH_PAUSE_SECONDS', 0.05))
+
+PAYLOAD_VERSION = "E1"
+SIGNATURE_BYTES = 16
+KID_PATTERN = re.compile(r"^[A-Za-z0-9]{1,8}$")
+
+logger = logging.getLogger(__name__)
+
+badge_scans_total = metrics.registry.register(metrics.Counter(
+    "badge_scans_total", "Accepted badge scans by payload format (signed or legacy)", ("format",)
+))
+
+class InvalidBadge(Exception):
+    pass
+
+class ForeignBadge(InvalidBadge):
+    """A genuine badge of another company"""
+
+def _load_keys() -> Dict[str, bytes]:
+    keys = {}
+    for item in filter(None, (part.strip() for part in os.environ.get('QR_SIGNING_KEYS', '').split(','))):
+        kid, _, secret = item.partition(":")
+        if not KID_PATTERN.match(kid) or not secret:
+            raise ValueError(f"Invalid QR_SIGNING_KEYS entry for kid {kid!r}")
+        keys[kid] = secret.encode()
+    if not keys:
+        jwt_secret = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production')
+        keys["0"] = hmac.new(jwt_secret.encode(), b"employee-badges", hashlib.sha256).digest()
+        logger.warning("QR_SIGNING_KEYS is not set: badges are signed with a key derived from JWT_SECRET, "
+                       "and rotating JWT_SECRET will invalidate every printed badge")
+    return keys
+
+SIGNING_KEYS = _load_keys()
+QR_SIGNING_KID = os.environ.get('QR_SIGNING_KID') or next(iter(SIGNING_KEYS))
+if QR_SIGNING_KID not in SIGNING_KEYS:
+    raise ValueError(f"QR_SIGNING_KID {QR_SIGNING_KID!r} is not in QR_SIGNING_KEYS")
+
+def _b64(data: bytes) -> str:
+    return base64.urlsafe_b64encode(data).rstrip(b"=").decode()
+
+def _unb64(text: str) -> bytes:
+    return base64.urlsafe_b64decode(text + "=" * (-len(text) % 4))
+
+def _signature(kid: str, signed: str) -> str:
+    return _b64(hmac.new(SIGNING_KEYS[kid], signed.encode(), hashlib.sha256).digest()[:SIGNATURE_BYTES])
+
+def badge_key(company_id: str, employee_id: str) -> str:
+    """The ids part of a badge payload; it stays the same when the badge is signed with another key"""
+    return _b64(uuid.UUID(company_id).bytes + uuid.UUID(employee_id).bytes)
+
+def sign(company_id: str, employee_id: str, kid: Optional[str] = None) -> str:
+    """The QR payload of an employee's badge"""
+    kid = kid or QR_SIGNING_KID
+    signed = f"{PAYLOAD_VERSION}.{kid}.{badge_key(company_id, employee_id)}"
+    return f"{signed}.{_signature(kid, signed)}"
+
+def is_signed(payload: str) -> bool:
+    return payload.startswith(PAYLOAD_VERSION + ".")
+
+def verify(payload: str, company_id: str) -> str:
+    """The employee id of a badge of company_id; InvalidBadge or ForeignBadge otherwise"""
+    parts = payload.split(".")
+    if len(parts) != 4 or parts[0] != PAYLOAD_VERSION or parts[1] not in SIGNING_KEYS:
+        raise InvalidBadge()
+    signed = payload[:payload.rindex(".")]
+    if not hmac.compare_digest(parts[3], _signature(parts[1], signed)):
+        raise InvalidBadge()
+    try:
+        ids = _unb64(parts[2])
+    except (binascii.Error, ValueError):
+        raise InvalidBadge()
+    if len(ids) != 32:
+        raise InvalidBadge()
+    if str(uuid.UUID(bytes=ids[:16])) != company_id:
+        raise ForeignBadge()
+    return str(uuid.UUID(bytes=ids[16:]))
+
+def parse_legacy(payload: str) -> Tuple[str, str]:
+    """(company id, employee number) of an unsigned EMP_ badge"""
+    parts = payload.split("_")
+    if len(parts) < 3 or parts[0] != "EMP":
+        raise InvalidBadge()
+    return parts[1], parts[2]
+
+def generate_qr_code(data: str) -> str:
+    import qrcode
+
+    qr = qrcode.QRCode(version=1, box_size=10, border=5)
+    qr.add_data(data)
+    qr.make(fit=True)
+
+    img = qr.make_image(fill_color="black", back_color="white")
+    img_buffer = io.BytesIO()
+    img.save(img_buffer, format='PNG')
+    img_str = base64.b64encode(img_buffer.getvalue()).decode()
+    return f"data:image/png;base64,{img_str}"
+
+def issue(company_id: str, employee_id: str) -> dict:
+    """The badge fields of an employee document, signed with the current key"""
+    return {"qr_code": generate_qr_code(sign(company_id, employee_id)), "badge_kid": QR_SIGNING_KID}
+
+async def reissue(db, on_batch=None, exclude_company_ids: Optional[List[str]] = None) -> int:
+    """Redraw every badge not signed with the current key, legacy ones included"""
+    reissued = 0
+    query = {"badge_kid": {"$ne": QR_SIGNING_KID}}
+    if exclude_company_ids:
+        query["company_id"] = {"$nin": exclude_company_ids}
+    loop = asyncio.get_running_loop()
+    while True:
+        employees = await db.employees.find(
+            query, {"_id": 0, "id": 1, "company_id": 1}
+        ).limit(BADGE_REISSUE_BATCH_SIZE).to_list(BADGE_REISSUE_BATCH_SIZE)
+        if not employees:
+            return reissued
+        for employee in employees:
+            # Drawing the PNG is CPU work; keep it off the loop that also runs other jobs
+            badge = await loop.run_in_executor(None, issue, employee["company_id"], employee["id"])
+            await db.employees.update_one({"id": employee["id"]}, {"$set": badge})
+        reissued += len(employees)
+        if on_batch:
+            await on_batch(len(employees))
+        await asyncio.sleep(BADGE_REISSUE_BATCH_PAUSE_SECONDS)
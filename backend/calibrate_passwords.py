@@ -0,0 +1,35 @@
+"""Pick a password hashing cost for this machine.
+
+Measures how long one verify takes at increasing costs and prints the setting
+for the highest cost that stays within the target. Run it on the hardware the
+API runs on; existing hashes move to the new cost as their owners log in.
+
+    python calibrate_passwords.py --target-ms 250
+    python calibrate_passwords.py --scheme pbkdf2_sha256 --target-ms 100
+"""
+import argparse
+import sys
+
+import passwords
+
+def main(args):
+    try:
+        rounds, verify_ms = passwords.calibrate(args.scheme, args.target_ms, samples=args.samples)
+    except (ValueError, ImportError) as exc:
+        print(f"❌ {exc}")
+        return 1
+    current = passwords.PASSWORD_ROUNDS.get(args.scheme)
+    print(f"{args.scheme}: cost {rounds} verifies in {verify_ms:.1f} ms (target {args.target_ms:g} ms)")
+    if current is not None:
+        print(f"Currently configured: {current}, {passwords.verify_seconds(args.scheme, current) * 1000:.1f} ms")
+    print(f"\nPASSWORD_{args.scheme.upper()}_ROUNDS={rounds}")
+    if args.scheme != passwords.PASSWORD_SCHEMES[0]:
+        print(f"PASSWORD_SCHEMES={','.join([args.scheme] + [s for s in passwords.PASSWORD_SCHEMES if s != args.scheme])}")
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Calibrate the password hashing cost for a target verify time")
+    parser.add_argument("--scheme", choices=sorted(passwords.DEFAULT_ROUNDS), default=passwords.PASSWORD_SCHEMES[0])
+    parser.add_argument("--target-ms", type=float, default=250, help="Longest acceptable verify time of one login")
+    parser.add_argument("--samples", type=int, default=3, help="Verifies per cost; the fastest counts")
+    sys.exit(main(parser.parse_args()))
@@ -0,0 +1,102 @@
+"""MongoDB client configuration and read routing.
+
+`create_client` builds the Motor client from environment settings: pool
+bounds, wire compression, timeouts and retry behaviour. Settings given
+explicitly here win over the same options in MONGO_URL.
+
+`analytics_database` returns a handle on the same database that reads from
+secondaries when MONGO_ANALYTICS_READ_PREFERENCE allows it, refusing any
+secondary more than MONGO_ANALYTICS_MAX_STALENESS_SECONDS behind. Reports and
+exports read through it; scans, writes and the reads that guard writes use the
+primary handle.
+
+To try the routing locally, run a single-host replica set:
+
+    mongod --replSet rs0 --dbpath /tmp/rs0 --port 27017
+    mongosh --eval 'rs.initiate()'
+    MONGO_URL="mongodb://localhost:27017/?replicaSet=rs0"
+
+With no secondary available, secondaryPreferred reads fall back to the primary.
+"""
+from importlib.util import find_spec
+from pymongo.read_preferences import read_pref_mode_from_name, make_read_preference
+from typing import Optional, TYPE_CHECKING
+import logging
+import os
+
+if TYPE_CHECKING:
+    from motor.motor_asyncio import AsyncIOMotorClient
+
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 5))
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+MONGO_MAX_IDLE_TIME_MS = int(os.environ.get('MONGO_MAX_IDLE_TIME_MS', 5 * 60 * 1000))
+MONGO_WAIT_QUEUE_TIMEOUT_MS = int(os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS', 10000))
+# Comma-separated, in order of preference; empty disables compression. Unset tries
+# every compressor and quietly skips the ones whose package is missing
+MONGO_COMPRESSORS = os.environ.get('MONGO_COMPRESSORS')
+DEFAULT_COMPRESSORS = "zstd,snappy,zlib"
+MONGO_ZLIB_COMPRESSION_LEVEL = int(os.environ.get('MONGO_ZLIB_COMPRESSION_LEVEL', 6))
+MONGO_CONNECT_TIMEOUT_MS = int(os.environ.get('MONGO_CONNECT_TIMEOUT_MS', 10000))
+MONGO_SERVER_SELECTION_TIMEOUT_MS = int(os.environ.get('MONGO_SERVER_SELECTION_TIMEOUT_MS', 10000))
+MONGO_SOCKET_TIMEOUT_MS = int(os.environ.get('MONGO_SOCKET_TIMEOUT_MS', 30000))
+MONGO_RETRY_WRITES = os.environ.get('MONGO_RETRY_WRITES', 'true').lower() == 'true'
+MONGO_RETRY_READS = os.environ.get('MONGO_RETRY_READS', 'true').lower() == 'true'
+
+MONGO_ANALYTICS_READ_PREFERENCE = os.environ.get('MONGO_ANALYTICS_READ_PREFERENCE', 'secondaryPreferred')
+# MongoDB rejects values below 90 seconds
+MONGO_ANALYTICS_MAX_STALENESS_SECONDS = int(os.environ.get('MONGO_ANALYTICS_MAX_STALENESS_SECONDS', 90))
+
+# Compressors that need a package pymongo does not install by default
+COMPRESSOR_PACKAGES = {"zstd": "zstandard", "snappy": "snappy"}
+
+logger = logging.getLogger(__name__)
+
+def available_compressors(requested: Optional[str] = MONGO_COMPRESSORS) -> list:
+    """The requested compressors this interpreter can actually use, in order"""
+    compressors = []
+    for name in (part.strip() for part in (requested if requested is not None else DEFAULT_COMPRESSORS).split(",")):
+        if not name:
+            continue
+        package = COMPRESSOR_PACKAGES.get(name)
+        if package and find_spec(package) is None:
+            if requested is not None:
+                logger.warning("MongoDB compressor %s skipped: the %s package is not installed", name, package)
+            continue
+        compressors.append(name)
+    return compressors
+
+def client_options() -> dict:
+    options = {
+        "minPoolSize": MONGO_MIN_POOL_SIZE,
+        "maxPoolSize": MONGO_MAX_POOL_SIZE,
+        "maxIdleTimeMS": MONGO_MAX_IDLE_TIME_MS,
+        "waitQueueTimeoutMS": MONGO_WAIT_QUEUE_TIMEOUT_MS,
+        "connectTimeoutMS": MONGO_CONNECT_TIMEOUT_MS,
+        "serverSelectionTimeoutMS": MONGO_SERVER_SELECTION_TIMEOUT_MS,
+        "socketTimeoutMS": MONGO_SOCKET_TIMEOUT_MS,
+        "retryWrites": MONGO_RETRY_WRITES,
+        "retryReads": MONGO_RETRY_READS,
+    }
+    compressors = available_compressors()
+    if compressors:
+        options["compressors"] = ",".join(compressors)
+        if "zlib" in compressors:
+            options["zlibCompressionLevel"] = MONGO_ZLIB_COMPRESSION_LEVEL
+    return options
+
+def create_client(mongo_url: str, **overrides) -> "AsyncIOMotorClient":
+    """Motor client configured from the environment; overrides (e.g. event_listeners) are passed through"""
+    # Imported here so that importing the API does not pay for Motor until connect()
+    from motor.motor_asyncio import AsyncIOMotorClient
+    return AsyncIOMotorClient(mongo_url, **{**client_options(), **overrides})
+
+def analytics_read_preference():
+    mode = read_pref_mode_from_name(MONGO_ANALYTICS_READ_PREFERENCE)
+    if MONGO_ANALYTICS_READ_PREFERENCE == "primary":
+        # maxStalenessSeconds is not allowed with primary reads
+        return make_read_preference(mode, None)
+    return make_read_preference(mode, None, max_staleness=MONGO_ANALYTICS_MAX_STALENESS_SECONDS)
+
+def analytics_database(client: "AsyncIOMotorClient", name: str):
+    """The same database, read through secondaries within the staleness bound"""
+    return client.get_database(name, read_preference=analytics_read_preference())
@@ -0,0 +1,169 @@
+"""Owner company directory: search, sorting and keyset pagination.
+
+Company documents carry what the directory lists, maintained on write rather
+than counted per request:
+
+- `admin_count`, `user_count`, `employee_count`: $inc'ed by the endpoints that
+  create and delete users and employees, and recounted by a daily reconcile
+  job in case a write was lost between the two updates.
+- `last_activity_at`: moved forward by scans and time entry edits, at most once
+  per ACTIVITY_RESOLUTION_SECONDS per company and process.
+- `name_key`: the normalized name, for prefix search and name ordering.
+
+Pages are read from an index on (sort field, id) starting after the cursor,
+so a page costs the same at the end of the list as at the start.
+"""
+from datetime import datetime, timedelta
+from typing import Optional
+import base64
+import json
+import os
+import re
+import time
+
+from search import normalize
+import tenancy
+
+DIRECTORY_SORTS = {
+    "name": "name_key",
+    "size": "employee_count",
+    "activity": "last_activity_at",
+    "created": "created_at",
+}
+ACTIVITY_RESOLUTION_SECONDS = int(os.environ.get('ACTIVITY_RESOLUTION_SECONDS', 60))
+DIRECTORY_RECONCILE_INTERVAL_SECONDS = int(os.environ.get('DIRECTORY_RECONCILE_INTERVAL_SECONDS', 24 * 60 * 60))
+DIRECTORY_RECONCILE_BATCH_SIZE = int(os.environ.get('DIRECTORY_RECONCILE_BATCH_SIZE', 200))
+
+LISTED_FIELDS = ("id", "name", "owner_id", "retention_years", "created_at", "last_activity_at",
+                 "admin_count", "user_count", "employee_count")
+
+# company_id -> monotonic time of this process's last activity write
+_last_touched = {}
+
+class InvalidCursor(ValueError):
+    pass
+
+def new_company_fields(name: str, created_at: datetime) -> dict:
+    """Directory fields of a company created with its first admin"""
+    return {"name_key": normalize(name), "admin_count": 1, "user_count": 1, "employee_count": 0,
+            "last_activity_at": created_at}
+
+async def ensure_indexes(db):
+    for field in DIRECTORY_SORTS.values():
+        await db.companies.create_index([(field, 1), ("id", 1)])
+
+def encode_cursor(value, company_id: str) -> str:
+    if isinstance(value, datetime):
+        value = {"$date": value.isoformat()}
+    raw = json.dumps([value, company_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+def decode_cursor(cursor: str):
+    try:
+        value, company_id = json.loads(base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4)))
+        if isinstance(value, dict):
+            value = datetime.fromisoformat(value["$date"])
+        return value, str(company_id)
+    except (ValueError, TypeError, KeyError):
+        raise InvalidCursor(cursor)
+
+def after_cursor(field: str, direction: int, value, company_id: str) -> list:
+    """The $or clauses for the companies past a cursor in (field, id) order.
+
+    MongoDB sorts a missing or null field before every value, and $gt/$lt never
+    match it, so a cursor on a company without the field needs clauses of its own.
+    """
+    beyond = "$lt" if direction < 0 else "$gt"
+    clauses = [{field: value, "id": {beyond: company_id}}]
+    if value is None:
+        if direction > 0:
+            clauses.append({field: {"$ne": None}})
+    else:
+        clauses.append({field: {beyond: value}})
+        if direction < 0:
+            clauses.append({field: None})
+    return clauses
+
+async def list_companies(db, q: Optional[str], sort: str, order: str, limit: int,
+                         cursor: Optional[str]) -> dict:
+    field = DIRECTORY_SORTS[sort]
+    direction = -1 if order == "desc" else 1
+    query = {"deleted_at": None}
+    if q and normalize(q):
+        query["name_key"] = {"$regex": f"^{re.escape(normalize(q))}"}
+    if cursor:
+        value, company_id = decode_cursor(cursor)
+        query["$or"] = after_cursor(field, direction, value, company_id)
+
+    projection = {"_id": 0, field: 1, **{name: 1 for name in LISTED_FIELDS}}
+    companies = await db.companies.find(query, projection) \
+        .sort([(field, direction), ("id", direction)]).limit(limit + 1).to_list(limit + 1)
+
+    next_cursor = None
+    if len(companies) > limit:
+        companies = companies[:limit]
+        last = companies[-1]
+        next_cursor = encode_cursor(last.get(field), last["id"])
+    for company in companies:
+        company.pop("name_key", None)
+    return {"companies": companies, "next_cursor": next_cursor}
+
+async def totals(db) -> dict:
+    """Company, user and employee totals across the whole directory"""
+    result = await db.companies.aggregate([
+        {"$match": {"deleted_at": None}},
+        {"$group": {"_id": None, "companies": {"$sum": 1}, "users": {"$sum": "$user_count"},
+                    "employees": {"$sum": "$employee_count"}}},
+    ]).to_list(1)
+    if not result:
+        return {"companies": 0, "users": 0, "employees": 0}
+    return {key: result[0][key] for key in ("companies", "users", "employees")}
+
+async def touch_activity(db, company_id: str, now: Optional[datetime] = None):
+    """Record activity in a company, skipping the write if it was recorded recently"""
+    monotonic = time.monotonic()
+    if monotonic - _last_touched.get(company_id, float("-inf")) < ACTIVITY_RESOLUTION_SECONDS:
+        return
+    _last_touched[company_id] = monotonic
+    now = now or datetime.utcnow()
+    # Other processes may have moved it already; only ever move it forward
+    await db.companies.update_one(
+        {"id": company_id, "$or": [
+            {"last_activity_at": {"$lt": now - timedelta(seconds=ACTIVITY_RESOLUTION_SECONDS)}},
+            {"last_activity_at": None}
+        ]},
+        {"$set": {"last_activity_at": now}}
+    )
+
+async def count_change(db, company_id: str, **deltas):
+    """Apply counter deltas, e.g. count_change(db, company_id, employee_count=1)"""
+    await db.companies.update_one({"id": company_id}, {"$inc": deltas})
+
+async def reconcile(db, on_batch=None) -> dict:
+    """Recount every company's users and employees and fill in missing directory fields"""
+    stats = {"companies_checked": 0, "companies_corrected": 0}
+    last_id = ""
+    while True:
+        companies = await db.companies.find(
+            {"id": {"$gt": last_id}, "deleted_at": None}
+        ).sort("id", 1).limit(DIRECTORY_RECONCILE_BATCH_SIZE).to_list(DIRECTORY_RECONCILE_BATCH_SIZE)
+        if not companies:
+            return stats
+        last_id = companies[-1]["id"]
+        corrected = 0
+        for company in companies:
+            tenant_db = await tenancy.tenant_database(db, company["id"])
+            actual = {
+                "name_key": normalize(company["name"]),
+                "admin_count": await db.users.count_documents({"company_id": company["id"], "role": "admin"}),
+                "user_count": await db.users.count_documents({"company_id": company["id"]}),
+                "employee_count": await tenant_db.employees.count_documents({"company_id": company["id"]}),
+                "last_activity_at": company.get("last_activity_at") or company.get("created_at"),
+            }
+            if any(company.get(key) != value for key, value in actual.items()):
+                await db.companies.update_one({"id": company["id"]}, {"$set": actual})
+                corrected += 1
+        stats["companies_checked"] += len(companies)
+        stats["companies_corrected"] += corrected
+        if on_batch:
+            await on_batch(len(companies), corrected)
@@ -0,0 +1,269 @@
+"""Idempotency-Key support for retried requests.
+
+A kiosk on a flaky network may send the same scan twice. When the request
+carries an `Idempotency-Key` header, the first response is kept for
+IDEMPOTENCY_WINDOW_SECONDS and a retry with the same key gets that response
+back, marked with `Idempotent-Replayed: true`, without running the handler or
+touching the database. A retry that arrives while the first attempt is still
+running waits for it.
+
+Keys are scoped to the company of the caller's token. Only successful
+responses are kept, so a retry after an error runs the request again. Reusing
+a key with a different request body is refused with 422.
+
+IDEMPOTENCY_STORE picks where responses are kept: `memory` (default; an LRU
+bounded by IDEMPOTENCY_MAX_KEYS, costing a scan no database writes) or `mongo`
+(the `idempotency_keys` collection with a TTL index, shared by every worker).
+A retry after a dropped connection may reach another worker process, so
+serve.py switches to `mongo` when it starts more than one worker, and refuses
+an explicit `memory` there.
+"""
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from datetime import datetime, timedelta
+from pymongo.errors import DuplicateKeyError
+from typing import Optional, Tuple
+import asyncio
+import hashlib
+import json
+import os
+import time
+
+from admission import company_from_scope
+
+IDEMPOTENCY_STORE = os.environ.get('IDEMPOTENCY_STORE', 'memory')
+IDEMPOTENCY_WINDOW_SECONDS = int(os.environ.get('IDEMPOTENCY_WINDOW_SECONDS', 10 * 60))
+IDEMPOTENCY_MAX_KEYS = int(os.environ.get('IDEMPOTENCY_MAX_KEYS', 10000))
+# How long a retry waits for the first attempt with its key to finish
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get('IDEMPOTENCY_WAIT_SECONDS', 5))
+IDEMPOTENCY_MAX_KEY_LENGTH = 255
+
+# A response as kept in a store: (status, [[header, value], ...], body)
+StoredResponse = Tuple[int, list, bytes]
+
+class IdempotencyConflict(Exception):
+    def __init__(self, status_code: int, detail: str):
+        super().__init__(detail)
+        self.status_code = status_code
+        self.detail = detail
+
+def _mismatch():
+    return IdempotencyConflict(422, "Klucz Idempotency-Key został już użyty z inną treścią żądania")
+
+def _still_running():
+    return IdempotencyConflict(409, "Żądanie z tym kluczem Idempotency-Key jest jeszcze przetwarzane")
+
+class IdempotencyStore(ABC):
+    """Claims keys, keeps responses and hands them back to retries"""
+    db = None
+
+    async def ensure_indexes(self):
+        pass
+
+    @abstractmethod
+    async def begin(self, key: str, fingerprint: str) -> Optional[StoredResponse]:
+        """Claim key for a new request (None), or return the kept response of an earlier one"""
+
+    @abstractmethod
+    async def complete(self, key: str, response: StoredResponse):
+        """Keep the response of a claimed key for retries"""
+
+    @abstractmethod
+    async def abandon(self, key: str):
+        """Release a claimed key without keeping a response, so a retry runs again"""
+
+class _MemoryEntry:
+    __slots__ = ("fingerprint", "expires_at", "response", "done")
+
+    def __init__(self, fingerprint: str, expires_at: float):
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+        self.response: Optional[StoredResponse] = None
+        self.done = asyncio.Event()
+
+class MemoryStore(IdempotencyStore):
+    def __init__(self, window: float = IDEMPOTENCY_WINDOW_SECONDS, max_keys: int = IDEMPOTENCY_MAX_KEYS,
+                 wait: float = IDEMPOTENCY_WAIT_SECONDS):
+        self.window = window
+        self.max_keys = max_keys
+        self.wait = wait
+        self._entries: "OrderedDict[str, _MemoryEntry]" = OrderedDict()
+
+    async def begin(self, key, fingerprint):
+        while True:
+            entry = self._entries.get(key)
+            if entry is None or entry.expires_at < time.monotonic():
+                self._entries[key] = _MemoryEntry(fingerprint, time.monotonic() + self.window)
+                self._entries.move_to_end(key)
+                while len(self._entries) > self.max_keys:
+                    self._entries.popitem(last=False)
+                return None
+            if entry.fingerprint != fingerprint:
+                raise _mismatch()
+            if entry.done.is_set():
+                self._entries.move_to_end(key)
+                return entry.response
+            try:
+                await asyncio.wait_for(entry.done.wait(), self.wait)
+            except asyncio.TimeoutError:
+                raise _still_running()
+            # Finished or abandoned; look again
+
+    async def complete(self, key, response):
+        entry = self._entries.get(key)
+        if entry is not None:
+            entry.response = response
+            entry.done.set()
+
+    async def abandon(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            entry.done.set()
+
+class MongoStore(IdempotencyStore):
+    """Keys in the idempotency_keys collection, expired by a TTL index"""
+
+    POLL_SECONDS = 0.05
+
+    def __init__(self, db=None, window: float = IDEMPOTENCY_WINDOW_SECONDS, wait: float = IDEMPOTENCY_WAIT_SECONDS):
+        self.db = db
+        self.window = window
+        self.wait = wait
+
+    async def ensure_indexes(self):
+        await self.db.idempotency_keys.create_index("expires_at", expireAfterSeconds=0)
+
+    async def begin(self, key, fingerprint):
+        deadline = time.monotonic() + self.wait
+        while True:
+            now = datetime.utcnow()
+            try:
+                await self.db.idempotency_keys.insert_one({
+                    "_id": key, "fingerprint": fingerprint, "response": None,
+                    "expires_at": now + timedelta(seconds=self.window)
+                })
+                return None
+            except DuplicateKeyError:
+                pass
+            entry = await self.db.idempotency_keys.find_one({"_id": key})
+            if entry is None:
+                continue  # Abandoned in the meantime
+            if entry["expires_at"] < now:
+                # The TTL monitor only runs once a minute; take over an expired key
+                await self.db.idempotency_keys.delete_one({"_id": key, "expires_at": entry["expires_at"]})
+                continue
+            if entry["fingerprint"] != fingerprint:
+                raise _mismatch()
+            if entry["response"] is not None:
+                response = entry["response"]
+                return response["status"], response["headers"], bytes(response["body"])
+            if time.monotonic() > deadline:
+                raise _still_running()
+            await asyncio.sleep(self.POLL_SECONDS)
+
+    async def complete(self, key, response):
+        status, headers, body = response
+        await self.db.idempotency_keys.update_one(
+            {"_id": key}, {"$set": {"response": {"status": status, "headers": headers, "body": body}}}
+        )
+
+    async def abandon(self, key):
+        await self.db.idempotency_keys.delete_one({"_id": key, "response": None})
+
+def create_store(backend: str = IDEMPOTENCY_STORE) -> IdempotencyStore:
+    if backend == "mongo":
+        return MongoStore()
+    if backend == "memory":
+        return MemoryStore()
+    raise ValueError(f"Unknown IDEMPOTENCY_STORE {backend!r}")
+
+def _header(scope, name: bytes) -> Optional[str]:
+    for header, value in scope.get("headers", ()):
+        if header == name:
+            return value.decode("latin-1")
+    return None
+
+async def _send_json(send, status_code: int, detail: str):
+    body = json.dumps({"detail": detail}, ensure_ascii=False).encode()
+    await send({"type": "http.response.start", "status": status_code,
+                "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())]})
+    await send({"type": "http.response.body", "body": body})
+
+class IdempotencyMiddleware:
+    """Replays kept responses for requests to `routes` that carry an Idempotency-Key"""
+
+    def __init__(self, app, store: IdempotencyStore, routes, secret_key: str, algorithm: str):
+        self.app = app
+        self.store = store
+        self.routes = set(routes)  # {(method, path)}
+        self.secret_key = secret_key
+        self.algorithm = algorithm
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or (scope["method"], scope["path"]) not in self.routes:
+            await self.app(scope, receive, send)
+            return
+        idempotency_key = _header(scope, b"idempotency-key")
+        company_id = company_from_scope(scope, self.secret_key, self.algorithm) if idempotency_key else None
+        if company_id is None:
+            await self.app(scope, receive, send)
+            return
+        if not idempotency_key.strip() or len(idempotency_key) > IDEMPOTENCY_MAX_KEY_LENGTH:
+            await _send_json(send, 400, "Nieprawidłowy klucz Idempotency-Key")
+            return
+
+        # The body is read here to fingerprint it, then handed to the app unchanged
+        chunks = []
+        while True:
+            message = await receive()
+            if message["type"] == "http.disconnect":
+                return
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        body = b"".join(chunks)
+        key = f"{company_id}:{idempotency_key}"
+        fingerprint = hashlib.sha256(body).hexdigest()
+
+        try:
+            kept = await self.store.begin(key, fingerprint)
+        except IdempotencyConflict as conflict:
+            await _send_json(send, conflict.status_code, conflict.detail)
+            return
+        if kept is not None:
+            status, headers, kept_body = kept
+            await send({"type": "http.response.start", "status": status,
+                        "headers": [(name.encode("latin-1"), value.encode("latin-1")) for name, value in headers]
+                        + [(b"idempotent-replayed", b"true")]})
+            await send({"type": "http.response.body", "body": kept_body})
+            return
+
+        body_sent = False
+
+        async def replay_receive():
+            nonlocal body_sent
+            if not body_sent:
+                body_sent = True
+                return {"type": "http.request", "body": body, "more_body": False}
+            return await receive()
+
+        response = {"status": None, "headers": [], "body": []}
+
+        async def capture_send(message):
+            if message["type"] == "http.response.start":
+                response["status"] = message["status"]
+                response["headers"] = [[name.decode("latin-1"), value.decode("latin-1")]
+                                       for name, value in message.get("headers", ())]
+            elif message["type"] == "http.response.body":
+                response["body"].append(message.get("body", b""))
+            await send(message)
+
+        completed = False
+        try:
+            await self.app(scope, replay_receive, capture_send)
+            if response["status"] is not None and 200 <= response["status"] < 300:
+                await self.store.complete(key, (response["status"], response["headers"], b"".join(response["body"])))
+                completed = True
+        finally:
+            if not completed:
+                await self.store.abandon(key)
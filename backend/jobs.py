@@ -0,0 +1,312 @@
+"""Persistent background jobs for the time tracking system.
+
+Jobs live in the `jobs` collection. Workers claim them with a lease that is
+kept alive by a heartbeat; if a worker dies, its lease runs out and the job is
+picked up again by another worker until it runs out of attempts.
+"""
+from pydantic import BaseModel, Field
+from pymongo.errors import DuplicateKeyError
+from datetime import datetime, timedelta
+from typing import Optional
+import asyncio
+import logging
+import os
+import socket
+import uuid
+
+JOB_WORKERS = int(os.environ.get('JOB_WORKERS', 2))
+JOB_LEASE_SECONDS = int(os.environ.get('JOB_LEASE_SECONDS', 60))
+JOB_HEARTBEAT_SECONDS = int(os.environ.get('JOB_HEARTBEAT_SECONDS', 15))
+JOB_POLL_SECONDS = float(os.environ.get('JOB_POLL_SECONDS', 1))
+JOB_MAX_ATTEMPTS = int(os.environ.get('JOB_MAX_ATTEMPTS', 3))
+JOB_RETRY_DELAY_SECONDS = int(os.environ.get('JOB_RETRY_DELAY_SECONDS', 30))
+JOB_SCHEDULER = os.environ.get('JOB_SCHEDULER', 'true').lower() == 'true'
+JOB_SCHEDULER_TICK_SECONDS = float(os.environ.get('JOB_SCHEDULER_TICK_SECONDS', 30))
+
+logger = logging.getLogger(__name__)
+
+_handlers = {}
+_schedules = {}
+
+def job_handler(job_type: str):
+    """Register an async handler for a job type. The handler receives a JobContext."""
+    def decorator(fn):
+        _handlers[job_type] = fn
+        return fn
+    return decorator
+
+def schedule_job(job_type: str, interval_seconds: float, payload: Optional[dict] = None):
+    """Enqueue a job of this type every interval_seconds, once across all worker processes"""
+    _schedules[job_type] = {"interval_seconds": interval_seconds, "payload": payload or {}}
+
+class Job(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    type: str
+    payload: dict = {}
+    company_id: Optional[str] = None
+    created_by: Optional[str] = None
+    status: str = "queued"  # "queued", "running", "completed" or "failed"
+    progress: dict = {}
+    result: Optional[dict] = None
+    error: Optional[str] = None
+    attempts: int = 0
+    max_attempts: int = JOB_MAX_ATTEMPTS
+    worker_id: Optional[str] = None
+    lease_expires_at: Optional[datetime] = None
+    run_after: datetime = Field(default_factory=datetime.utcnow)
+    created_at: datetime = Field(default_factory=datetime.utcnow)
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class LeaseLost(Exception):
+    """Raised inside a job when another worker has taken over its lease"""
+
+class JobContext:
+    """Handle passed to job handlers for reading the payload and reporting progress"""
+
+    def __init__(self, queue: "JobQueue", job: dict):
+        self.queue = queue
+        self.job = job
+
+    @property
+    def id(self) -> str:
+        return self.job["id"]
+
+    @property
+    def payload(self) -> dict:
+        return self.job.get("payload") or {}
+
+    async def set_progress(self, **fields):
+        await self._update({"$set": {f"progress.{key}": value for key, value in fields.items()}})
+
+    async def increment(self, **counts):
+        await self._update({"$inc": {f"progress.{key}": value for key, value in counts.items()}})
+
+    async def _update(self, update: dict):
+        result = await self.queue.db.jobs.update_one(
+            {"id": self.id, "worker_id": self.queue.worker_id, "status": "running"},
+            update
+        )
+        if result.matched_count == 0:
+            raise LeaseLost(self.id)
+
+class JobQueue:
+    def __init__(self, db, concurrency: int = JOB_WORKERS, lease_seconds: int = JOB_LEASE_SECONDS):
+        self.db = db
+        self.concurrency = concurrency
+        self.lease_seconds = lease_seconds
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._workers = []
+        self._stopping = asyncio.Event()
+
+    async def ensure_indexes(self):
+        await self.db.jobs.create_index("id", unique=True)
+        await self.db.jobs.create_index([("status", 1), ("run_after", 1)])
+        await self.db.jobs.create_index([("status", 1), ("lease_expires_at", 1)])
+        await self.db.jobs.create_index([("type", 1), ("company_id", 1), ("created_at", -1)])
+        await self.db.job_schedules.create_index("job_type", unique=True)
+
+    async def enqueue(
+        self,
+        job_type: str,
+        payload: Optional[dict] = None,
+        company_id: Optional[str] = None,
+        created_by: Optional[str] = None,
+        max_attempts: int = JOB_MAX_ATTEMPTS,
+        progress: Optional[dict] = None
+    ) -> Job:
+        if job_type not in _handlers:
+            raise ValueError(f"Unknown job type: {job_type}")
+        job = Job(
+            type=job_type,
+            payload=payload or {},
+            company_id=company_id,
+            created_by=created_by,
+            max_attempts=max_attempts,
+            progress=progress or {}
+        )
+        await self.db.jobs.insert_one(job.dict())
+        return job
+
+    async def get(self, job_id: str) -> Optional[Job]:
+        job = await self.db.jobs.find_one({"id": job_id})
+        return Job(**job) if job else None
+
+    async def claim(self) -> Optional[dict]:
+        """Atomically take the next runnable job, or one whose worker stopped heartbeating"""
+        now = datetime.utcnow()
+        return await self.db.jobs.find_one_and_update(
+            {
+                "type": {"$in": list(_handlers)},
+                "$or": [
+                    {"status": "queued", "run_after": {"$lte": now}},
+                    {"status": "running", "lease_expires_at": {"$lt": now}}
+                ]
+            },
+            {
+                "$set": {
+                    "status": "running",
+                    "worker_id": self.worker_id,
+                    "lease_expires_at": now + timedelta(seconds=self.lease_seconds),
+                    "started_at": now
+                },
+                "$inc": {"attempts": 1}
+            },
+            sort=[("run_after", 1)],
+            return_document=True
+        )
+
+    async def _finish(self, job: dict, fields: dict):
+        await self.db.jobs.update_one(
+            {"id": job["id"], "worker_id": self.worker_id},
+            {"$set": {**fields, "lease_expires_at": None}}
+        )
+
+    async def _release(self, job: dict):
+        await self.db.jobs.update_one(
+            {"id": job["id"], "worker_id": self.worker_id, "status": "running"},
+            {
+                "$set": {"status": "queued", "worker_id": None, "lease_expires_at": None},
+                "$inc": {"attempts": -1}
+            }
+        )
+
+    async def _heartbeat(self, job: dict, task: asyncio.Task):
+        while True:
+            await asyncio.sleep(JOB_HEARTBEAT_SECONDS)
+            result = await self.db.jobs.update_one(
+                {"id": job["id"], "worker_id": self.worker_id, "status": "running"},
+                {"$set": {"lease_expires_at": datetime.utcnow() + timedelta(seconds=self.lease_seconds)}}
+            )
+            if result.matched_count == 0:
+                logger.warning("Lost lease on job %s, cancelling", job["id"])
+                task.cancel()
+                return
+
+    async def run_job(self, job: dict):
+        if job["attempts"] > job["max_attempts"]:
+            await self._finish(job, {
+                "status": "failed",
+                "error": "Job exceeded its attempts after its worker stopped responding",
+                "finished_at": datetime.utcnow()
+            })
+            return
+
+        handler = _handlers[job["type"]]
+        task = asyncio.create_task(handler(JobContext(self, job)))
+        heartbeat = asyncio.create_task(self._heartbeat(job, task))
+        try:
+            result = await task
+        except (asyncio.CancelledError, LeaseLost):
+            # Either we are shutting down or another worker owns the job now
+            if self._stopping.is_set():
+                # Hand the job back right away instead of waiting for the lease to lapse
+                await asyncio.shield(self._release(job))
+                raise
+            return
+        except Exception as e:
+            logger.exception("Job %s (%s) failed", job["id"], job["type"])
+            if job["attempts"] < job["max_attempts"]:
+                await self._finish(job, {
+                    "status": "queued",
+                    "error": str(e),
+                    "run_after": datetime.utcnow() + timedelta(seconds=JOB_RETRY_DELAY_SECONDS * job["attempts"])
+                })
+            else:
+                await self._finish(job, {
+                    "status": "failed",
+                    "error": str(e),
+                    "finished_at": datetime.utcnow()
+                })
+            return
+        finally:
+            heartbeat.cancel()
+
+        await self._finish(job, {
+            "status": "completed",
+            "result": result if isinstance(result, dict) else {"value": result},
+            "error": None,
+            "finished_at": datetime.utcnow()
+        })
+
+    async def _worker_loop(self):
+        while not self._stopping.is_set():
+            try:
+                job = await self.claim()
+                if job:
+                    await self.run_job(job)
+                    continue
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job worker error")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=JOB_POLL_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    async def run_due_schedules(self):
+        """Enqueue every scheduled job whose time has come.
+
+        The schedule document is advanced with a conditional update, so when
+        several processes tick at once only one of them enqueues the job.
+        """
+        now = datetime.utcnow()
+        for job_type, schedule in _schedules.items():
+            try:
+                await self.db.job_schedules.update_one(
+                    {"job_type": job_type},
+                    {"$setOnInsert": {"next_run_at": now}},
+                    upsert=True
+                )
+            except DuplicateKeyError:
+                pass  # Another process created the schedule first
+            claimed = await self.db.job_schedules.find_one_and_update(
+                {"job_type": job_type, "next_run_at": {"$lte": now}},
+                {"$set": {
+                    "next_run_at": now + timedelta(seconds=schedule["interval_seconds"]),
+                    "last_run_at": now
+                }}
+            )
+            if claimed:
+                await self.enqueue(job_type, payload=schedule["payload"], max_attempts=1)
+
+    async def _scheduler_loop(self):
+        while not self._stopping.is_set():
+            try:
+                await self.run_due_schedules()
+            except asyncio.CancelledError:
+                raise
+            except Exception:
+                logger.exception("Job scheduler error")
+            try:
+                await asyncio.wait_for(self._stopping.wait(), timeout=JOB_SCHEDULER_TICK_SECONDS)
+            except asyncio.TimeoutError:
+                pass
+
+    def start(self):
+        self._stopping.clear()
+        for _ in range(self.concurrency):
+            self._workers.append(asyncio.create_task(self._worker_loop()))
+        if JOB_SCHEDULER and _schedules:
+            self._workers.append(asyncio.create_task(self._scheduler_loop()))
+        logger.info("Started %d job workers as %s", self.concurrency, self.worker_id)
+
+    async def stop(self, timeout: float = 10):
+        """Stop claiming jobs and give running ones `timeout` seconds to finish"""
+        self._stopping.set()
+        if not self._workers:
+            return
+        done, pending = await asyncio.wait(self._workers, timeout=timeout)
+        for task in pending:
+            task.cancel()
+        await asyncio.gather(*pending, return_exceptions=True)
+        self._workers = []
+
+    def request_stop(self):
+        self._stopping.set()
+
+    async def run_forever(self):
+        self.start()
+        await self._stopping.wait()
+        await self.stop()
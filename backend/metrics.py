@@ -0,0 +1,227 @@
+"""In-process metrics exposed in Prometheus text format.
+
+`MetricsMiddleware` times every request by route template and counts the
+MongoDB commands it issues; `MongoCommandMetrics` is the pymongo command
+listener that does the counting. Motor runs commands on executor threads with
+a copy of the caller's context, so the listener finds the request it works for
+through the `current_request` context variable.
+"""
+from abc import ABC, abstractmethod
+from contextvars import ContextVar
+from pymongo import monitoring
+from typing import Dict, List, Optional, Sequence, Tuple
+import threading
+import time
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+DB_OPERATION_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 50, 100, 250)
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: Optional[Tuple[str, str]] = None) -> str:
+    pairs = list(zip(names, values))
+    if extra:
+        pairs.append(extra)
+    if not pairs:
+        return ""
+    escaped = (
+        '%s="%s"' % (name, str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n"))
+        for name, value in pairs
+    )
+    return "{%s}" % ",".join(escaped)
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(value) if isinstance(value, float) else str(value)
+
+class _Metric(ABC):
+    type = ""
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = ()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._lock = threading.Lock()
+        self._values: Dict[Tuple[str, ...], object] = {}
+
+    @abstractmethod
+    def _samples(self) -> List[str]:
+        """Sample lines of the metric; called with the lock held"""
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            lines.extend(self._samples())
+        return "\n".join(lines)
+
+class Counter(_Metric):
+    type = "counter"
+
+    def inc(self, *label_values: str, amount: float = 1):
+        with self._lock:
+            self._values[label_values] = self._values.get(label_values, 0) + amount
+
+    def _samples(self):
+        return [
+            f"{self.name}{_format_labels(self.labels, label_values)} {_format_value(value)}"
+            for label_values, value in sorted(self._values.items())
+        ]
+
+class Gauge(Counter):
+    type = "gauge"
+
+    def dec(self, *label_values: str, amount: float = 1):
+        self.inc(*label_values, amount=-amount)
+
+    def set(self, *label_values: str, value: float):
+        with self._lock:
+            self._values[label_values] = value
+
+class Histogram(_Metric):
+    type = "histogram"
+
+    def __init__(self, name: str, help: str, labels: Sequence[str] = (), buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(sorted(buckets)) + (float("inf"),)
+
+    def observe(self, *label_values: str, value: float):
+        with self._lock:
+            counts, total = self._values.get(label_values, ([0] * len(self.buckets), 0.0))
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            self._values[label_values] = (counts, total + value)
+
+    def _samples(self):
+        samples = []
+        for label_values, (counts, total) in sorted(self._values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, counts):
+                cumulative += count
+                labels = _format_labels(self.labels, label_values, ("le", _format_value(bound)))
+                samples.append(f"{self.name}_bucket{labels} {cumulative}")
+            labels = _format_labels(self.labels, label_values)
+            samples.append(f"{self.name}_sum{labels} {_format_value(total)}")
+            samples.append(f"{self.name}_count{labels} {cumulative}")
+        return samples
+
+class Registry:
+    def __init__(self):
+        self._metrics: List[_Metric] = []
+
+    def register(self, metric: _Metric) -> _Metric:
+        self._metrics.append(metric)
+        return metric
+
+    def render(self) -> str:
+        return "\n".join(metric.render() for metric in self._metrics) + "\n"
+
+registry = Registry()
+
+http_requests_total = registry.register(Counter(
+    "http_requests_total", "HTTP requests by route and status code", ("method", "route", "status")
+))
+http_request_duration_seconds = registry.register(Histogram(
+    "http_request_duration_seconds", "HTTP request latency by route", ("method", "route")
+))
+http_requests_in_flight = registry.register(Gauge(
+    "http_requests_in_flight", "HTTP requests currently being served", ("method",)
+))
+http_request_db_operations = registry.register(Histogram(
+    "http_request_db_operations", "MongoDB commands issued per HTTP request", ("method", "route"),
+    buckets=DB_OPERATION_BUCKETS
+))
+http_request_db_seconds = registry.register(Histogram(
+    "http_request_db_seconds", "Time spent in MongoDB commands per HTTP request", ("method", "route")
+))
+mongo_commands_total = registry.register(Counter(
+    "mongo_commands_total", "MongoDB commands by name and outcome", ("command", "outcome")
+))
+mongo_command_duration_seconds = registry.register(Histogram(
+    "mongo_command_duration_seconds", "MongoDB command latency", ("command",)
+))
+
+class RequestStats:
+    """Database work attributed to one request; shared with executor threads via the context"""
+    __slots__ = ("method", "scope", "company_id", "db_operations", "db_seconds")
+
+    def __init__(self, method: str, scope: dict):
+        self.method = method
+        self.scope = scope
+        self.company_id = None  # Filled in once the request is authenticated
+        self.db_operations = 0
+        self.db_seconds = 0.0
+
+    @property
+    def route(self) -> str:
+        return route_template(self.scope)
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar("current_request", default=None)
+
+def tag_request(company_id: Optional[str]):
+    """Attach the authenticated company to the current request's stats"""
+    stats = current_request.get()
+    if stats is not None:
+        stats.company_id = company_id
+
+class MongoCommandMetrics(monitoring.CommandListener):
+    """Count and time every MongoDB command, attributing it to the current request"""
+
+    def started(self, event):
+        pass
+
+    def _record(self, event, outcome: str):
+        seconds = event.duration_micros / 1_000_000
+        mongo_commands_total.inc(event.command_name, outcome)
+        mongo_command_duration_seconds.observe(event.command_name, value=seconds)
+        stats = current_request.get()
+        if stats is not None:
+            stats.db_operations += 1
+            stats.db_seconds += seconds
+
+    def succeeded(self, event):
+        self._record(event, "success")
+
+    def failed(self, event):
+        self._record(event, "failure")
+
+command_listener = MongoCommandMetrics()
+
+def route_template(scope) -> str:
+    """The matched route's path template, so /api/employees/{employee_id} is one series"""
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        stats = RequestStats(method, scope)
+        token = current_request.set(stats)
+        status_code = 500
+
+        async def send_wrapper(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+            await send(message)
+
+        http_requests_in_flight.inc(method)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_requests_in_flight.dec(method)
+            current_request.reset(token)
+            route = stats.route
+            http_requests_total.inc(method, route, str(status_code))
+            http_request_duration_seconds.observe(method, route, value=elapsed)
+            http_request_db_operations.observe(method, route, value=stats.db_operations)
+            http_request_db_seconds.observe(method, route, value=stats.db_seconds)
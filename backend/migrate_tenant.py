@@ -0,0 +1,69 @@
+"""Move a company between the shared database and a dedicated one, online.
+
+The company keeps working during the copy; writes to it are refused with 503
+for the short freeze before the switch (see tenancy.py). Running API workers
+pick up the new placement within TENANT_CACHE_SECONDS.
+
+    python migrate_tenant.py <company_id> --to dedicated
+    python migrate_tenant.py <company_id> --to shared
+    python migrate_tenant.py --list
+"""
+import argparse
+import asyncio
+import json
+import logging
+import sys
+
+import server
+import tenancy
+
+async def list_tenants():
+    entries = await server.db.tenants.find({}, {"_id": 0}).sort("company_id", 1).to_list(None)
+    for entry in entries:
+        print(f"{entry['company_id']}  {entry.get('placement', 'shared'):9}  {entry.get('state', 'active'):8}  "
+              f"{entry.get('database') or server.DB_NAME}")
+    if not entries:
+        print("Every company is in the shared database")
+
+async def main(args):
+    server.connect()
+    try:
+        if args.list:
+            await list_tenants()
+            return 0
+        await server.ensure_indexes()
+        result = await tenancy.migrate_company(
+            server.db,
+            args.company_id,
+            args.to,
+            database_name=args.database,
+            batch_size=args.batch_size,
+            propagation_seconds=args.propagation_seconds,
+            keep_source=args.keep_source,
+            report=lambda message: print(f"  {message}", flush=True)
+        )
+    except tenancy.MigrationError as exc:
+        print(f"❌ {exc}")
+        return 1
+    finally:
+        server.client.close()
+    print(json.dumps(result, indent=2, default=str))
+    return 0
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Move a company's data between shared and dedicated storage")
+    parser.add_argument("company_id", nargs="?")
+    parser.add_argument("--to", choices=["dedicated", "shared"])
+    parser.add_argument("--database", help="Name of the dedicated database (default: <DB_NAME>_tenant_<id>)")
+    parser.add_argument("--batch-size", type=int, default=tenancy.TENANT_MIGRATION_BATCH_SIZE)
+    parser.add_argument("--propagation-seconds", type=float,
+                        help="How long to wait for API workers to see a registry change "
+                             "(default: TENANT_CACHE_SECONDS + TENANT_FREEZE_GRACE_SECONDS)")
+    parser.add_argument("--keep-source", action="store_true",
+                        help="Leave the copy in the source database in place after the switch")
+    parser.add_argument("--list", action="store_true", help="List the tenant registry and exit")
+    args = parser.parse_args()
+    if not args.list and not (args.company_id and args.to):
+        parser.error("company_id and --to are required")
+    logging.basicConfig(level=logging.INFO)
+    sys.exit(asyncio.run(main(args)))
@@ -0,0 +1,146 @@
+"""Password hashing with configurable schemes and costs.
+
+PASSWORD_SCHEMES lists the passlib schemes a login accepts, as
+`bcrypt,pbkdf2_sha256`; new hashes use the first and the rest are only
+verified. The cost of each scheme comes from PASSWORD_<SCHEME>_ROUNDS (bcrypt's
+log2 cost, PBKDF2 iterations, Argon2 time cost; argon2 also takes
+PASSWORD_ARGON2_MEMORY_COST in KiB and needs argon2-cffi). A stored hash in
+another scheme or with another cost, higher or lower, is replaced on the next
+successful login, so a change of configuration reaches every account as people
+log in. `python calibrate_passwords.py` picks a cost for a target verify time
+on the machine it runs on.
+
+Hashes are made and checked in a pool of PASSWORD_HASH_WORKERS threads; bcrypt,
+PBKDF2 and Argon2 release the GIL, so logins do not stall the event loop and
+the pool caps how many cores they take at once. passlib loads on first use.
+"""
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from typing import Optional, Tuple
+import asyncio
+import os
+import time
+
+import metrics
+
+# passlib's own defaults, so hashes made before the schemes were configurable stay current
+DEFAULT_ROUNDS = {"bcrypt": 12, "pbkdf2_sha256": 29000, "argon2": 2}
+# Costs that double the work per step; the others grow linearly
+LOG2_ROUNDS = {"bcrypt"}
+
+PASSWORD_SCHEMES = [scheme.strip() for scheme in os.environ.get('PASSWORD_SCHEMES', 'bcrypt').split(',')
+                    if scheme.strip()]
+for _scheme in PASSWORD_SCHEMES:
+    if _scheme not in DEFAULT_ROUNDS:
+        raise ValueError(f"Unsupported password scheme {_scheme!r}; choose from {', '.join(DEFAULT_ROUNDS)}")
+PASSWORD_ROUNDS = {scheme: int(os.environ.get(f'PASSWORD_{scheme.upper()}_ROUNDS', DEFAULT_ROUNDS[scheme]))
+                   for scheme in PASSWORD_SCHEMES}
+PASSWORD_ARGON2_MEMORY_COST = int(os.environ.get('PASSWORD_ARGON2_MEMORY_COST', 512))
+PASSWORD_REHASH_ON_LOGIN = os.environ.get('PASSWORD_REHASH_ON_LOGIN', 'true').lower() == 'true'
+PASSWORD_HASH_WORKERS = int(os.environ.get('PASSWORD_HASH_WORKERS', os.cpu_count() or 1))
+
+password_rehashes_total = metrics.registry.register(metrics.Counter(
+    "password_rehashes_total", "Stored password hashes replaced at login, by the scheme they had", ("scheme",)
+))
+
+_pool: Optional[ThreadPoolExecutor] = None
+
+def _settings(scheme: str, rounds: int) -> dict:
+    # min and max pin the cost, so passlib flags hashes made with any other one as outdated
+    settings = {f"{scheme}__{key}": rounds for key in ("default_rounds", "min_rounds", "max_rounds")}
+    if scheme == "argon2":
+        settings["argon2__memory_cost"] = PASSWORD_ARGON2_MEMORY_COST
+    return settings
+
+@lru_cache(maxsize=None)
+def context():
+    from passlib.context import CryptContext
+
+    settings = {}
+    for scheme in PASSWORD_SCHEMES:
+        settings.update(_settings(scheme, PASSWORD_ROUNDS[scheme]))
+    return CryptContext(schemes=PASSWORD_SCHEMES, deprecated="auto", **settings)
+
+def hash_password(password: str) -> str:
+    return context().hash(password)
+
+def verify_password(password: str, password_hash: str) -> bool:
+    return context().verify(password, password_hash)
+
+def verify_and_update(password: str, password_hash: str) -> Tuple[bool, Optional[str]]:
+    """Whether the password matches, and a current hash of it when the stored one is outdated"""
+    if not PASSWORD_REHASH_ON_LOGIN:
+        return context().verify(password, password_hash), None
+    return context().verify_and_update(password, password_hash)
+
+def get_pool() -> ThreadPoolExecutor:
+    global _pool
+    if _pool is None:
+        _pool = ThreadPoolExecutor(max_workers=PASSWORD_HASH_WORKERS, thread_name_prefix="passwords")
+    return _pool
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+async def hash_password_async(password: str) -> str:
+    return await asyncio.get_running_loop().run_in_executor(get_pool(), hash_password, password)
+
+async def check_password(collection, document: dict, password: str) -> bool:
+    """Verify a login against a stored document and store a current hash if its own is outdated"""
+    ok, new_hash = await asyncio.get_running_loop().run_in_executor(
+        get_pool(), verify_and_update, password, document["password_hash"]
+    )
+    if ok and new_hash:
+        # Conditional on the old hash, so a password changed meanwhile is not overwritten
+        await collection.update_one(
+            {"id": document["id"], "password_hash": document["password_hash"]},
+            {"$set": {"password_hash": new_hash}}
+        )
+        password_rehashes_total.inc(context().identify(document["password_hash"]))
+    return ok
+
+def scheme_context(scheme: str, rounds: int):
+    """A context for one scheme at one cost, for calibration and benchmarks"""
+    from passlib.context import CryptContext
+
+    return CryptContext(schemes=[scheme], **_settings(scheme, rounds))
+
+def verify_seconds(scheme: str, rounds: int, samples: int = 3) -> float:
+    """The fastest of `samples` verifies of a hash made with this scheme and cost"""
+    handler = scheme_context(scheme, rounds)
+    password_hash = handler.hash("calibration")
+    timings = []
+    for _ in range(samples):
+        started = time.perf_counter()
+        handler.verify("calibration", password_hash)
+        timings.append(time.perf_counter() - started)
+    return min(timings)
+
+def calibrate(scheme: str, target_ms: float, samples: int = 3) -> Tuple[int, float]:
+    """The highest cost whose verify takes no longer than target_ms here, and its verify time in ms"""
+    if scheme not in DEFAULT_ROUNDS:
+        raise ValueError(f"Unsupported password scheme {scheme!r}")
+    target = target_ms / 1000
+    if scheme in LOG2_ROUNDS:
+        # bcrypt's cost is 4 to 31; every step doubles the time, so walk up until the target is passed
+        rounds, seconds = 4, verify_seconds(scheme, 4, samples)
+        while rounds < 31:
+            next_seconds = verify_seconds(scheme, rounds + 1, samples)
+            if next_seconds > target:
+                break
+            rounds, seconds = rounds + 1, next_seconds
+        return rounds, seconds * 1000
+
+    # Linear costs: scale from a measured sample, then step back while the estimate overshoots
+    base = DEFAULT_ROUNDS[scheme]
+    rounds = max(1, int(base * target / verify_seconds(scheme, base, samples)))
+    if scheme == "pbkdf2_sha256":
+        rounds = max(1000, rounds // 1000 * 1000)
+    seconds = verify_seconds(scheme, rounds, samples)
+    while seconds > target and rounds > 1:
+        rounds = max(1, int(rounds * target / seconds * 0.95))
+        seconds = verify_seconds(scheme, rounds, samples)
+    return rounds, seconds * 1000
@@ -0,0 +1,132 @@
+"""Per-company retention of attendance data.
+
+Companies with `retention_years` set have time entries older than that
+purged, both from `time_entries` and from the monthly archive buckets. Purging
+walks the (company_id, date) indexes in small batches and sleeps between them
+in proportion to how long each batch took, so it only ever uses a fraction of
+the database's time.
+
+Time entries carry their company_id. `settle_unowned` gives the entries and
+buckets written without one the company of their employee, and purges those
+whose employee no longer exists, which no company's purge would reach.
+"""
+from datetime import datetime
+from typing import List, Optional
+import asyncio
+import os
+import time
+
+RETENTION_INTERVAL_SECONDS = int(os.environ.get('RETENTION_INTERVAL_SECONDS', 24 * 60 * 60))
+RETENTION_BATCH_SIZE = int(os.environ.get('RETENTION_BATCH_SIZE', 500))
+# Fraction of wall time the purger may keep the database busy
+RETENTION_DUTY_CYCLE = float(os.environ.get('RETENTION_DUTY_CYCLE', 0.25))
+RETENTION_MIN_PAUSE_SECONDS = float(os.environ.get('RETENTION_MIN_PAUSE_SECONDS', 0.05))
+
+def retention_cutoff(retention_years: int, now: Optional[datetime] = None) -> str:
+    """Entries dated before this YYYY-MM-DD day are past retention"""
+    now = now or datetime.now()
+    try:
+        cutoff = now.replace(year=now.year - retention_years)
+    except ValueError:
+        # 29 February in a year that has none
+        cutoff = now.replace(year=now.year - retention_years, day=28)
+    return cutoff.strftime("%Y-%m-%d")
+
+async def _throttle(started: float):
+    elapsed = time.monotonic() - started
+    await asyncio.sleep(max(RETENTION_MIN_PAUSE_SECONDS, elapsed * (1 / RETENTION_DUTY_CYCLE - 1)))
+
+async def ensure_indexes(db):
+    await db.time_entries.create_index([("company_id", 1), ("date", 1)])
+
+async def settle_unowned(db, on_batch=None, exclude_employee_ids: Optional[List[str]] = None) -> dict:
+    """Stamp company_id on entries and buckets written without it; purge those of deleted employees"""
+    stats = {"entries_stamped": 0, "buckets_stamped": 0, "orphan_entries_purged": 0, "orphan_buckets_deleted": 0}
+    # Missing and null company_id are both indexed as null, so these reads use the company_id indexes
+    query = {"company_id": None}
+    if exclude_employee_ids:
+        query["employee_id"] = {"$nin": exclude_employee_ids}
+
+    for collection, stamped_key, purged_key in (
+        (db.time_entries, "entries_stamped", "orphan_entries_purged"),
+        (db.time_entries_archive, "buckets_stamped", "orphan_buckets_deleted"),
+    ):
+        while True:
+            batch_started = time.monotonic()
+            documents = await collection.find(query, {"_id": 1, "employee_id": 1}).limit(
+                RETENTION_BATCH_SIZE
+            ).to_list(RETENTION_BATCH_SIZE)
+            if not documents:
+                break
+            employees = await db.employees.find(
+                {"id": {"$in": list({document["employee_id"] for document in documents})}},
+                {"_id": 0, "id": 1, "company_id": 1}
+            ).to_list(None)
+            company_by_employee = {employee["id"]: employee["company_id"] for employee in employees}
+
+            counts = {stamped_key: 0, purged_key: 0}
+            orphans = [document["_id"] for document in documents if document["employee_id"] not in company_by_employee]
+            if orphans:
+                counts[purged_key] = (await collection.delete_many({"_id": {"$in": orphans}})).deleted_count
+            for employee_id, company_id in company_by_employee.items():
+                result = await collection.update_many(
+                    {"employee_id": employee_id, "company_id": None}, {"$set": {"company_id": company_id}}
+                )
+                counts[stamped_key] += result.modified_count
+            for key, value in counts.items():
+                stats[key] += value
+            if on_batch:
+                await on_batch(**counts)
+            await _throttle(batch_started)
+    return stats
+
+async def purge_company(db, company_id: str, cutoff: str, on_batch=None) -> dict:
+    """Delete every time entry of a company dated before cutoff, hot and archived"""
+    stats = {"cutoff": cutoff, "entries_purged": 0, "archived_entries_purged": 0, "buckets_deleted": 0}
+    started_at = time.monotonic()
+
+    while True:
+        batch_started = time.monotonic()
+        expired = await db.time_entries.find(
+            {"company_id": company_id, "date": {"$lt": cutoff}}, {"_id": 1}
+        ).limit(RETENTION_BATCH_SIZE).to_list(RETENTION_BATCH_SIZE)
+        if not expired:
+            break
+        result = await db.time_entries.delete_many({"_id": {"$in": [entry["_id"] for entry in expired]}})
+        stats["entries_purged"] += result.deleted_count
+        if on_batch:
+            await on_batch(entries_purged=result.deleted_count)
+        await _throttle(batch_started)
+
+    # Whole archived months before the cutoff month go bucket by bucket
+    cutoff_month = cutoff[:7]
+    while True:
+        batch_started = time.monotonic()
+        buckets = await db.time_entries_archive.find(
+            {"company_id": company_id, "month": {"$lt": cutoff_month}}, {"_id": 1, "entries": 1}
+        ).limit(RETENTION_BATCH_SIZE).to_list(RETENTION_BATCH_SIZE)
+        if not buckets:
+            break
+        result = await db.time_entries_archive.delete_many({"_id": {"$in": [bucket["_id"] for bucket in buckets]}})
+        archived_entries = sum(len(bucket.get("entries", {})) for bucket in buckets)
+        stats["buckets_deleted"] += result.deleted_count
+        stats["archived_entries_purged"] += archived_entries
+        if on_batch:
+            await on_batch(buckets_deleted=result.deleted_count, archived_entries_purged=archived_entries)
+        await _throttle(batch_started)
+
+    # The cutoff month itself is only partly expired
+    async for bucket in db.time_entries_archive.find({"company_id": company_id, "month": cutoff_month}):
+        expired_keys = [
+            entry_id for entry_id, entry in bucket.get("entries", {}).items() if entry["date"] < cutoff
+        ]
+        if expired_keys:
+            await db.time_entries_archive.update_one(
+                {"_id": bucket["_id"]},
+                {"$unset": {f"entries.{entry_id}": "" for entry_id in expired_keys},
+                 "$pull": {"entry_ids": {"$in": expired_keys}}}
+            )
+            stats["archived_entries_purged"] += len(expired_keys)
+
+    stats["duration_seconds"] = round(time.monotonic() - started_at, 2)
+    return stats
@@ -0,0 +1,139 @@
+"""Signed, versioned employee rosters for kiosks.
+
+A kiosk keeps the roster of its company, the badge key and number of every
+employee with the name to show, so it can greet a scanned employee at once
+and still recognise badges while the network is briefly down. The server
+still decides every scan.
+
+Every change to an employee's roster fields takes the next value of the
+company's `roster_version` counter. A kiosk sends the version it has and gets
+only the employees changed since then, plus tombstones (`roster_tombstones`)
+for the employees deleted since then. Tombstones are pruned after
+ROSTER_TOMBSTONE_DAYS; a kiosk whose version is older than the newest pruned
+tombstone (`roster_min_version`) gets the full roster again. Deltas also
+repeat the last ROSTER_DELTA_OVERLAP versions, so a change stamped by a
+request that was still running when the previous delta was read is not
+missed; applying a change twice is harmless.
+
+Responses are signed with Ed25519 (ROSTER_SIGNING_KEY, a base64 32-byte
+seed; derived from the JWT secret when unset). The signature of the exact
+response body is in the `X-Roster-Signature` header, and kiosks get the
+public key from GET /api/kiosk/roster/key.
+"""
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Optional
+import base64
+import hashlib
+import json
+import os
+
+from pymongo import ReturnDocument
+
+import badges
+
+ROSTER_TOMBSTONE_DAYS = int(os.environ.get('ROSTER_TOMBSTONE_DAYS', 30))
+ROSTER_DELTA_OVERLAP = int(os.environ.get('ROSTER_DELTA_OVERLAP', 8))
+ROSTER_PRUNE_INTERVAL_SECONDS = int(os.environ.get('ROSTER_PRUNE_INTERVAL_SECONDS', 24 * 60 * 60))
+ROSTER_FIELDS = ("name", "surname", "number")
+
+@lru_cache(maxsize=None)
+def signing_key():
+    from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
+
+    seed = os.environ.get('ROSTER_SIGNING_KEY')
+    if seed:
+        seed = base64.b64decode(seed)
+    else:
+        jwt_secret = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production')
+        seed = hashlib.sha256(jwt_secret.encode() + b"kiosk-roster").digest()
+    return Ed25519PrivateKey.from_private_bytes(seed)
+
+def public_key() -> str:
+    from cryptography.hazmat.primitives.serialization import Encoding, PublicFormat
+
+    raw = signing_key().public_key().public_bytes(Encoding.Raw, PublicFormat.Raw)
+    return base64.b64encode(raw).decode()
+
+def sign(body: bytes) -> str:
+    return base64.b64encode(signing_key().sign(body)).decode()
+
+async def ensure_indexes(db):
+    """Indexes in a tenant database; the version counters live on the shared companies collection"""
+    await db.employees.create_index([("company_id", 1), ("roster_version", 1)])
+    await db.roster_tombstones.create_index([("company_id", 1), ("roster_version", 1)])
+    await db.roster_tombstones.create_index("deleted_at")
+
+async def next_version(db, company_id: str) -> int:
+    company = await db.companies.find_one_and_update(
+        {"id": company_id}, {"$inc": {"roster_version": 1}},
+        projection={"_id": 0, "roster_version": 1}, return_document=ReturnDocument.AFTER
+    )
+    return company["roster_version"] if company else 0
+
+def changes_roster(update_data: dict) -> bool:
+    return any(field in update_data for field in ROSTER_FIELDS)
+
+async def record_removal(db, tenant_db, employee: dict):
+    """Leave a tombstone so kiosks drop a deleted employee with their next delta"""
+    await tenant_db.roster_tombstones.insert_one({
+        "company_id": employee["company_id"],
+        "key": badges.badge_key(employee["company_id"], employee["id"]),
+        "roster_version": await next_version(db, employee["company_id"]),
+        "deleted_at": datetime.utcnow(),
+    })
+
+def _entry(employee: dict) -> dict:
+    return {
+        "key": badges.badge_key(employee["company_id"], employee["id"]),
+        "number": employee["number"],
+        "name": f"{employee['name']} {employee['surname']}",
+    }
+
+async def roster(db, tenant_db, company_id: str, since: Optional[int] = None) -> dict:
+    """The company's roster, or the changes after version `since`"""
+    # The version is read first: anything stamped later is in this response or the next one
+    company = await db.companies.find_one(
+        {"id": company_id}, {"_id": 0, "roster_version": 1, "roster_min_version": 1}
+    ) or {}
+    version = company.get("roster_version", 0)
+    full = since is None or since < company.get("roster_min_version", 0) or since > version
+    projection = {"_id": 0, "id": 1, "company_id": 1, "name": 1, "surname": 1, "number": 1}
+
+    if full:
+        employees = await tenant_db.employees.find({"company_id": company_id}, projection).to_list(None)
+        removed = []
+    else:
+        changed_since = {"$gt": since - ROSTER_DELTA_OVERLAP}
+        employees = await tenant_db.employees.find(
+            {"company_id": company_id, "roster_version": changed_since}, projection
+        ).to_list(None)
+        removed = await tenant_db.roster_tombstones.distinct(
+            "key", {"company_id": company_id, "roster_version": changed_since}
+        )
+    return {
+        "company_id": company_id,
+        "version": version,
+        "full": full,
+        "employees": [_entry(employee) for employee in employees],
+        "removed": removed,
+        "generated_at": datetime.utcnow().isoformat(),
+    }
+
+def encode(roster_data: dict) -> bytes:
+    return json.dumps(roster_data, ensure_ascii=False, separators=(",", ":")).encode()
+
+async def prune_tombstones(db, tenant_db, now: Optional[datetime] = None) -> int:
+    """Drop tombstones older than ROSTER_TOMBSTONE_DAYS; kiosks older than them resync in full"""
+    cutoff = (now or datetime.utcnow()) - timedelta(days=ROSTER_TOMBSTONE_DAYS)
+    expired = await tenant_db.roster_tombstones.aggregate([
+        {"$match": {"deleted_at": {"$lt": cutoff}}},
+        {"$group": {"_id": "$company_id", "roster_version": {"$max": "$roster_version"}}},
+    ]).to_list(None)
+    for company in expired:
+        # Raised before the tombstones go, so no kiosk is ever told a delta is complete without them
+        await db.companies.update_one(
+            {"id": company["_id"]}, {"$max": {"roster_min_version": company["roster_version"]}}
+        )
+    result = await tenant_db.roster_tombstones.delete_many({"deleted_at": {"$lt": cutoff}})
+    return result.deleted_count
@@ -0,0 +1,142 @@
+"""Employee search: prefix and fuzzy matching on name, surname, number and position.
+
+Each employee document carries two derived, indexed arrays:
+
+- `search_keys`: the normalized words of its searchable fields (lowercase, no
+  Polish diacritics), matched by anchored regexes, which MongoDB turns into
+  index range scans on (company_id, search_keys).
+- `search_grams`: the trigrams of those words, looked up with $in on
+  (company_id, search_grams) when prefix matching finds too little, so typos
+  still find candidates ("kowlaski" -> "Kowalski").
+
+Candidates are capped at SEARCH_CANDIDATE_LIMIT and ranked in Python.
+
+Both arrays are stamped with `search_version`; the backfill finds the employees
+still on another version (or none) through its index, and bumping
+SEARCH_VERSION after a change to the normalization recomputes every employee.
+"""
+from pymongo import UpdateOne
+from typing import Optional
+import os
+import re
+import unicodedata
+
+SEARCH_FIELDS = ("surname", "name", "number", "position")
+SEARCH_VERSION = 1
+# Rank bonus per field for a whole-word or prefix hit; surnames are what people type
+FIELD_WEIGHTS = {"surname": 4, "name": 3, "number": 3, "position": 1}
+SEARCH_CANDIDATE_LIMIT = int(os.environ.get('SEARCH_CANDIDATE_LIMIT', 500))
+SEARCH_MIN_SIMILARITY = float(os.environ.get('SEARCH_MIN_SIMILARITY', 0.3))
+SEARCH_BACKFILL_BATCH_SIZE = int(os.environ.get('SEARCH_BACKFILL_BATCH_SIZE', 500))
+
+# Letters NFKD does not decompose into a base letter and a combining mark
+TRANSLITERATION = str.maketrans({"ł": "l", "Ł": "L", "ß": "ss", "ø": "o", "Ø": "O"})
+PROJECTION = {"_id": 0, "id": 1, "name": 1, "surname": 1, "number": 1, "position": 1}
+
+def normalize(text: Optional[str]) -> str:
+    decomposed = unicodedata.normalize("NFKD", (text or "").translate(TRANSLITERATION))
+    stripped = "".join(char for char in decomposed if not unicodedata.combining(char))
+    return " ".join(re.findall(r"\w+", stripped.lower()))
+
+def words(text: Optional[str]) -> list:
+    return normalize(text).split()
+
+def trigrams(word: str) -> set:
+    padded = f" {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def search_fields(employee: dict) -> dict:
+    """The derived search arrays for an employee document (or its pending update)"""
+    keys = []
+    for field in SEARCH_FIELDS:
+        for word in words(employee.get(field)):
+            if word not in keys:
+                keys.append(word)
+    grams = sorted(set().union(*(trigrams(word) for word in keys))) if keys else []
+    return {"search_keys": keys, "search_grams": grams, "search_version": SEARCH_VERSION}
+
+async def ensure_indexes(db):
+    await db.employees.create_index([("company_id", 1), ("search_keys", 1)])
+    await db.employees.create_index([("company_id", 1), ("search_grams", 1)])
+    # $ne on a single-field index scans only the keys around the current version
+    await db.employees.create_index("search_version")
+
+def score(employee: dict, terms: list) -> float:
+    """Rank a candidate: whole words beat prefixes beat trigram similarity, weighted by field"""
+    field_words = [(field, words(employee.get(field))) for field in SEARCH_FIELDS]
+    total = 0.0
+    for term in terms:
+        best = 0.0
+        term_grams = trigrams(term)
+        for field, field_word_list in field_words:
+            for word in field_word_list:
+                if word == term:
+                    best = max(best, 2.0 * FIELD_WEIGHTS[field])
+                elif word.startswith(term):
+                    best = max(best, 1.0 * FIELD_WEIGHTS[field])
+                else:
+                    word_grams = trigrams(word)
+                    similarity = len(term_grams & word_grams) / len(term_grams | word_grams)
+                    if similarity >= SEARCH_MIN_SIMILARITY:
+                        best = max(best, similarity * FIELD_WEIGHTS[field] * 0.5)
+        if not best:
+            return 0.0  # Every term has to match something
+        total += best
+    return total
+
+async def search_employees(db, company_id: str, query: str, limit: int, offset: int) -> dict:
+    terms = words(query)
+    if not terms:
+        return {"results": [], "next_offset": None}
+
+    # Prefix matches: every term must prefix one of the words
+    prefix_query = {"company_id": company_id,
+                    "$and": [{"search_keys": {"$regex": f"^{re.escape(term)}"}} for term in terms]}
+    candidates = await db.employees.find(prefix_query, PROJECTION).limit(SEARCH_CANDIDATE_LIMIT) \
+        .to_list(SEARCH_CANDIDATE_LIMIT)
+
+    # Too few for the requested page: widen to employees sharing trigrams with the query
+    if len(candidates) < offset + limit:
+        grams = sorted(set().union(*(trigrams(term) for term in terms)))
+        seen = {employee["id"] for employee in candidates}
+        fuzzy = await db.employees.find(
+            {"company_id": company_id, "search_grams": {"$in": grams}}, PROJECTION
+        ).limit(SEARCH_CANDIDATE_LIMIT).to_list(SEARCH_CANDIDATE_LIMIT)
+        candidates += [employee for employee in fuzzy if employee["id"] not in seen]
+
+    ranked = []
+    for employee in candidates:
+        employee_score = score(employee, terms)
+        if employee_score:
+            ranked.append((employee_score, employee))
+    ranked.sort(key=lambda item: (-item[0], normalize(item[1]["surname"]), normalize(item[1]["name"])))
+
+    page = ranked[offset:offset + limit]
+    return {
+        "results": [
+            {**{field: employee[field] for field in ("id", "name", "surname", "number", "position")},
+             "score": round(employee_score, 3)}
+            for employee_score, employee in page
+        ],
+        "next_offset": offset + limit if len(ranked) > offset + limit else None
+    }
+
+async def backfill(db, on_batch=None, exclude_company_ids: Optional[list] = None) -> int:
+    """Add the search arrays to employees created before they existed, or before SEARCH_VERSION"""
+    query = {"search_version": {"$ne": SEARCH_VERSION}}
+    if exclude_company_ids:
+        query["company_id"] = {"$nin": exclude_company_ids}
+    updated = 0
+    while True:
+        employees = await db.employees.find(
+            query, {"_id": 0, "id": 1, **{field: 1 for field in SEARCH_FIELDS}}
+        ).limit(SEARCH_BACKFILL_BATCH_SIZE).to_list(SEARCH_BACKFILL_BATCH_SIZE)
+        if not employees:
+            return updated
+        await db.employees.bulk_write(
+            [UpdateOne({"id": employee["id"]}, {"$set": search_fields(employee)}) for employee in employees],
+            ordered=False
+        )
+        updated += len(employees)
+        if on_batch:
+            await on_batch(len(employees))
@@ -0,0 +1,47 @@
+"""Multi-worker launcher for the API.
+
+Starts one uvicorn worker process per core (or --workers / WEB_CONCURRENCY).
+Each worker builds the app with server.create_app() and opens its own MongoDB
+pool, indexes and job workers in the lifespan. On SIGTERM workers stop
+accepting connections and drain in-flight requests before exiting.
+
+    python serve.py
+    python serve.py --workers 4 --port 8001
+"""
+from pathlib import Path
+import argparse
+import os
+
+from dotenv import load_dotenv
+import uvicorn
+
+load_dotenv(Path(__file__).parent / '.env')
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the API with one worker process per core")
+    parser.add_argument("--host", default=os.environ.get("HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.environ.get("PORT", 8001)))
+    parser.add_argument("--workers", type=int, default=int(os.environ.get("WEB_CONCURRENCY", os.cpu_count() or 1)))
+    parser.add_argument("--graceful-timeout", type=float,
+                        default=float(os.environ.get("SHUTDOWN_DRAIN_SECONDS", 20)),
+                        help="Seconds to wait for in-flight requests on shutdown")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+    if args.workers > 1:
+        # Each worker would keep its own keys, and a retried scan on another worker would run again
+        if os.environ.get("IDEMPOTENCY_STORE") == "memory":
+            parser.error("IDEMPOTENCY_STORE=memory needs --workers 1; use the shared mongo store with more workers")
+        os.environ.setdefault("IDEMPOTENCY_STORE", "mongo")
+
+    uvicorn.run(
+        "server:create_app",
+        factory=True,
+        host=args.host,
+        port=args.port,
+        workers=args.workers,
+        timeout_graceful_shutdown=args.graceful_timeout,
+        log_level=args.log_level,
+    )
+
+if __name__ == "__main__":
+    main()
@@ -1,48 +1,93 @@
-from fastapi import FastAPI, HTTPException, Depends, status
+from fastapi import APIRouter, FastAPI, HTTPException, Depends, Query, Request, Response, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
 from fastapi.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
-from pydantic import BaseModel, Field, EmailStr
-from passlib.context import CryptContext
+from fastapi.responses import StreamingResponse
+from pydantic import BaseModel, Field
 from datetime import datetime, timedelta
 from typing import List, Optional
+from collections import Counter
+from contextlib import asynccontextmanager
 import jwt
 import os
 import uuid
-import qrcode
-import io
-import base64
+import asyncio
+import logging
 from pathlib import Path
 from dotenv import load_dotenv
+from pymongo import DeleteOne, InsertOne, UpdateOne
+from pymongo.errors import BulkWriteError
 
-# Load environment variables
+# Load environment variables before the modules below read their settings
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# Database setup
+from jobs import Job, JobQueue, job_handler, schedule_job
+import admission
+import archive
+import badges
+import database
+import directory
+import idempotency
+import retention
+import roster
+import search
+import shifts
+import metrics
+import passwords
+import tenancy
+import timesheets
+from slowlog import slow_query_listener
+
+# Database setup; the client is opened per process by connect(), from the app lifespan
 mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+DB_NAME = os.environ['DB_NAME']
+client = None
+db = None
+# Reports and exports read from secondaries within a staleness bound; scans and writes stay on `db`
+analytics_db = None
+
+# Background jobs; workers run in this process unless JOB_WORKERS_IN_API is off
+# and a separate `python worker.py` process handles them instead
+job_queue = JobQueue(db)
+JOB_WORKERS_IN_API = os.environ.get('JOB_WORKERS_IN_API', 'true').lower() == 'true'
+
+# Responses kept for retried requests carrying an Idempotency-Key
+idempotency_store = idempotency.create_store()
+IDEMPOTENT_ROUTES = {("POST", "/api/time/scan")}
+
+# Seconds the lifespan waits for in-flight requests to finish on shutdown
+SHUTDOWN_DRAIN_SECONDS = float(os.environ.get('SHUTDOWN_DRAIN_SECONDS', 20))
 
 # JWT Configuration
 SECRET_KEY = os.environ.get('JWT_SECRET', 'your-secret-key-change-in-production')
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 24 * 60  # 24 hours
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Optional bearer token required to scrape /api/metrics
+METRICS_TOKEN = os.environ.get('METRICS_TOKEN')
+
+# Most operations accepted by one POST /api/time/entries/bulk
+BULK_MAX_OPERATIONS = int(os.environ.get('BULK_MAX_OPERATIONS', 500))
+
+# Cascade deletion
+DELETE_BATCH_SIZE = int(os.environ.get('DELETE_BATCH_SIZE', 500))
+DELETE_BATCH_PAUSE_SECONDS = float(os.environ.get('DELETE_BATCH_PAUSE_SECONDS', 0.05))
+
+logger = logging.getLogger(__name__)
+
 security = HTTPBearer()
 
-app = FastAPI(title="Multi-Tenant Time Tracking System")
+router = APIRouter()
 
-# CORS middleware
-app.add_middleware(
-    CORSMiddleware,
-    allow_origins=["*"],
-    allow_credentials=True,
-    allow_methods=["*"],
-    allow_headers=["*"],
-)
+def connect():
+    """Open this process's MongoDB client. Runs after any fork, so every worker gets its own pool"""
+    global client, db, analytics_db
+    client = database.create_client(mongo_url, event_listeners=[metrics.command_listener, slow_query_listener])
+    db = client[DB_NAME]
+    analytics_db = database.analytics_database(client, DB_NAME)
+    job_queue.db = db
+    idempotency_store.db = db
+    return client
 
 # Models
 class Owner(BaseModel):
@@ -56,10 +101,18 @@ class OwnerLogin(BaseModel):
     username: str
     password: str
 
+class ShiftPolicy(BaseModel):
+    """How forgotten open shifts are resolved (see shifts.py)"""
+    max_shift_hours: int = Field(default=shifts.DEFAULT_SHIFT_POLICY["max_shift_hours"], ge=1, le=24)
+    default_check_out: Optional[str] = Field(default=None, pattern=r"^([01]\d|2[0-3]):[0-5]\d$")  # HH:MM
+    action: str = Field(default=shifts.DEFAULT_SHIFT_POLICY["action"], pattern="^(close|flag)$")
+
 class Company(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     name: str
     owner_id: str
+    retention_years: Optional[int] = None  # None keeps attendance data forever
+    shift_policy: Optional[ShiftPolicy] = None  # None uses the defaults
     created_at: datetime = Field(default_factory=datetime.utcnow)
 
 class CompanyCreate(BaseModel):
@@ -68,6 +121,9 @@ class CompanyCreate(BaseModel):
     admin_email: str
     admin_password: str
 
+class RetentionPolicy(BaseModel):
+    retention_years: Optional[int] = Field(default=None, ge=1)
+
 class User(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     username: str
@@ -118,11 +174,14 @@ class EmployeeUpdate(BaseModel):
 class TimeEntry(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     employee_id: str
+    company_id: Optional[str] = None  # Missing on entries written before retention purged by company
     check_in: Optional[datetime] = None
     check_out: Optional[datetime] = None
     date: str  # YYYY-MM-DD format
-    status: str  # "working" or "completed"
+    status: str  # "working", "completed" or "unclosed" (flagged by the open shift sweep)
     last_scan_time: Optional[datetime] = None
+    auto_closed: bool = False  # Checked out by the open shift sweep, not by a scan
+    archived: bool = False  # Read from time_entries_archive
 
 class TimeEntryEdit(BaseModel):
     check_in: Optional[str] = None  # HH:MM format
@@ -135,6 +194,17 @@ class TimeEntryCreate(BaseModel):
     check_out: Optional[str] = None  # HH:MM format
     date: str  # YYYY-MM-DD format
 
+class TimeEntryBulkOperation(BaseModel):
+    action: str = Field(..., pattern="^(create|update|delete)$")
+    id: Optional[str] = None  # Entry to update or delete
+    employee_id: Optional[str] = None  # For create
+    check_in: Optional[str] = None  # HH:MM format
+    check_out: Optional[str] = None  # HH:MM format
+    date: Optional[str] = None  # YYYY-MM-DD format
+
+class TimeEntryBulkRequest(BaseModel):
+    operations: List[TimeEntryBulkOperation] = Field(..., min_length=1, max_length=BULK_MAX_OPERATIONS)
+
 class QRScanRequest(BaseModel):
     qr_data: str
 
@@ -144,12 +214,6 @@ class Token(BaseModel):
     user: dict
 
 # Utility functions
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
-
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
-
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     to_encode = data.copy()
     if expires_delta:
@@ -160,17 +224,6 @@ def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
     encoded_jwt = jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
     return encoded_jwt
 
-def generate_qr_code(data: str) -> str:
-    qr = qrcode.QRCode(version=1, box_size=10, border=5)
-    qr.add_data(data)
-    qr.make(fit=True)
-    
-    img = qr.make_image(fill_color="black", back_color="white")
-    img_buffer = io.BytesIO()
-    img.save(img_buffer, format='PNG')
-    img_str = base64.b64encode(img_buffer.getvalue()).decode()
-    return f"data:image/png;base64,{img_str}"
-
 async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(security)):
     credentials_exception = HTTPException(
         status_code=status.HTTP_401_UNAUTHORIZED,
@@ -196,9 +249,14 @@ async def get_current_user(credentials: HTTPAuthorizationCredentials = Depends(s
             company_id: str = payload.get("company_id")
             if company_id is None:
                 raise credentials_exception
-            user = await db.users.find_one({"username": username, "company_id": company_id})
+            user = await db.users.find_one({
+                "username": username,
+                "company_id": company_id,
+                "disabled": {"$ne": True}
+            })
             if user is None:
                 raise credentials_exception
+            metrics.tag_request(company_id)
             return {"type": "user", "data": User(**user)}
     except jwt.PyJWTError:
         raise credentials_exception
@@ -231,11 +289,27 @@ async def get_company_context(current_user: User = Depends(get_current_regular_u
     """Get company context for filtering data"""
     return current_user.company_id
 
+async def get_tenant_db(request: Request, company_id: str = Depends(get_company_context)):
+    """The database holding the company's employees and time entries (see tenancy.py)"""
+    try:
+        return await tenancy.tenant_database(db, company_id, write=request.method not in ("GET", "HEAD"))
+    except tenancy.TenantFrozen:
+        # Only for the few seconds a migration needs to catch up; clients retry
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Trwa przenoszenie danych firmy, spróbuj ponownie za chwilę",
+            headers={"Retry-After": str(int(tenancy.TENANT_CACHE_SECONDS + tenancy.TENANT_FREEZE_GRACE_SECONDS))}
+        )
+
+async def get_tenant_analytics_db(company_id: str = Depends(get_company_context)):
+    """The company's database for reports, read from secondaries like analytics_db"""
+    return await tenancy.tenant_database(analytics_db, company_id)
+
 # Owner Authentication and Management
-@app.post("/api/owner/login", response_model=Token)
+@router.post("/api/owner/login", response_model=Token)
 async def owner_login(login_data: OwnerLogin):
     owner = await db.owners.find_one({"username": login_data.username})
-    if not owner or not verify_password(login_data.password, owner["password_hash"]):
+    if not owner or not await passwords.check_password(db.owners, owner, login_data.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password"
@@ -261,40 +335,30 @@ async def owner_login(login_data: OwnerLogin):
         }
     }
 
-@app.get("/api/owner/companies")
-async def get_all_companies(current_owner: Owner = Depends(get_current_owner)):
-    """Get all companies (owner only)"""
-    companies = await db.companies.find().to_list(1000)
-    result = []
-    
-    for company in companies:
-        # Get company admin count
-        admin_count = await db.users.count_documents({
-            "company_id": company["id"],
-            "role": "admin"
-        })
-        
-        # Get total user count
-        user_count = await db.users.count_documents({
-            "company_id": company["id"]
-        })
-        
-        # Get employee count
-        employee_count = await db.employees.count_documents({
-            "company_id": company["id"]
-        })
-        
-        company_data = Company(**company).dict()
-        company_data.update({
-            "admin_count": admin_count,
-            "user_count": user_count,
-            "employee_count": employee_count
-        })
-        result.append(company_data)
+@router.get("/api/owner/companies")
+async def get_all_companies(
+    q: Optional[str] = None,
+    sort: str = Query("name", pattern="^(name|size|activity|created)$"),
+    order: str = Query("asc", pattern="^(asc|desc)$"),
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None,
+    current_owner: Owner = Depends(get_current_owner)
+):
+    """Page through companies with their counts, optionally filtered by name prefix (owner only)
+
+    Returns {"companies", "next_cursor", "totals"}; the endpoint used to return a bare list.
+    """
+    try:
+        page = await directory.list_companies(db, q, sort, order, limit, cursor)
+    except directory.InvalidCursor:
+        raise HTTPException(status_code=400, detail="Nieprawidłowy kursor stronicowania")
     
-    return result
+    # Totals for the whole directory come with the first page only
+    if not cursor:
+        page["totals"] = await directory.totals(analytics_db)
+    return page
 
-@app.post("/api/owner/companies")
+@router.post("/api/owner/companies")
 async def create_company(
     company_data: CompanyCreate,
     current_owner: Owner = Depends(get_current_owner)
@@ -321,13 +385,13 @@ async def create_company(
         name=company_data.name,
         owner_id=current_owner.id
     )
-    await db.companies.insert_one(company.dict())
+    await db.companies.insert_one({**company.dict(), **directory.new_company_fields(company.name, company.created_at)})
     
     # Create admin user
     admin_user = User(
         username=company_data.admin_username,
         email=company_data.admin_email,
-        password_hash=get_password_hash(company_data.admin_password),
+        password_hash=await passwords.hash_password_async(company_data.admin_password),
         role="admin",
         company_id=company.id
     )
@@ -344,38 +408,311 @@ async def create_company(
         }
     }
 
-@app.delete("/api/owner/companies/{company_id}")
+async def _delete_in_batches(collection, query: dict, batch_size: int = DELETE_BATCH_SIZE):
+    """Delete documents matching query in bounded batches, yielding the count of each batch.
+
+    Every batch is selected by _id and removed with its own short delete, so a
+    large tenant never holds a long-running write on the collection.
+    """
+    while True:
+        docs = await collection.find(query, {"_id": 1}).limit(batch_size).to_list(batch_size)
+        if not docs:
+            return
+        result = await collection.delete_many({"_id": {"$in": [doc["_id"] for doc in docs]}})
+        yield result.deleted_count
+        await asyncio.sleep(DELETE_BATCH_PAUSE_SECONDS)
+
+@job_handler("company_delete")
+async def run_company_deletion(ctx):
+    """Cascade-delete a tombstoned company, recording progress on its job"""
+    company_id = ctx.payload["company_id"]
+    progress = {"employees_deleted": 0, "users_deleted": 0, "time_entries_deleted": 0, "archive_buckets_deleted": 0}
+    tenant_db = await tenancy.tenant_database(db, company_id)
+
+    # Employees go in batches together with their time entries, so an
+    # entry is never left behind without its employee
+    while True:
+        employees = await tenant_db.employees.find(
+            {"company_id": company_id}, {"_id": 1, "id": 1}
+        ).limit(DELETE_BATCH_SIZE).to_list(DELETE_BATCH_SIZE)
+        if not employees:
+            break
+        employee_ids = [emp["id"] for emp in employees]
+        async for deleted in _delete_in_batches(tenant_db.time_entries, {"employee_id": {"$in": employee_ids}}):
+            progress["time_entries_deleted"] += deleted
+            await ctx.increment(time_entries_deleted=deleted)
+        async for deleted in _delete_in_batches(tenant_db.time_entries_archive, {"employee_id": {"$in": employee_ids}}):
+            progress["archive_buckets_deleted"] += deleted
+            await ctx.increment(archive_buckets_deleted=deleted)
+        result = await tenant_db.employees.delete_many({"_id": {"$in": [emp["_id"] for emp in employees]}})
+        progress["employees_deleted"] += result.deleted_count
+        await ctx.increment(employees_deleted=result.deleted_count)
+
+    async for deleted in _delete_in_batches(db.users, {"company_id": company_id}):
+        progress["users_deleted"] += deleted
+        await ctx.increment(users_deleted=deleted)
+    async for _ in _delete_in_batches(tenant_db.roster_tombstones, {"company_id": company_id}):
+        pass
+
+    if tenant_db.name != db.name:
+        await db.client.drop_database(tenant_db.name)
+    await db.tenants.delete_one({"company_id": company_id})
+    tenancy.clear_cache()
+    await db.companies.delete_one({"id": company_id})
+    # Counts cover this attempt only; a retried job resumes where the last one stopped
+    return progress
+
+@router.delete("/api/owner/companies/{company_id}", status_code=status.HTTP_202_ACCEPTED)
 async def delete_company(
     company_id: str,
     current_owner: Owner = Depends(get_current_owner)
 ):
-    """Delete a company and all its data (owner only)"""
+    """Tombstone a company and delete all its data in the background (owner only)"""
     # Check if company exists
-    company = await db.companies.find_one({"id": company_id})
+    company = await db.companies.find_one({"id": company_id, "deleted_at": None})
     if not company:
         raise HTTPException(status_code=404, detail="Company not found")
+    if company_id in await tenancy.migrating_companies(db):
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail="Trwa przenoszenie danych firmy, usuń ją po zakończeniu"
+        )
+    tenant_db = await tenancy.tenant_database(db, company_id)
     
-    # Delete all company data
-    await db.users.delete_many({"company_id": company_id})
-    await db.employees.delete_many({"company_id": company_id})
-    await db.time_entries.delete_many({"employee_id": {"$in": []}})  # Will be updated with proper employee IDs
-    
-    # Get all employee IDs first, then delete time entries
-    employees = await db.employees.find({"company_id": company_id}).to_list(1000)
-    employee_ids = [emp["id"] for emp in employees]
-    if employee_ids:
-        await db.time_entries.delete_many({"employee_id": {"$in": employee_ids}})
-    
-    # Delete employees
-    await db.employees.delete_many({"company_id": company_id})
+    # Tombstone the company and lock out its users right away; the data
+    # itself is removed in batches by the background deletion
+    await db.companies.update_one({"id": company_id}, {"$set": {"deleted_at": datetime.utcnow()}})
+    await db.users.update_many({"company_id": company_id}, {"$set": {"disabled": True}})
     
-    # Delete company
-    await db.companies.delete_one({"id": company_id})
+    job = await job_queue.enqueue(
+        "company_delete",
+        payload={"company_id": company_id, "company_name": company["name"]},
+        company_id=company_id,
+        created_by=current_owner.id,
+        progress={
+            "employees_total": await tenant_db.employees.count_documents({"company_id": company_id}),
+            "users_total": await db.users.count_documents({"company_id": company_id})
+        }
+    )
     
-    return {"message": "Company and all its data deleted successfully"}
+    return {
+        "message": "Company deletion started",
+        "job_id": job.id
+    }
+
+@router.get("/api/owner/companies/{company_id}/deletion", response_model=Job)
+async def get_company_deletion(
+    company_id: str,
+    current_owner: Owner = Depends(get_current_owner)
+):
+    """Get progress of the most recent deletion of a company (owner only)"""
+    jobs = await db.jobs.find(
+        {"type": "company_delete", "company_id": company_id}
+    ).sort("created_at", -1).to_list(1)
+    if not jobs:
+        raise HTTPException(status_code=404, detail="Company deletion not found")
+    return Job(**jobs[0])
+
+@job_handler("archive_time_entries")
+async def run_time_entry_archival(ctx):
+    """Move closed shifts past the archive horizon out of the hot collection, in every tenant database"""
+    async def on_batch(entries_archived: int, buckets_updated: int):
+        await ctx.increment(entries_archived=entries_archived, buckets_updated=buckets_updated)
+    totals = {"entries_archived": 0, "buckets_updated": 0}
+    for tenant_db in await tenancy.tenant_databases(db):
+        excluded = await tenancy.migration_exclusions(db, tenant_db)
+        stats = await archive.archive_completed_entries(
+            tenant_db, on_batch=on_batch, exclude_employee_ids=excluded["employee_ids"]
+        )
+        for key in totals:
+            totals[key] += stats[key]
+    return totals
+
+schedule_job("archive_time_entries", archive.ARCHIVE_INTERVAL_SECONDS)
+
+@job_handler("employee_search_backfill")
+async def run_employee_search_backfill(ctx):
+    """Index employees created before search existed"""
+    async def on_batch(employees_updated: int):
+        await ctx.increment(employees_updated=employees_updated)
+    updated = 0
+    for tenant_db in await tenancy.tenant_databases(db):
+        excluded = await tenancy.migration_exclusions(db, tenant_db)
+        updated += await search.backfill(tenant_db, on_batch=on_batch, exclude_company_ids=excluded["company_ids"])
+    return {"employees_updated": updated}
+
+schedule_job("employee_search_backfill", 24 * 60 * 60)
+
+@job_handler("company_directory_reconcile")
+async def run_company_directory_reconcile(ctx):
+    """Recount the users and employees the owner directory shows for every company"""
+    async def on_batch(companies_checked: int, companies_corrected: int):
+        await ctx.increment(companies_checked=companies_checked, companies_corrected=companies_corrected)
+    return await directory.reconcile(db, on_batch=on_batch)
+
+schedule_job("company_directory_reconcile", directory.DIRECTORY_RECONCILE_INTERVAL_SECONDS)
+
+@job_handler("retention_purge")
+async def run_retention_purge(ctx):
+    """Purge expired attendance data of one company, or of every company with a retention policy"""
+    query = {"retention_years": {"$ne": None}, "deleted_at": None, "id": {"$nin": await tenancy.migrating_companies(db)}}
+    if ctx.payload.get("company_id"):
+        query["id"]["$eq"] = ctx.payload["company_id"]
+    companies = await db.companies.find(query, {"id": 1, "retention_years": 1}).to_list(None)
+
+    async def on_batch(**counts):
+        await ctx.increment(**counts)
+
+    totals = {"companies": 0, "entries_purged": 0, "archived_entries_purged": 0, "buckets_deleted": 0}
+    # Entries without a company are settled first, so the purges by company below reach them
+    if not ctx.payload.get("company_id"):
+        for tenant_db in await tenancy.tenant_databases(db):
+            excluded = await tenancy.migration_exclusions(db, tenant_db)
+            settled = await retention.settle_unowned(
+                tenant_db, on_batch=on_batch, exclude_employee_ids=excluded["employee_ids"]
+            )
+            for key, value in settled.items():
+                totals[key] = totals.get(key, 0) + value
+    for company in companies:
+        cutoff = retention.retention_cutoff(company["retention_years"])
+        tenant_db = await tenancy.tenant_database(db, company["id"])
+        stats = await retention.purge_company(tenant_db, company["id"], cutoff, on_batch=on_batch)
+        await db.companies.update_one(
+            {"id": company["id"]},
+            {"$set": {"retention_last_purge": {**stats, "finished_at": datetime.utcnow()}}}
+        )
+        totals["companies"] += 1
+        for key in ("entries_purged", "archived_entries_purged", "buckets_deleted"):
+            totals[key] += stats[key]
+        await ctx.increment(companies=1)
+    return totals
+
+schedule_job("retention_purge", retention.RETENTION_INTERVAL_SECONDS)
+
+@job_handler("close_open_shifts")
+async def run_open_shift_sweep(ctx):
+    """Close or flag shifts left open past their company's maximum shift length, in every tenant database"""
+    companies = await db.companies.find({"deleted_at": None}, {"id": 1, "shift_policy": 1}).to_list(None)
+    policies = {company["id"]: shifts.shift_policy(company) for company in companies}
+
+    async def on_batch(entries_checked: int, entries_resolved: int):
+        await ctx.increment(entries_checked=entries_checked, entries_resolved=entries_resolved)
+    totals = {"entries_checked": 0, "entries_closed": 0, "entries_flagged": 0}
+    for tenant_db in await tenancy.tenant_databases(db):
+        excluded = await tenancy.migration_exclusions(db, tenant_db)
+        stats = await shifts.sweep_open_shifts(
+            tenant_db, policies, on_batch=on_batch, exclude_employee_ids=excluded["employee_ids"]
+        )
+        for key in totals:
+            totals[key] += stats[key]
+    return totals
+
+schedule_job("close_open_shifts", shifts.SHIFT_SWEEP_INTERVAL_SECONDS)
+
+@job_handler("roster_tombstone_prune")
+async def run_roster_tombstone_prune(ctx):
+    """Drop kiosk roster tombstones past ROSTER_TOMBSTONE_DAYS in every tenant database"""
+    pruned = 0
+    for tenant_db in await tenancy.tenant_databases(db):
+        pruned += await roster.prune_tombstones(db, tenant_db)
+    return {"tombstones_pruned": pruned}
+
+schedule_job("roster_tombstone_prune", roster.ROSTER_PRUNE_INTERVAL_SECONDS)
+
+@job_handler("badge_reissue")
+async def run_badge_reissue(ctx):
+    """Redraw every badge not signed with the current key, after a key rotation or to retire legacy badges"""
+    async def on_batch(employees_reissued: int):
+        await ctx.increment(employees_reissued=employees_reissued)
+    reissued = 0
+    for tenant_db in await tenancy.tenant_databases(db):
+        excluded = await tenancy.migration_exclusions(db, tenant_db)
+        reissued += await badges.reissue(tenant_db, on_batch=on_batch, exclude_company_ids=excluded["company_ids"])
+    return {"employees_reissued": reissued, "kid": badges.QR_SIGNING_KID}
+
+# Background jobs
+async def get_visible_job(job_id: str, current_auth = Depends(get_current_user)) -> Job:
+    """Owners see every job, company admins only the jobs of their own company"""
+    job = await job_queue.get(job_id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if current_auth["type"] != "owner":
+        user = current_auth["data"]
+        if user.role != "admin" or job.company_id != user.company_id:
+            raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@router.get("/api/jobs/{job_id}", response_model=Job)
+async def get_job(job: Job = Depends(get_visible_job)):
+    return job
+
+@router.get("/api/jobs/{job_id}/result")
+async def get_job_result(job: Job = Depends(get_visible_job)):
+    if job.status == "failed":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Job failed: {job.error}")
+    if job.status != "completed":
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Job has not finished yet")
+    return {"id": job.id, "type": job.type, "result": job.result}
+
+@router.get("/api/owner/companies/{company_id}/retention")
+async def get_company_retention(
+    company_id: str,
+    current_owner: Owner = Depends(get_current_owner)
+):
+    """Get the retention policy and last purge statistics of a company (owner only)"""
+    company = await db.companies.find_one({"id": company_id, "deleted_at": None})
+    if not company:
+        raise HTTPException(status_code=404, detail="Company not found")
+    return {
+        "retention_years": company.get("retention_years"),
+        "last_purge": company.get("retention_last_purge")
+    }
+
+@router.put("/api/owner/companies/{company_id}/retention")
+async def set_company_retention(
+    company_id: str,
+    policy: RetentionPolicy,
+    current_owner: Owner = Depends(get_current_owner)
+):
+    """Set how many years of attendance data a company keeps (owner only)"""
+    result = await db.companies.update_one(
+        {"id": company_id, "deleted_at": None},
+        {"$set": {"retention_years": policy.retention_years}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Company not found")
+    return {"retention_years": policy.retention_years}
+
+@router.post("/api/owner/companies/{company_id}/retention/purge", status_code=status.HTTP_202_ACCEPTED)
+async def purge_company_retention(
+    company_id: str,
+    current_owner: Owner = Depends(get_current_owner)
+):
+    """Run the retention purge for one company now instead of waiting for the schedule (owner only)"""
+    company = await db.companies.find_one({"id": company_id, "deleted_at": None})
+    if not company:
+        raise HTTPException(status_code=404, detail="Company not found")
+    if not company.get("retention_years"):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Firma nie ma ustawionego okresu przechowywania danych"
+        )
+    job = await job_queue.enqueue(
+        "retention_purge",
+        payload={"company_id": company_id},
+        company_id=company_id,
+        created_by=current_owner.id
+    )
+    return {"message": "Retention purge started", "job_id": job.id}
+
+@router.post("/api/owner/badges/reissue", status_code=status.HTTP_202_ACCEPTED)
+async def reissue_badges(current_owner: Owner = Depends(get_current_owner)):
+    """Redraw every badge not signed with the current QR signing key (owner only)"""
+    job = await job_queue.enqueue("badge_reissue", created_by=current_owner.id)
+    return {"message": "Badge reissue started", "kid": badges.QR_SIGNING_KID, "job_id": job.id}
 
 # Company Self-Registration
-@app.post("/api/auth/register-company", response_model=Token)
+@router.post("/api/auth/register-company", response_model=Token)
 async def register_company(company_data: CompanyRegistration):
     """Allow companies to self-register with admin user"""
     # Check if company name already exists
@@ -399,13 +736,13 @@ async def register_company(company_data: CompanyRegistration):
         name=company_data.company_name,
         owner_id="system"  # For self-registered companies
     )
-    await db.companies.insert_one(company.dict())
+    await db.companies.insert_one({**company.dict(), **directory.new_company_fields(company.name, company.created_at)})
     
     # Create admin user
     admin_user = User(
         username=company_data.admin_username,
         email=company_data.admin_email,
-        password_hash=get_password_hash(company_data.admin_password),
+        password_hash=await passwords.hash_password_async(company_data.admin_password),
         role="admin",
         company_id=company.id
     )
@@ -437,11 +774,11 @@ async def register_company(company_data: CompanyRegistration):
     }
 
 # Universal Authentication - handles both owners and regular users
-@app.post("/api/auth/login", response_model=Token)
+@router.post("/api/auth/login", response_model=Token)
 async def login(user_data: UserLogin):
     # First check if user is an owner
     owner = await db.owners.find_one({"username": user_data.username})
-    if owner and verify_password(user_data.password, owner["password_hash"]):
+    if owner and await passwords.check_password(db.owners, owner, user_data.password):
         # Owner login
         access_token_expires = timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
         access_token = create_access_token(
@@ -464,8 +801,8 @@ async def login(user_data: UserLogin):
         }
     
     # If not owner, check regular users
-    user = await db.users.find_one({"username": user_data.username})
-    if not user or not verify_password(user_data.password, user["password_hash"]):
+    user = await db.users.find_one({"username": user_data.username, "disabled": {"$ne": True}})
+    if not user or not await passwords.check_password(db.users, user, user_data.password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Incorrect username or password"
@@ -495,7 +832,7 @@ async def login(user_data: UserLogin):
         }
     }
 
-@app.get("/api/auth/me")
+@router.get("/api/auth/me")
 async def get_me(current_auth = Depends(get_current_user)):
     if current_auth["type"] == "owner":
         owner = current_auth["data"]
@@ -517,14 +854,33 @@ async def get_me(current_auth = Depends(get_current_user)):
         }
 
 # Company Management (Admin only)
-@app.get("/api/company/info")
+@router.get("/api/company/info")
 async def get_company_info(current_user: User = Depends(get_current_regular_user)):
-    company = await db.companies.find_one({"id": current_user.company_id})
+    company = await db.companies.find_one({"id": current_user.company_id, "deleted_at": None})
     if not company:
         raise HTTPException(status_code=404, detail="Company not found")
     return Company(**company)
 
-@app.get("/api/company/users")
+@router.get("/api/company/shift-policy", response_model=ShiftPolicy)
+async def get_shift_policy(current_user: User = Depends(get_admin_user)):
+    """How the company's forgotten open shifts are closed or flagged"""
+    company = await db.companies.find_one({"id": current_user.company_id, "deleted_at": None})
+    if not company:
+        raise HTTPException(status_code=404, detail="Company not found")
+    return ShiftPolicy(**shifts.shift_policy(company))
+
+@router.put("/api/company/shift-policy", response_model=ShiftPolicy)
+async def set_shift_policy(policy: ShiftPolicy, current_user: User = Depends(get_admin_user)):
+    """Set how the company's forgotten open shifts are closed or flagged"""
+    result = await db.companies.update_one(
+        {"id": current_user.company_id, "deleted_at": None},
+        {"$set": {"shift_policy": policy.dict()}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=404, detail="Company not found")
+    return policy
+
+@router.get("/api/company/users")
 async def get_company_users(current_user: User = Depends(get_admin_user)):
     users = await db.users.find({"company_id": current_user.company_id}).to_list(1000)
     return [
@@ -538,7 +894,7 @@ async def get_company_users(current_user: User = Depends(get_admin_user)):
         for user in users
     ]
 
-@app.post("/api/company/users")
+@router.post("/api/company/users")
 async def create_company_user(
     user_data: UserCreate,
     current_user: User = Depends(get_admin_user)
@@ -555,11 +911,12 @@ async def create_company_user(
     new_user = User(
         username=user_data.username,
         email=user_data.email,
-        password_hash=get_password_hash(user_data.password),
+        password_hash=await passwords.hash_password_async(user_data.password),
         role=user_data.role,
         company_id=current_user.company_id
     )
     await db.users.insert_one(new_user.dict())
+    await directory.count_change(db, new_user.company_id, user_count=1, admin_count=int(new_user.role == "admin"))
     
     return {
         "id": new_user.id,
@@ -569,7 +926,7 @@ async def create_company_user(
         "company_id": new_user.company_id
     }
 
-@app.delete("/api/company/users/{user_id}")
+@router.delete("/api/company/users/{user_id}")
 async def delete_company_user(
     user_id: str,
     current_user: User = Depends(get_admin_user)
@@ -589,18 +946,22 @@ async def delete_company_user(
     result = await db.users.delete_one({"id": user_id, "company_id": current_user.company_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="User not found")
+    await directory.count_change(
+        db, current_user.company_id, user_count=-1, admin_count=-int(user_to_delete["role"] == "admin")
+    )
     
     return {"message": "User deleted successfully"}
 
 # Employee endpoints (Admin only, company-scoped)
-@app.post("/api/employees", response_model=Employee)
+@router.post("/api/employees", response_model=Employee)
 async def create_employee(
     employee_data: EmployeeCreate,
     company_id: str = Depends(get_company_context),
+    tenant_db = Depends(get_tenant_db),
     current_user: User = Depends(get_admin_user)
 ):
     # Check if employee number already exists in this company
-    existing_employee = await db.employees.find_one({
+    existing_employee = await tenant_db.employees.find_one({
         "number": employee_data.number,
         "company_id": company_id
     })
@@ -610,38 +971,57 @@ async def create_employee(
             detail="Numer pracownika już istnieje w tej firmie"
         )
     
-    # Generate unique QR code data
-    qr_data = f"EMP_{company_id}_{employee_data.number}_{str(uuid.uuid4())[:8]}"
-    qr_code = generate_qr_code(qr_data)
+    # The badge is signed over the employee id, so it is drawn before the employee is built
+    employee_id = str(uuid.uuid4())
+    badge = badges.issue(company_id, employee_id)
     
     employee = Employee(
+        id=employee_id,
         name=employee_data.name,
         surname=employee_data.surname,
         position=employee_data.position,
         number=employee_data.number,
-        qr_code=qr_code,
+        qr_code=badge["qr_code"],
         company_id=company_id
     )
     
-    await db.employees.insert_one(employee.dict())
+    await tenant_db.employees.insert_one({
+        **employee.dict(), "badge_kid": badge["badge_kid"], **search.search_fields(employee.dict()),
+        "roster_version": await roster.next_version(db, company_id)
+    })
+    await directory.count_change(db, company_id, employee_count=1)
     return employee
 
-@app.get("/api/employees", response_model=List[Employee])
+@router.get("/api/employees", response_model=List[Employee])
 async def get_employees(
     company_id: str = Depends(get_company_context),
+    tenant_db = Depends(get_tenant_db),
     current_user: User = Depends(get_admin_user)
 ):
-    employees = await db.employees.find({"company_id": company_id}).to_list(1000)
+    employees = await tenant_db.employees.find({"company_id": company_id}).to_list(1000)
     return [Employee(**emp) for emp in employees]
 
-@app.put("/api/employees/{employee_id}", response_model=Employee)
+@router.get("/api/employees/search")
+async def search_employees(
+    q: str,
+    limit: int = Query(20, ge=1, le=100),
+    offset: int = Query(0, ge=0),
+    company_id: str = Depends(get_company_context),
+    tenant_db = Depends(get_tenant_db),
+    current_user: User = Depends(get_admin_user)
+):
+    """Typeahead search by name, surname, number or position, best matches first"""
+    return await search.search_employees(tenant_db, company_id, q, limit, offset)
+
+@router.put("/api/employees/{employee_id}", response_model=Employee)
 async def update_employee(
     employee_id: str,
     employee_data: EmployeeUpdate,
     company_id: str = Depends(get_company_context),
+    tenant_db = Depends(get_tenant_db),
     current_user: User = Depends(get_admin_user)
 ):
-    employee = await db.employees.find_one({"id": employee_id, "company_id": company_id})
+    employee = await tenant_db.employees.find_one({"id": employee_id, "company_id": company_id})
     if not employee:
         raise HTTPException(status_code=404, detail="Employee not found")
     
@@ -649,7 +1029,7 @@ async def update_employee(
     if update_data:
         # Check if number is being changed and if it already exists
         if "number" in update_data:
-            existing_employee = await db.employees.find_one({
+            existing_employee = await tenant_db.employees.find_one({
                 "number": update_data["number"],
                 "company_id": company_id,
                 "id": {"$ne": employee_id}
@@ -660,70 +1040,80 @@ async def update_employee(
                     detail="Numer pracownika już istnieje w tej firmie"
                 )
         
-        await db.employees.update_one(
+        if any(field in update_data for field in search.SEARCH_FIELDS):
+            update_data.update(search.search_fields({**employee, **update_data}))
+        if roster.changes_roster(update_data):
+            update_data["roster_version"] = await roster.next_version(db, company_id)
+        
+        await tenant_db.employees.update_one(
             {"id": employee_id, "company_id": company_id},
             {"$set": update_data}
         )
     
-    updated_employee = await db.employees.find_one({"id": employee_id, "company_id": company_id})
+    updated_employee = await tenant_db.employees.find_one({"id": employee_id, "company_id": company_id})
     return Employee(**updated_employee)
 
-@app.delete("/api/employees/{employee_id}")
+@router.delete("/api/employees/{employee_id}")
 async def delete_employee(
     employee_id: str,
     company_id: str = Depends(get_company_context),
+    tenant_db = Depends(get_tenant_db),
     current_user: User = Depends(get_admin_user)
 ):
-    result = await db.employees.delete_one({"id": employee_id, "company_id": company_id})
+    result = await tenant_db.employees.delete_one({"id": employee_id, "company_id": company_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Employee not found")
+    await directory.count_change(db, company_id, employee_count=-1)
+    await roster.record_removal(db, tenant_db, {"id": employee_id, "company_id": company_id})
     
-    # Also delete related time entries
-    await db.time_entries.delete_many({"employee_id": employee_id})
+    # Also delete related time entries, hot and archived
+    await tenant_db.time_entries.delete_many({"employee_id": employee_id})
+    await tenant_db.time_entries_archive.delete_many({"employee_id": employee_id})
     
     return {"message": "Employee deleted successfully"}
 
 # Time tracking endpoints (company-scoped)
-@app.post("/api/time/scan")
+@router.post("/api/time/scan")
 async def scan_qr(
     scan_data: QRScanRequest,
     company_id: str = Depends(get_company_context),
+    tenant_db = Depends(get_tenant_db),
     current_user: User = Depends(get_current_regular_user)
 ):
     # Find employee by QR data
     qr_data = scan_data.qr_data
     
-    # Extract company and employee info from QR data (format: EMP_COMPANYID_NUMBER_UUID)
-    if not qr_data.startswith("EMP_"):
-        raise HTTPException(status_code=400, detail="Invalid QR code")
-    
-    try:
-        parts = qr_data.split("_")
-        if len(parts) < 3:
+    # Signed badges are checked before any database access and name the employee by id
+    if badges.is_signed(qr_data):
+        try:
+            employee_query = {"id": badges.verify(qr_data, company_id)}
+        except badges.ForeignBadge:
+            raise HTTPException(status_code=403, detail="QR kod nie należy do Twojej firmy")
+        except badges.InvalidBadge:
+            raise HTTPException(status_code=400, detail="Invalid QR code")
+        badges.badge_scans_total.inc("signed")
+    elif badges.QR_ACCEPT_LEGACY and qr_data.startswith("EMP_"):
+        # Unsigned badge (format: EMP_COMPANYID_NUMBER_UUID), found by number
+        try:
+            qr_company_id, employee_number = badges.parse_legacy(qr_data)
+        except badges.InvalidBadge:
             raise HTTPException(status_code=400, detail="Invalid QR code format")
-        qr_company_id = parts[1]
-        employee_number = parts[2]
-        
-        # Verify QR code belongs to user's company
         if qr_company_id != company_id:
             raise HTTPException(status_code=403, detail="QR kod nie należy do Twojej firmy")
-        
-        employee = await db.employees.find_one({
-            "number": employee_number,
-            "company_id": company_id
-        })
-        if not employee:
-            raise HTTPException(status_code=404, detail="Employee not found")
-    except HTTPException:
-        raise
-    except Exception as e:
-        raise HTTPException(status_code=400, detail="Invalid QR code format")
+        badges.badge_scans_total.inc("legacy")
+        employee_query = {"number": employee_number}
+    else:
+        raise HTTPException(status_code=400, detail="Invalid QR code")
+    
+    employee = await tenant_db.employees.find_one({**employee_query, "company_id": company_id})
+    if not employee:
+        raise HTTPException(status_code=404, detail="Employee not found")
     
     today = datetime.now().strftime("%Y-%m-%d")
     current_time = datetime.now()
     
     # Check if there's an active time entry for today
-    existing_entry = await db.time_entries.find_one({
+    existing_entry = await tenant_db.time_entries.find_one({
         "employee_id": employee["id"],
         "date": today,
         "status": "working"
@@ -748,7 +1138,7 @@ async def scan_qr(
             )
     
     # Check for completed entries today to prevent multiple scans
-    completed_entry = await db.time_entries.find_one({
+    completed_entry = await tenant_db.time_entries.find_one({
         "employee_id": employee["id"],
         "date": today,
         "status": "completed"
@@ -769,10 +1159,12 @@ async def scan_qr(
                 detail=f"Poczekaj {remaining_seconds} sekund przed kolejnym skanowaniem"
             )
     
+    await directory.touch_activity(db, company_id)
+    
     if existing_entry:
         # Check out - end work
         check_out_time = datetime.now()
-        await db.time_entries.update_one(
+        await tenant_db.time_entries.update_one(
             {"id": existing_entry["id"]},
             {
                 "$set": {
@@ -794,12 +1186,13 @@ async def scan_qr(
         check_in_time = datetime.now()
         time_entry = TimeEntry(
             employee_id=employee["id"],
+            company_id=company_id,
             check_in=check_in_time,
             date=today,
             status="working",
             last_scan_time=check_in_time
         )
-        await db.time_entries.insert_one(time_entry.dict())
+        await tenant_db.time_entries.insert_one(time_entry.dict())
         
         return {
             "action": "check_in",
@@ -809,33 +1202,86 @@ async def scan_qr(
             "cooldown_seconds": COOLDOWN_SECONDS
         }
 
-@app.get("/api/time/entries/{employee_id}")
+def _date_range_query(date_from: Optional[str], date_to: Optional[str]) -> dict:
+    date_range = {}
+    if date_from:
+        date_range["$gte"] = date_from
+    if date_to:
+        date_range["$lte"] = date_to
+    return {"date": date_range} if date_range else {}
+
+@router.get("/api/kiosk/roster")
+async def get_kiosk_roster(
+    since: Optional[int] = Query(None, ge=0),
+    company_id: str = Depends(get_company_context),
+    tenant_db = Depends(get_tenant_db),
+    current_user: User = Depends(get_current_regular_user)
+):
+    """The company's signed employee roster for kiosks, or the changes after version `since`"""
+    body = roster.encode(await roster.roster(db, tenant_db, company_id, since))
+    return Response(content=body, media_type="application/json", headers={"X-Roster-Signature": roster.sign(body)})
+
+@router.get("/api/kiosk/roster/key")
+async def get_kiosk_roster_key(current_user: User = Depends(get_current_regular_user)):
+    """The Ed25519 public key kiosks check roster signatures with"""
+    return {"algorithm": "Ed25519", "public_key": roster.public_key()}
+
+@router.get("/api/time/entries/{employee_id}")
 async def get_employee_time_entries(
     employee_id: str,
+    date_from: Optional[str] = None,  # YYYY-MM-DD format
+    date_to: Optional[str] = None,  # YYYY-MM-DD format
     company_id: str = Depends(get_company_context),
+    tenant_db = Depends(get_tenant_db),
+    tenant_analytics_db = Depends(get_tenant_analytics_db),
     current_user: User = Depends(get_admin_user)
 ):
     # Verify employee belongs to company
-    employee = await db.employees.find_one({"id": employee_id, "company_id": company_id})
+    employee = await tenant_db.employees.find_one({"id": employee_id, "company_id": company_id})
     if not employee:
         raise HTTPException(status_code=404, detail="Employee not found")
     
-    entries = await db.time_entries.find({"employee_id": employee_id}).to_list(1000)
+    entries = await tenant_analytics_db.time_entries.find({
+        "employee_id": employee_id,
+        **_date_range_query(date_from, date_to)
+    }).to_list(1000)
+    
+    # Reach into the monthly archive only when the range goes back past the horizon
+    if archive.reaches_archive(date_from) and len(entries) < 1000:
+        entries += await archive.find_archived_entries(
+            tenant_analytics_db, [employee_id], date_from, date_to,
+            limit=1000 - len(entries), exclude_ids=[entry["id"] for entry in entries]
+        )
+        entries.sort(key=lambda entry: entry["date"])
+    
     return [TimeEntry(**entry) for entry in entries]
 
-@app.get("/api/time/entries")
+@router.get("/api/time/entries")
 async def get_all_time_entries(
+    date_from: Optional[str] = None,  # YYYY-MM-DD format
+    date_to: Optional[str] = None,  # YYYY-MM-DD format
     company_id: str = Depends(get_company_context),
+    tenant_analytics_db = Depends(get_tenant_analytics_db),
     current_user: User = Depends(get_admin_user)
 ):
     """Get all time entries for company with employee information"""
     # Get all employees for this company
-    employees = await db.employees.find({"company_id": company_id}).to_list(1000)
+    employees = await tenant_analytics_db.employees.find({"company_id": company_id}).to_list(1000)
     employee_ids = [emp["id"] for emp in employees]
     employee_map = {emp["id"]: emp for emp in employees}
     
     # Get time entries for company employees
-    entries = await db.time_entries.find({"employee_id": {"$in": employee_ids}}).sort("date", -1).to_list(1000)
+    entries = await tenant_analytics_db.time_entries.find({
+        "employee_id": {"$in": employee_ids},
+        **_date_range_query(date_from, date_to)
+    }).sort("date", -1).to_list(1000)
+    
+    # Fill up with archived entries, newest first, when the range reaches back
+    if archive.reaches_archive(date_from) and len(entries) < 1000:
+        entries += await archive.find_archived_entries(
+            tenant_analytics_db, employee_ids, date_from, date_to,
+            limit=1000 - len(entries), exclude_ids=[entry["id"] for entry in entries]
+        )
     
     # Combine entries with employee data
     result = []
@@ -866,24 +1312,51 @@ async def get_all_time_entries(
     
     return result
 
-@app.put("/api/time/entries/{entry_id}")
-async def update_time_entry(
-    entry_id: str,
-    entry_data: TimeEntryEdit,
+MONTH_PATTERN = r"^\d{4}-(0[1-9]|1[0-2])$"
+
+async def _company_name(company_id: str) -> str:
+    company = await db.companies.find_one({"id": company_id}, {"_id": 0, "name": 1})
+    return company["name"] if company else ""
+
+@router.get("/api/employees/{employee_id}/timesheet")
+async def get_employee_timesheet(
+    employee_id: str,
+    month: str = Query(..., pattern=MONTH_PATTERN),  # YYYY-MM
     company_id: str = Depends(get_company_context),
+    tenant_analytics_db = Depends(get_tenant_analytics_db),
     current_user: User = Depends(get_admin_user)
 ):
-    """Update a time entry (admin only, company-scoped)"""
-    # Get entry and verify it belongs to company employee
-    entry = await db.time_entries.find_one({"id": entry_id})
-    if not entry:
-        raise HTTPException(status_code=404, detail="Time entry not found")
-    
-    # Verify employee belongs to company
-    employee = await db.employees.find_one({"id": entry["employee_id"], "company_id": company_id})
+    """The employee's monthly timesheet as a PDF, rendered in the timesheet process pool"""
+    employee = await tenant_analytics_db.employees.find_one({"id": employee_id, "company_id": company_id})
     if not employee:
-        raise HTTPException(status_code=404, detail="Time entry not found")
+        raise HTTPException(status_code=404, detail="Employee not found")
     
+    entries = await timesheets.month_entries(tenant_analytics_db, [employee_id], month)
+    pdf = await timesheets.render(
+        timesheets.timesheet_data(await _company_name(company_id), employee, month, entries[employee_id])
+    )
+    return Response(
+        content=pdf,
+        media_type="application/pdf",
+        headers={"Content-Disposition": f'attachment; filename="{timesheets.filename(employee, month)}"'}
+    )
+
+@router.get("/api/timesheets")
+async def get_company_timesheets(
+    month: str = Query(..., pattern=MONTH_PATTERN),  # YYYY-MM
+    company_id: str = Depends(get_company_context),
+    tenant_analytics_db = Depends(get_tenant_analytics_db),
+    current_user: User = Depends(get_admin_user)
+):
+    """Every employee's timesheet for the month, streamed as a ZIP while it is rendered"""
+    return StreamingResponse(
+        timesheets.company_timesheets_zip(tenant_analytics_db, company_id, await _company_name(company_id), month),
+        media_type="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="karty_czasu_pracy_{month}.zip"'}
+    )
+
+def _time_entry_changes(entry: dict, entry_data: TimeEntryEdit) -> dict:
+    """The fields an edit sets on an existing entry"""
     update_fields = {}
     
     # Update date if provided
@@ -901,33 +1374,16 @@ async def update_time_entry(
         date_str = entry_data.date or entry["date"]
         check_out_datetime = datetime.strptime(f"{date_str} {entry_data.check_out}", "%Y-%m-%d %H:%M")
         update_fields["check_out"] = check_out_datetime
+        update_fields["auto_closed"] = False
         
         # Set status to completed if both times exist
         if "check_in" in update_fields or entry.get("check_in"):
             update_fields["status"] = "completed"
     
-    if update_fields:
-        await db.time_entries.update_one(
-            {"id": entry_id},
-            {"$set": update_fields}
-        )
-    
-    updated_entry = await db.time_entries.find_one({"id": entry_id})
-    return TimeEntry(**updated_entry)
+    return update_fields
 
-@app.post("/api/time/entries")
-async def create_time_entry(
-    entry_data: TimeEntryCreate,
-    company_id: str = Depends(get_company_context),
-    current_user: User = Depends(get_admin_user)
-):
-    """Create a manual time entry (admin only, company-scoped)"""
-    # Verify employee exists and belongs to company
-    employee = await db.employees.find_one({"id": entry_data.employee_id, "company_id": company_id})
-    if not employee:
-        raise HTTPException(status_code=404, detail="Employee not found")
-    
-    # Parse times
+def _new_time_entry(entry_data: TimeEntryCreate, company_id: str) -> TimeEntry:
+    """A manually entered shift; completed when it has a check-out"""
     check_in_datetime = datetime.strptime(f"{entry_data.date} {entry_data.check_in}", "%Y-%m-%d %H:%M")
     check_out_datetime = None
     status = "working"
@@ -936,45 +1392,326 @@ async def create_time_entry(
         check_out_datetime = datetime.strptime(f"{entry_data.date} {entry_data.check_out}", "%Y-%m-%d %H:%M")
         status = "completed"
     
-    time_entry = TimeEntry(
+    return TimeEntry(
         employee_id=entry_data.employee_id,
+        company_id=company_id,
         check_in=check_in_datetime,
         check_out=check_out_datetime,
         date=entry_data.date,
         status=status,
         last_scan_time=datetime.now()
     )
+
+async def _find_time_entry(tenant_db, entry_id: str, company_id: str) -> dict:
+    """A time entry of a company employee, hot or archived; 404 otherwise"""
+    entry = await tenant_db.time_entries.find_one({"id": entry_id})
+    if not entry:
+        entry = (await archive.find_archived_by_ids(tenant_db, [entry_id])).get(entry_id)
+    if not entry:
+        raise HTTPException(status_code=404, detail="Time entry not found")
     
-    await db.time_entries.insert_one(time_entry.dict())
-    return time_entry
+    # Verify employee belongs to company
+    employee = await tenant_db.employees.find_one({"id": entry["employee_id"], "company_id": company_id})
+    if not employee:
+        raise HTTPException(status_code=404, detail="Time entry not found")
+    return entry
 
-@app.delete("/api/time/entries/{entry_id}")
-async def delete_time_entry(
+@router.put("/api/time/entries/{entry_id}")
+async def update_time_entry(
     entry_id: str,
+    entry_data: TimeEntryEdit,
     company_id: str = Depends(get_company_context),
+    tenant_db = Depends(get_tenant_db),
     current_user: User = Depends(get_admin_user)
 ):
-    """Delete a time entry (admin only, company-scoped)"""
-    # Get entry and verify it belongs to company employee
-    entry = await db.time_entries.find_one({"id": entry_id})
-    if not entry:
-        raise HTTPException(status_code=404, detail="Time entry not found")
+    """Update a time entry (admin only, company-scoped)"""
+    entry = await _find_time_entry(tenant_db, entry_id, company_id)
+    update_fields = _time_entry_changes(entry, entry_data)
     
-    # Verify employee belongs to company
-    employee = await db.employees.find_one({"id": entry["employee_id"], "company_id": company_id})
+    if entry.get("archived"):
+        if update_fields:
+            entry = await archive.update_archived_entry(tenant_db, entry, update_fields)
+            await directory.touch_activity(db, company_id)
+        return TimeEntry(**entry)
+    
+    if update_fields:
+        await tenant_db.time_entries.update_one(
+            {"id": entry_id},
+            {"$set": update_fields}
+        )
+        await directory.touch_activity(db, company_id)
+    
+    updated_entry = await tenant_db.time_entries.find_one({"id": entry_id})
+    return TimeEntry(**updated_entry)
+
+@router.post("/api/time/entries")
+async def create_time_entry(
+    entry_data: TimeEntryCreate,
+    company_id: str = Depends(get_company_context),
+    tenant_db = Depends(get_tenant_db),
+    current_user: User = Depends(get_admin_user)
+):
+    """Create a manual time entry (admin only, company-scoped)"""
+    # Verify employee exists and belongs to company
+    employee = await tenant_db.employees.find_one({"id": entry_data.employee_id, "company_id": company_id})
     if not employee:
-        raise HTTPException(status_code=404, detail="Time entry not found")
+        raise HTTPException(status_code=404, detail="Employee not found")
     
-    result = await db.time_entries.delete_one({"id": entry_id})
-    if result.deleted_count == 0:
+    time_entry = _new_time_entry(entry_data, company_id)
+    await tenant_db.time_entries.insert_one(time_entry.dict())
+    await directory.touch_activity(db, company_id)
+    return time_entry
+
+@router.post("/api/time/entries/bulk")
+async def bulk_time_entries(
+    bulk_data: TimeEntryBulkRequest,
+    company_id: str = Depends(get_company_context),
+    tenant_db = Depends(get_tenant_db),
+    current_user: User = Depends(get_admin_user)
+):
+    """Create, update and delete many time entries in one write (admin only, company-scoped).
+
+    Every operation gets its own result; one failing operation does not stop the others.
+    """
+    operations = bulk_data.operations
+    results = [{"index": index, "action": operation.action, "id": operation.id} for index, operation in
+               enumerate(operations)]
+
+    # Ownership of everything referenced, checked with one query per collection
+    entry_ids = [operation.id for operation in operations if operation.action != "create" and operation.id]
+    entries = {
+        entry["id"]: entry for entry in await tenant_db.time_entries.find(
+            {"id": {"$in": entry_ids}}, {"_id": 0}
+        ).to_list(None)
+    }
+    # Entries the archive job has moved out are edited in their monthly bucket
+    entries.update(await archive.find_archived_by_ids(tenant_db, [
+        entry_id for entry_id in entry_ids if entry_id not in entries
+    ]))
+    employee_ids = {entry["employee_id"] for entry in entries.values()} | {
+        operation.employee_id for operation in operations if operation.action == "create" and operation.employee_id
+    }
+    owned_employees = set(await tenant_db.employees.distinct(
+        "id", {"id": {"$in": list(employee_ids)}, "company_id": company_id}
+    ))
+    repeated = {entry_id for entry_id, count in Counter(entry_ids).items() if count > 1}
+
+    writes, written = [], []  # bulk_write requests and the result index of each
+    archived_writes = []  # (result, entry, update fields or None to delete) of archived entries
+    for result, operation in zip(results, operations):
+        try:
+            if operation.action == "create":
+                if operation.employee_id not in owned_employees:
+                    raise HTTPException(status_code=404, detail="Employee not found")
+                if not operation.date or not operation.check_in:
+                    raise HTTPException(status_code=400, detail="Podaj datę i godzinę rozpoczęcia")
+                time_entry = _new_time_entry(TimeEntryCreate(
+                    employee_id=operation.employee_id, check_in=operation.check_in,
+                    check_out=operation.check_out, date=operation.date
+                ), company_id)
+                result["id"] = time_entry.id
+                result["entry"] = time_entry.dict()
+                writes.append(InsertOne(time_entry.dict()))
+            else:
+                entry = entries.get(operation.id)
+                if not entry or entry["employee_id"] not in owned_employees:
+                    raise HTTPException(status_code=404, detail="Time entry not found")
+                if operation.id in repeated:
+                    raise HTTPException(status_code=400, detail="Wpis występuje w żądaniu więcej niż raz")
+                if operation.action == "delete":
+                    if entry.get("archived"):
+                        archived_writes.append((result, entry, None))
+                        continue
+                    writes.append(DeleteOne({"id": operation.id}))
+                else:
+                    update_fields = _time_entry_changes(entry, TimeEntryEdit(
+                        check_in=operation.check_in, check_out=operation.check_out, date=operation.date
+                    ))
+                    result["entry"] = TimeEntry(**{**entry, **update_fields}).dict()
+                    if not update_fields:
+                        result["status"] = "ok"
+                        continue
+                    if entry.get("archived"):
+                        archived_writes.append((result, entry, update_fields))
+                        continue
+                    writes.append(UpdateOne({"id": operation.id}, {"$set": update_fields}))
+        except HTTPException as exc:
+            result.update(status="error", status_code=exc.status_code, detail=exc.detail)
+            continue
+        except ValueError:
+            result.update(status="error", status_code=400, detail="Nieprawidłowy format daty lub godziny")
+            continue
+        written.append(result)
+
+    failed_writes = {}
+    if writes:
+        try:
+            await tenant_db.time_entries.bulk_write(writes, ordered=False)
+        except BulkWriteError as exc:
+            failed_writes = {error["index"]: error.get("errmsg", "") for error in exc.details.get("writeErrors", [])}
+        await directory.touch_activity(db, company_id)
+    for index, result in enumerate(written):
+        if index in failed_writes:
+            result.update(status="error", status_code=409, detail=failed_writes[index])
+            result.pop("entry", None)
+        else:
+            result["status"] = "ok"
+    # Rare corrections of old shifts; one bucket update each
+    for result, entry, update_fields in archived_writes:
+        if update_fields is None:
+            if await archive.delete_archived_entry(tenant_db, entry):
+                result["status"] = "ok"
+            else:
+                result.update(status="error", status_code=404, detail="Time entry not found")
+        else:
+            result["entry"] = TimeEntry(**await archive.update_archived_entry(tenant_db, entry, update_fields)).dict()
+            result["status"] = "ok"
+    if archived_writes and not writes:
+        await directory.touch_activity(db, company_id)
+
+    failed = sum(result["status"] == "error" for result in results)
+    return {"applied": len(results) - failed, "failed": failed, "results": results}
+
+@router.delete("/api/time/entries/{entry_id}")
+async def delete_time_entry(
+    entry_id: str,
+    company_id: str = Depends(get_company_context),
+    tenant_db = Depends(get_tenant_db),
+    current_user: User = Depends(get_admin_user)
+):
+    """Delete a time entry (admin only, company-scoped)"""
+    entry = await _find_time_entry(tenant_db, entry_id, company_id)
+    if entry.get("archived"):
+        deleted = await archive.delete_archived_entry(tenant_db, entry)
+    else:
+        deleted = (await tenant_db.time_entries.delete_one({"id": entry_id})).deleted_count > 0
+    if not deleted:
         raise HTTPException(status_code=404, detail="Time entry not found")
+    await directory.touch_activity(db, company_id)
     
     return {"message": "Time entry deleted successfully"}
 
-@app.get("/api/")
+async def ensure_indexes():
+    await db.companies.create_index("id", unique=True)
+    await db.users.create_index("username")
+    await db.users.create_index("company_id")
+    await directory.ensure_indexes(db)
+    await tenancy.ensure_indexes(db)
+    for tenant_db in await tenancy.tenant_databases(db):
+        await tenancy.ensure_tenant_indexes(tenant_db)
+    await job_queue.ensure_indexes()
+    await idempotency_store.ensure_indexes()
+
+@router.get("/api/owner/slow-queries")
+async def get_slow_queries(
+    limit: int = 100,
+    current_owner: Owner = Depends(get_current_owner)
+):
+    """Most recent slow MongoDB commands, newest first, with their sampled query plans (owner only)"""
+    return {
+        "threshold_ms": slow_query_listener.threshold_ms,
+        "entries": slow_query_listener.recent(limit)
+    }
+
+@router.get("/api/owner/admission")
+async def get_admission(
+    request: Request,
+    limit: int = Query(20, ge=1, le=200),
+    current_owner: Owner = Depends(get_current_owner)
+):
+    """Admission lanes of this worker process with their busiest companies, and scan latency (owner only)"""
+    return request.app.state.admission.snapshot(limit)
+
+@router.get("/api/metrics", include_in_schema=False)
+async def get_metrics(request: Request):
+    """Prometheus scrape endpoint"""
+    if METRICS_TOKEN and request.headers.get("Authorization") != f"Bearer {METRICS_TOKEN}":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return Response(content=metrics.registry.render(), media_type="text/plain; version=0.0.4")
+
+@router.get("/api/")
 async def root():
     return {"message": "Multi-Tenant Time Tracking System API"}
 
+class InFlightRequests:
+    """Counts HTTP requests still being served, so shutdown can wait for them"""
+
+    def __init__(self):
+        self.count = 0
+        self.idle = asyncio.Event()
+        self.idle.set()
+
+    def middleware(self, app):
+        async def track(scope, receive, send):
+            if scope["type"] != "http":
+                return await app(scope, receive, send)
+            self.count += 1
+            self.idle.clear()
+            try:
+                await app(scope, receive, send)
+            finally:
+                self.count -= 1
+                if not self.count:
+                    self.idle.set()
+        return track
+
+    async def drain(self, timeout: float):
+        try:
+            await asyncio.wait_for(self.idle.wait(), timeout)
+        except asyncio.TimeoutError:
+            logger.warning("Shutting down with %d requests still in flight", self.count)
+
+async def warm_pool():
+    """Open MONGO_MIN_POOL_SIZE connections up front instead of on the first requests"""
+    await asyncio.gather(*(client.admin.command("ping") for _ in range(max(1, database.MONGO_MIN_POOL_SIZE))))
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    connect()
+    slow_query_listener.attach(client, asyncio.get_running_loop())
+    await warm_pool()
+    await ensure_indexes()
+    if JOB_WORKERS_IN_API:
+        job_queue.start()
+    try:
+        yield
+    finally:
+        await app.state.in_flight.drain(SHUTDOWN_DRAIN_SECONDS)
+        await job_queue.stop()
+        timesheets.shutdown()
+        passwords.shutdown()
+        client.close()
+
+def create_app() -> FastAPI:
+    """Build the API; each server worker calls this and opens its own resources in the lifespan"""
+    app = FastAPI(title="Multi-Tenant Time Tracking System", lifespan=lifespan)
+
+    # Innermost, so requests refused admission still get CORS headers and metrics
+    app.state.admission = admission.Lanes()
+    app.add_middleware(admission.AdmissionMiddleware, lanes=app.state.admission,
+                       secret_key=SECRET_KEY, algorithm=ALGORITHM)
+    # Outside admission, so a replayed response costs neither a turn nor a database read
+    app.add_middleware(idempotency.IdempotencyMiddleware, store=idempotency_store, routes=IDEMPOTENT_ROUTES,
+                       secret_key=SECRET_KEY, algorithm=ALGORITHM)
+
+    # CORS middleware
+    app.add_middleware(
+        CORSMiddleware,
+        allow_origins=["*"],
+        allow_credentials=True,
+        allow_methods=["*"],
+        allow_headers=["*"],
+        expose_headers=["X-Roster-Signature", "Idempotent-Replayed"],
+    )
+    app.add_middleware(metrics.MetricsMiddleware)
+    # Added last so it is outermost: a request counts until its response has been sent
+    app.state.in_flight = InFlightRequests()
+    app.add_middleware(app.state.in_flight.middleware)
+    app.include_router(router)
+    return app
+
+app = create_app()
+
 if __name__ == "__main__":
     import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8001)
\ No newline at end of file
+    uvicorn.run("server:create_app", factory=True, host="0.0.0.0", port=8001)
\ No newline at end of file
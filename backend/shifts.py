@@ -0,0 +1,114 @@
+"""Auto-close of forgotten open shifts.
+
+A scan only checks out the employee's open entry of the same day, so an entry
+left at `status: "working"` after a forgotten check-out stays open for good
+and skews every report. `sweep_open_shifts` finds shifts that have been open
+longer than their company's `max_shift_hours` and, per the company's shift
+policy, either:
+
+- `close`: checks the shift out at the company's `default_check_out` time on
+  the day of the shift, or after `max_shift_hours` when that time does not fit
+  the shift; the entry is marked `auto_closed`.
+- `flag`: sets its status to `unclosed`, for an admin to enter the real
+  check-out time (which completes it).
+
+Open entries are found through a partial index on `check_in` that only holds
+entries with `status: "working"`, so the sweep never reads completed history.
+"""
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+import asyncio
+import os
+
+from pymongo import UpdateOne
+
+SHIFT_SWEEP_INTERVAL_SECONDS = int(os.environ.get('SHIFT_SWEEP_INTERVAL_SECONDS', 15 * 60))
+SHIFT_SWEEP_BATCH_SIZE = int(os.environ.get('SHIFT_SWEEP_BATCH_SIZE', 500))
+SHIFT_SWEEP_BATCH_PAUSE_SECONDS = float(os.environ.get('SHIFT_SWEEP_BATCH_PAUSE_SECONDS', 0.05))
+
+SHIFT_ACTIONS = ("close", "flag")
+DEFAULT_SHIFT_POLICY = {"max_shift_hours": 16, "default_check_out": None, "action": "flag"}
+
+async def ensure_indexes(db):
+    await db.time_entries.create_index(
+        [("check_in", 1), ("id", 1)], name="open_shifts",
+        partialFilterExpression={"status": "working"}
+    )
+
+def shift_policy(company: Optional[dict]) -> dict:
+    """The company's shift policy, with defaults for whatever it leaves unset"""
+    policy = dict(DEFAULT_SHIFT_POLICY)
+    policy.update({key: value for key, value in ((company or {}).get("shift_policy") or {}).items()
+                   if key in DEFAULT_SHIFT_POLICY})
+    return policy
+
+def close_time(entry: dict, policy: dict) -> datetime:
+    """When an auto-closed shift ends: the default check-out time if it fits the shift, else its maximum length"""
+    latest = entry["check_in"] + timedelta(hours=policy["max_shift_hours"])
+    if policy["default_check_out"]:
+        default = datetime.strptime(f"{entry['date']} {policy['default_check_out']}", "%Y-%m-%d %H:%M")
+        if entry["check_in"] < default <= latest:
+            return default
+    return latest
+
+def _resolution(entry: dict, policy: dict, now: datetime) -> Optional[dict]:
+    """The $set that closes or flags a stale entry, or None while it may still be a running shift"""
+    if entry["check_in"] + timedelta(hours=policy["max_shift_hours"]) > now:
+        return None
+    if policy["action"] == "close":
+        return {"check_out": close_time(entry, policy), "status": "completed", "auto_closed": True}
+    return {"status": "unclosed", "flagged_at": now}
+
+async def sweep_open_shifts(
+    db,
+    policies: Dict[str, dict],
+    now: Optional[datetime] = None,
+    on_batch=None,
+    exclude_employee_ids: Optional[List[str]] = None
+) -> dict:
+    """Close or flag the stale open shifts of one database; policies maps company id to shift policy"""
+    now = now or datetime.now()
+    stats = {"entries_checked": 0, "entries_closed": 0, "entries_flagged": 0}
+    if not policies:
+        return stats
+    # Nothing opened after this can be stale under any company's policy
+    cutoff = now - timedelta(hours=min(policy["max_shift_hours"] for policy in policies.values()))
+    excluded = set(exclude_employee_ids or ())
+    employee_companies: Dict[str, Optional[str]] = {}
+
+    last = None
+    while True:
+        query = {"status": "working", "check_in": {"$lt": cutoff}}
+        if last:
+            # Entries that are not stale yet stay open; page past them instead of reading them again
+            query["$or"] = [{"check_in": {"$gt": last[0]}}, {"check_in": last[0], "id": {"$gt": last[1]}}]
+        entries = await db.time_entries.find(
+            query, {"_id": 0, "id": 1, "employee_id": 1, "check_in": 1, "date": 1}
+        ).sort([("check_in", 1), ("id", 1)]).limit(SHIFT_SWEEP_BATCH_SIZE).to_list(SHIFT_SWEEP_BATCH_SIZE)
+        if not entries:
+            return stats
+        last = (entries[-1]["check_in"], entries[-1]["id"])
+
+        unknown = list({entry["employee_id"] for entry in entries} - employee_companies.keys())
+        if unknown:
+            employee_companies.update(dict.fromkeys(unknown))
+            async for employee in db.employees.find({"id": {"$in": unknown}}, {"_id": 0, "id": 1, "company_id": 1}):
+                employee_companies[employee["id"]] = employee["company_id"]
+
+        operations = []
+        for entry in entries:
+            policy = policies.get(employee_companies[entry["employee_id"]])
+            if policy is None or entry["employee_id"] in excluded:
+                continue
+            changes = _resolution(entry, policy, now)
+            if changes:
+                # Only while still open, so a check-out scanned meanwhile wins
+                operations.append(UpdateOne({"id": entry["id"], "status": "working"}, {"$set": changes}))
+                stats["entries_closed" if changes["status"] == "completed" else "entries_flagged"] += 1
+
+        stats["entries_checked"] += len(entries)
+        if operations:
+            await db.time_entries.bulk_write(operations, ordered=False)
+        if on_batch:
+            await on_batch(len(entries), len(operations))
+        await asyncio.sleep(SHIFT_SWEEP_BATCH_PAUSE_SECONDS)
@@ -0,0 +1,188 @@
+"""Slow MongoDB query log with sampled explain() capture.
+
+`SlowQueryListener` watches every command through pymongo command monitoring.
+Commands slower than SLOW_QUERY_MS are tagged with the route and company of
+the request that issued them and kept in a bounded ring buffer. For a sample
+of slow reads the command is re-run as `explain` in executionStats mode on the
+event loop, recording whether it scanned the collection or an index and how
+many keys and documents it examined for what it returned.
+"""
+from collections import deque
+from datetime import datetime
+from pymongo import monitoring
+from typing import List, Optional
+import asyncio
+import logging
+import os
+import random
+import threading
+
+import metrics
+
+SLOW_QUERY_MS = float(os.environ.get('SLOW_QUERY_MS', 100))
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE = float(os.environ.get('SLOW_QUERY_EXPLAIN_SAMPLE_RATE', 0.2))
+SLOW_QUERY_LOG_SIZE = int(os.environ.get('SLOW_QUERY_LOG_SIZE', 200))
+
+EXPLAINABLE_COMMANDS = {"find", "aggregate", "count", "distinct", "findAndModify", "update", "delete"}
+READ_COMMANDS = {"find", "aggregate", "count", "distinct"}
+# Session and routing fields the driver adds, which explain does not accept
+DRIVER_FIELDS = {"lsid", "$db", "$clusterTime", "$readPreference", "txnNumber", "autocommit", "startTransaction"}
+
+logger = logging.getLogger(__name__)
+
+def query_shape(value, depth: int = 0):
+    """Replace literal values in a query with placeholders, keeping operators and field names"""
+    if depth > 6:
+        return "..."
+    if isinstance(value, dict):
+        return {key: query_shape(item, depth + 1) for key, item in value.items()}
+    if isinstance(value, list):
+        if value and isinstance(value[0], dict):
+            return [query_shape(value[0], depth + 1)]
+        return f"<{len(value)} values>"
+    return "?"
+
+def _find_key(document, key: str):
+    """Depth-first search for key in nested explain output"""
+    if isinstance(document, dict):
+        if key in document:
+            return document[key]
+        children = document.values()
+    elif isinstance(document, list):
+        children = document
+    else:
+        return None
+    for child in children:
+        found = _find_key(child, key)
+        if found is not None:
+            return found
+    return None
+
+def _plan_stages(plan, stages: list):
+    if isinstance(plan, dict):
+        if "stage" in plan:
+            stages.append(plan)
+        for key in ("inputStage", "inputStages", "queryPlan"):
+            if key in plan:
+                _plan_stages(plan[key], stages)
+    elif isinstance(plan, list):
+        for item in plan:
+            _plan_stages(item, stages)
+    return stages
+
+def summarize_explain(explain: dict) -> dict:
+    """Reduce explain output to the plan type, winning index and examined/returned counts"""
+    winning_plan = _find_key(explain, "winningPlan") or {}
+    stages = _plan_stages(winning_plan, [])
+    stage_names = [stage["stage"] for stage in stages]
+    index_names = [stage["indexName"] for stage in stages if stage.get("indexName")]
+    execution = _find_key(explain, "executionStats") or {}
+
+    if "COLLSCAN" in stage_names:
+        plan = "COLLSCAN"
+    elif "IXSCAN" in stage_names or "EXPRESS_IXSCAN" in stage_names or "IDHACK" in stage_names:
+        plan = "IXSCAN"
+    else:
+        plan = stage_names[0] if stage_names else None
+
+    returned = execution.get("nReturned")
+    docs_examined = execution.get("totalDocsExamined")
+    return {
+        "plan": plan,
+        "stages": stage_names,
+        "index": index_names[0] if index_names else None,
+        "keys_examined": execution.get("totalKeysExamined"),
+        "docs_examined": docs_examined,
+        "returned": returned,
+        "docs_examined_per_returned": (
+            round(docs_examined / max(returned, 1), 2) if docs_examined is not None and returned is not None else None
+        )
+    }
+
+def explain_command(command: dict) -> dict:
+    return {key: value for key, value in command.items() if key not in DRIVER_FIELDS}
+
+class SlowQueryListener(monitoring.CommandListener):
+    def __init__(self, threshold_ms: float = SLOW_QUERY_MS, sample_rate: float = SLOW_QUERY_EXPLAIN_SAMPLE_RATE,
+                 size: int = SLOW_QUERY_LOG_SIZE):
+        self.threshold_ms = threshold_ms
+        self.sample_rate = sample_rate
+        self.entries = deque(maxlen=size)
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._client = None
+        self._loop = None
+
+    def attach(self, client, loop: asyncio.AbstractEventLoop):
+        """Enable explain capture, which needs a client and the loop it runs on"""
+        self._client = client
+        self._loop = loop
+
+    def started(self, event):
+        if event.command_name in EXPLAINABLE_COMMANDS:
+            with self._lock:
+                self._pending[(event.connection_id, event.request_id)] = event.command
+
+    def succeeded(self, event):
+        self._finish(event)
+
+    def failed(self, event):
+        self._finish(event, failed=True)
+
+    def _finish(self, event, failed: bool = False):
+        with self._lock:
+            command = self._pending.pop((event.connection_id, event.request_id), None)
+        duration_ms = event.duration_micros / 1000
+        if duration_ms < self.threshold_ms or event.command_name == "explain":
+            return
+
+        stats = metrics.current_request.get()
+        entry = {
+            "time": datetime.utcnow(),
+            "command": event.command_name,
+            "database": event.database_name,
+            "collection": command.get(event.command_name) if command else None,
+            "duration_ms": round(duration_ms, 1),
+            "failed": failed,
+            "route": stats.route if stats else "background",
+            "company_id": stats.company_id if stats else None,
+            "query": query_shape(self._query_of(command)) if command else None,
+            "explain": None
+        }
+        with self._lock:
+            self.entries.append(entry)
+        logger.warning(
+            "Slow query: %s %s.%s took %.1f ms (route %s, company %s)",
+            entry["command"], entry["database"], entry["collection"], duration_ms,
+            entry["route"], entry["company_id"]
+        )
+
+        if (command and not failed and self._loop and event.command_name in READ_COMMANDS
+                and random.random() < self.sample_rate):
+            asyncio.run_coroutine_threadsafe(self._explain(entry, event.database_name, command), self._loop)
+
+    @staticmethod
+    def _query_of(command: dict):
+        for key in ("filter", "query", "pipeline", "updates", "deletes"):
+            if key in command:
+                return command[key]
+        return None
+
+    async def _explain(self, entry: dict, database_name: str, command: dict):
+        # Not attributed to any request, and "explain" itself is never logged
+        metrics.current_request.set(None)
+        try:
+            result = await self._client[database_name].command(
+                {"explain": explain_command(command), "verbosity": "executionStats"}
+            )
+            entry["explain"] = summarize_explain(result)
+        except Exception as e:
+            entry["explain"] = {"error": str(e)}
+
+    def recent(self, limit: Optional[int] = None) -> List[dict]:
+        with self._lock:
+            entries = list(self.entries)
+        entries.reverse()
+        return entries[:limit] if limit else entries
+
+slow_query_listener = SlowQueryListener()
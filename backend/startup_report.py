@@ -0,0 +1,99 @@
+"""Startup timing report for an API worker.
+
+Measures, in this fresh process, how long a worker takes to become useful:
+importing server.py, building the app with create_app(), running the lifespan
+startup (MongoDB connect, pool warm-up, indexes, job workers) and serving the
+first request. Also lists the slowest top-level imports, measured with
+`python -X importtime` in a separate interpreter.
+
+    python startup_report.py
+    python startup_report.py --json
+"""
+import argparse
+import asyncio
+import json
+import subprocess
+import sys
+import time
+from pathlib import Path
+
+started = time.perf_counter()
+
+def slowest_imports(limit: int):
+    """Cumulative import time of the modules server.py imports directly, slowest first"""
+    output = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import server"],
+        cwd=Path(__file__).parent, capture_output=True, text=True
+    ).stderr
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith("import time:") or "|" not in line:
+            continue
+        _, cumulative, name = line.split("|")
+        # After the column separator's space, direct imports of server are indented by two more
+        indent = len(name) - len(name.lstrip())
+        if indent != 3 or not cumulative.strip().isdigit():
+            continue
+        imports.append({"module": name.strip(), "ms": round(int(cumulative) / 1000, 1)})
+    return sorted(imports, key=lambda item: item["ms"], reverse=True)[:limit]
+
+async def measure(stages: dict):
+    import httpx
+    import server
+
+    stages["import"] = time.perf_counter() - started
+
+    mark = time.perf_counter()
+    app = server.create_app()
+    stages["create_app"] = time.perf_counter() - mark
+
+    server.JOB_WORKERS_IN_API = False  # Starting the job workers is not part of readiness
+    mark = time.perf_counter()
+    async with server.lifespan(app):
+        stages["lifespan_startup"] = time.perf_counter() - mark
+
+        mark = time.perf_counter()
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://startup") as client:
+            response = await client.post("/api/auth/login", json={"username": "", "password": ""})
+        stages["first_request"] = time.perf_counter() - mark
+        stages["first_request_status"] = response.status_code
+
+def main():
+    parser = argparse.ArgumentParser(description="Time each phase of API worker startup")
+    parser.add_argument("--json", action="store_true", help="Print the report as JSON")
+    parser.add_argument("--imports", type=int, default=10, help="How many of the slowest imports to list")
+    args = parser.parse_args()
+
+    stages = {}
+    error = None
+    try:
+        asyncio.run(measure(stages))
+    except Exception as exc:  # Report what was measured before MongoDB or the app failed
+        error = f"{type(exc).__name__}: {exc}"
+    stages["ready"] = time.perf_counter() - started
+
+    report = {
+        "stages_ms": {name: round(value * 1000, 1) for name, value in stages.items()
+                      if name != "first_request_status"},
+        "first_request_status": stages.get("first_request_status"),
+        "slowest_imports": slowest_imports(args.imports),
+        "error": error,
+    }
+    if args.json:
+        print(json.dumps(report, indent=2))
+        return 1 if error else 0
+
+    print(f"{'stage':20} {'ms':>10}")
+    for name, value in report["stages_ms"].items():
+        print(f"{name:20} {value:>10}")
+    print(f"\n{'slowest imports':40} {'ms':>10}")
+    for item in report["slowest_imports"]:
+        print(f"{item['module']:40} {item['ms']:>10}")
+    if error:
+        print(f"\n❌ Startup failed: {error}")
+        return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
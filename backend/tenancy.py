@@ -0,0 +1,271 @@
+"""Tenant data placement: shared collections or a database per company.
+
+A company's employees, time entries and archive buckets live either in the
+shared database or in a dedicated database of their own. Which one is recorded
+in the `tenants` registry collection of the shared database; companies
+without an entry are shared. Users, companies, owners and jobs always stay in
+the shared database, since login and the owner views look them up across
+companies.
+
+`tenant_database` resolves a company to its database, caching registry
+entries for TENANT_CACHE_SECONDS. `migrate_company` moves a company between
+placements while it keeps working:
+
+1. copy     - batches are copied while the API keeps reading and writing the source
+2. freeze   - writes to the company are refused (the API answers 503) and, after
+              every process has seen the freeze, the copy is brought up to date
+3. flip     - the registry points at the target; the freeze is lifted
+4. cleanup  - once every process routes to the target, the source copy is removed
+
+Until the flip the source stays authoritative, so a failed migration is rolled
+back by deleting whatever was copied. Background jobs skip companies that are
+being migrated.
+"""
+from datetime import datetime
+from pymongo import DeleteOne, ReplaceOne
+from pymongo.read_preferences import ReadPreference
+from typing import List, Optional
+import asyncio
+import logging
+import os
+import time
+
+import archive
+import retention
+import roster
+import search
+import shifts
+
+TENANT_CACHE_SECONDS = float(os.environ.get('TENANT_CACHE_SECONDS', 15))
+# Extra wait after the cache period, for writes that were already in flight
+TENANT_FREEZE_GRACE_SECONDS = float(os.environ.get('TENANT_FREEZE_GRACE_SECONDS', 5))
+TENANT_MIGRATION_BATCH_SIZE = int(os.environ.get('TENANT_MIGRATION_BATCH_SIZE', 1000))
+TENANT_DATABASE_PREFIX = os.environ.get('TENANT_DATABASE_PREFIX')  # default: "<shared db>_tenant_"
+
+# Collections that hold a company's own data, in copy order
+TENANT_COLLECTIONS = ("employees", "time_entries", "time_entries_archive", "roster_tombstones")
+
+logger = logging.getLogger(__name__)
+
+# company_id -> (monotonic expiry, registry entry or None)
+_registry_cache = {}
+
+class TenantFrozen(Exception):
+    """The company is in the frozen phase of a migration and cannot be written to"""
+
+class MigrationError(Exception):
+    pass
+
+def clear_cache():
+    _registry_cache.clear()
+
+def _primary(db):
+    """The registry is always read from the primary, whatever handle the caller has"""
+    return db.client.get_database(db.name, read_preference=ReadPreference.PRIMARY)
+
+def dedicated_database_name(db, company_id: str) -> str:
+    prefix = TENANT_DATABASE_PREFIX or f"{db.name}_tenant_"
+    return prefix + company_id.replace("-", "")[:16]
+
+async def ensure_indexes(db):
+    await db.tenants.create_index("company_id", unique=True)
+    await db.tenants.create_index("state")
+
+async def ensure_tenant_indexes(db):
+    """Indexes of the per-company collections, in the shared database or a dedicated one"""
+    await db.employees.create_index("id", unique=True)
+    await db.employees.create_index([("company_id", 1), ("number", 1)])
+    await db.employees.create_index([("company_id", 1), ("id", 1)])
+    await db.time_entries.create_index("id", unique=True)
+    await db.time_entries.create_index([("employee_id", 1), ("date", 1)])
+    await archive.ensure_indexes(db)
+    await retention.ensure_indexes(db)
+    await search.ensure_indexes(db)
+    await shifts.ensure_indexes(db)
+    await roster.ensure_indexes(db)
+
+async def registry_entry(db, company_id: str, fresh: bool = False) -> Optional[dict]:
+    now = time.monotonic()
+    cached = _registry_cache.get(company_id)
+    if cached and cached[0] > now and not fresh:
+        return cached[1]
+    entry = await _primary(db).tenants.find_one({"company_id": company_id}, {"_id": 0})
+    _registry_cache[company_id] = (now + TENANT_CACHE_SECONDS, entry)
+    return entry
+
+async def tenant_database(db, company_id: str, write: bool = False):
+    """The database holding a company's data, with the same read preference as `db`"""
+    entry = await registry_entry(db, company_id)
+    if not entry:
+        return db
+    if write and entry.get("state") == "frozen":
+        raise TenantFrozen(company_id)
+    if entry.get("placement") != "dedicated":
+        return db
+    return db.client.get_database(entry["database"], read_preference=db.read_preference)
+
+async def tenant_databases(db) -> list:
+    """The shared database followed by every dedicated one"""
+    names = await _primary(db).tenants.distinct("database", {"placement": "dedicated"})
+    return [db] + [db.client.get_database(name, read_preference=db.read_preference) for name in sorted(names)]
+
+async def migrating_companies(db) -> List[str]:
+    """Companies in the middle of a migration, which background jobs leave alone"""
+    return await _primary(db).tenants.distinct("company_id", {"state": {"$in": ["copying", "frozen"]}})
+
+async def migration_exclusions(db, tenant_db) -> dict:
+    """Employee and company filters keeping batch jobs in tenant_db away from migrating companies"""
+    migrating = await migrating_companies(db)
+    if not migrating:
+        return {"employee_ids": [], "company_ids": []}
+    employee_ids = await tenant_db.employees.distinct("id", {"company_id": {"$in": migrating}})
+    return {"employee_ids": employee_ids, "company_ids": migrating}
+
+def _tenant_filters(company_id: str, employee_ids: List[str]) -> dict:
+    return {
+        "employees": {"company_id": company_id},
+        "time_entries": {"employee_id": {"$in": employee_ids}},
+        "time_entries_archive": {"company_id": company_id},
+        "roster_tombstones": {"company_id": company_id},
+    }
+
+async def _employee_ids(tenant_db, company_id: str) -> List[str]:
+    return await tenant_db.employees.distinct("id", {"company_id": company_id})
+
+async def _batches(collection, query: dict, batch_size: int):
+    """Documents matching query in _id order, a batch at a time"""
+    last_id = None
+    while True:
+        batch_query = dict(query)
+        if last_id is not None:
+            batch_query["_id"] = {"$gt": last_id}
+        documents = await collection.find(batch_query).sort("_id", 1).limit(batch_size).to_list(batch_size)
+        if not documents:
+            return
+        last_id = documents[-1]["_id"]
+        yield documents
+
+async def _copy(source, target, company_id: str, batch_size: int, report) -> dict:
+    """Copy (or bring up to date) every tenant document; only differing documents are written"""
+    stats = {}
+    employee_ids = await _employee_ids(source, company_id)
+    for name, query in _tenant_filters(company_id, employee_ids).items():
+        written = 0
+        async for documents in _batches(source[name], query, batch_size):
+            existing = await target[name].find({"_id": {"$in": [doc["_id"] for doc in documents]}}).to_list(None)
+            existing = {doc["_id"]: doc for doc in existing}
+            operations = [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True)
+                          for doc in documents if existing.get(doc["_id"]) != doc]
+            if operations:
+                await target[name].bulk_write(operations, ordered=False)
+                written += len(operations)
+
+        # Documents deleted from the source since they were copied
+        deleted = 0
+        async for documents in _batches(target[name], query, batch_size):
+            ids = [doc["_id"] for doc in documents]
+            still_there = {doc["_id"] for doc in await source[name].find({"_id": {"$in": ids}}, {"_id": 1}).to_list(None)}
+            gone = [DeleteOne({"_id": _id}) for _id in ids if _id not in still_there]
+            if gone:
+                await target[name].bulk_write(gone, ordered=False)
+                deleted += len(gone)
+        stats[name] = {"written": written, "deleted": deleted}
+        report(f"{name}: {written} written, {deleted} deleted")
+    return stats
+
+async def _delete_tenant_data(tenant_db, company_id: str, batch_size: int) -> dict:
+    employee_ids = await _employee_ids(tenant_db, company_id)
+    stats = {}
+    # Employees last, so their ids are still known if this is interrupted and re-run
+    for name, query in reversed(list(_tenant_filters(company_id, employee_ids).items())):
+        deleted = 0
+        while True:
+            ids = [doc["_id"] for doc in await tenant_db[name].find(query, {"_id": 1}).limit(batch_size)
+                   .to_list(batch_size)]
+            if not ids:
+                break
+            deleted += (await tenant_db[name].delete_many({"_id": {"$in": ids}})).deleted_count
+        stats[name] = deleted
+    return stats
+
+async def _set_state(db, company_id: str, **fields):
+    await _primary(db).tenants.update_one(
+        {"company_id": company_id},
+        {"$set": {**fields, "updated_at": datetime.utcnow()}, "$setOnInsert": {"company_id": company_id}},
+        upsert=True
+    )
+    _registry_cache.pop(company_id, None)
+
+async def migrate_company(
+    db,
+    company_id: str,
+    placement: str,
+    database_name: Optional[str] = None,
+    batch_size: int = TENANT_MIGRATION_BATCH_SIZE,
+    propagation_seconds: Optional[float] = None,
+    keep_source: bool = False,
+    report=logger.info
+) -> dict:
+    """Move a company's data to `placement` ("dedicated" or "shared") without taking it offline"""
+    if placement not in ("dedicated", "shared"):
+        raise MigrationError(f"Unknown placement {placement}")
+    shared = _primary(db)
+    if not await shared.companies.find_one({"id": company_id, "deleted_at": None}, {"_id": 1}):
+        raise MigrationError(f"Company {company_id} not found")
+    entry = await registry_entry(db, company_id, fresh=True) or {"placement": "shared", "state": "active"}
+    if entry.get("state", "active") != "active":
+        raise MigrationError(f"Company {company_id} is already being migrated ({entry['state']})")
+
+    source = await tenant_database(shared, company_id)
+    if placement == "dedicated":
+        target_name = database_name or entry.get("database") or dedicated_database_name(db, company_id)
+        target = shared.client.get_database(target_name)
+    else:
+        target_name, target = None, shared
+    if entry.get("placement", "shared") == placement and source.name == target.name:
+        raise MigrationError(f"Company {company_id} is already in {target.name}")
+    wait = TENANT_CACHE_SECONDS + TENANT_FREEZE_GRACE_SECONDS if propagation_seconds is None else propagation_seconds
+    previous = {"placement": entry.get("placement", "shared"), "database": entry.get("database")}
+    started = time.monotonic()
+
+    await ensure_tenant_indexes(target)
+    await _set_state(db, company_id, state="copying", target_database=target.name, **previous)
+    try:
+        report(f"Copying {company_id} from {source.name} to {target.name}")
+        copied = await _copy(source, target, company_id, batch_size, report)
+
+        await _set_state(db, company_id, state="frozen")
+        report(f"Writes frozen; waiting {wait:.0f}s for every process to see it")
+        await asyncio.sleep(wait)
+        frozen_at = time.monotonic()
+        resynced = await _copy(source, target, company_id, batch_size, report)
+    except BaseException:
+        report("Migration failed; removing the partial copy and lifting the freeze")
+        await _delete_tenant_data(target, company_id, batch_size)
+        await _set_state(db, company_id, state="active", target_database=None, **previous)
+        raise
+
+    await _set_state(db, company_id, state="active", placement=placement, database=target_name,
+                     target_database=None, migrated_at=datetime.utcnow())
+    frozen_seconds = time.monotonic() - frozen_at
+    report(f"Flipped to {target.name} after {frozen_seconds:.1f}s frozen")
+
+    cleaned = {}
+    if not keep_source:
+        report(f"Waiting {wait:.0f}s before removing the copy in {source.name}")
+        await asyncio.sleep(wait)
+        cleaned = await _delete_tenant_data(source, company_id, batch_size)
+        if source.name != shared.name and not any(
+            [await source[name].estimated_document_count() for name in TENANT_COLLECTIONS]
+        ):
+            await shared.client.drop_database(source.name)
+    return {
+        "company_id": company_id,
+        "source": source.name,
+        "target": target.name,
+        "copied": copied,
+        "resynced": resynced,
+        "source_deleted": cleaned,
+        "frozen_seconds": round(frozen_seconds, 2),
+        "duration_seconds": round(time.monotonic() - started, 2),
+    }
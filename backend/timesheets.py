@@ -0,0 +1,293 @@
+"""Monthly timesheet PDFs.
+
+`render_timesheet` turns one employee's month of time entries into a PDF with
+a row per day, totals and signature lines for the employee and the employer.
+The PDF is written directly (PDF 1.4, the built-in Helvetica font with an
+encoding that covers Polish letters), so no rendering library is needed.
+
+Rendering is CPU-bound and runs in a process pool (`render`), never on the
+event loop. `company_timesheets_zip` streams a company's timesheets as a ZIP,
+rendering TIMESHEET_BATCH_SIZE employees at a time so memory stays bounded
+whatever the size of the company.
+"""
+from calendar import monthrange
+from concurrent.futures import ProcessPoolExecutor
+from datetime import date, datetime
+from typing import AsyncIterator, Dict, List, Optional
+import asyncio
+import multiprocessing
+import os
+import re
+import unicodedata
+import zipfile
+import zlib
+
+import archive
+
+TIMESHEET_WORKERS = int(os.environ.get('TIMESHEET_WORKERS', max(1, (os.cpu_count() or 2) // 2)))
+TIMESHEET_BATCH_SIZE = int(os.environ.get('TIMESHEET_BATCH_SIZE', 50))
+
+WEEKDAYS = ("Pn", "Wt", "Śr", "Cz", "Pt", "So", "Nd")
+STATUS_LABELS = {"working": "w trakcie", "completed": "zakończona", "unclosed": "niezamknięta"}
+# Marks check-outs set by the open shift sweep rather than scanned, as the web app does
+AUTO_CLOSED_LABEL = "auto"
+
+# Polish letters outside WinAnsiEncoding, placed on codes 128-145 through /Differences
+EXTRA_GLYPHS = {
+    "Ą": "Aogonek", "Ć": "Cacute", "Ę": "Eogonek", "Ł": "Lslash", "Ń": "Nacute", "Ś": "Sacute",
+    "Ź": "Zacute", "Ż": "Zdotaccent", "ą": "aogonek", "ć": "cacute", "ę": "eogonek", "ł": "lslash",
+    "ń": "nacute", "ś": "sacute", "ź": "zacute", "ż": "zdotaccent",
+}
+EXTRA_CODES = {char: 128 + index for index, char in enumerate(EXTRA_GLYPHS)}
+
+PAGE_WIDTH, PAGE_HEIGHT = 595, 842  # A4 in points
+MARGIN = 50
+ROW_HEIGHT = 14
+COLUMNS = ((MARGIN, "Data"), (120, "Dzień"), (170, "Wejście"), (250, "Wyjście"), (330, "Godziny"),
+           (400, "Status"))
+TABLE_TOP = 700
+TABLE_BOTTOM = 90
+SUMMARY_HEIGHT = 110  # Totals and signature lines
+
+_pool: Optional[ProcessPoolExecutor] = None
+
+def _encode(text: str) -> bytes:
+    encoded = bytearray()
+    for char in text:
+        if char in EXTRA_CODES:
+            encoded.append(EXTRA_CODES[char])
+        else:
+            encoded += char.encode("cp1252", errors="replace")
+    return bytes(encoded).replace(b"\\", b"\\\\").replace(b"(", b"\\(").replace(b")", b"\\)")
+
+def _text(x: float, y: float, text: str, size: int = 9, bold: bool = False) -> bytes:
+    font = b"/F2" if bold else b"/F1"
+    return b"BT %s %d Tf %.1f %.1f Td (%s) Tj ET\n" % (font, size, x, y, _encode(text))
+
+def _line(x1: float, y1: float, x2: float, y2: float) -> bytes:
+    return b"%.1f %.1f m %.1f %.1f l S\n" % (x1, y1, x2, y2)
+
+def _as_datetime(value) -> Optional[datetime]:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    if isinstance(value, datetime) and value.tzinfo:
+        value = value.replace(tzinfo=None)
+    return value
+
+def _hours(entry: dict) -> Optional[float]:
+    check_in, check_out = _as_datetime(entry.get("check_in")), _as_datetime(entry.get("check_out"))
+    if not check_in or not check_out:
+        return None
+    return (check_out - check_in).total_seconds() / 3600
+
+def _format_hours(hours: float) -> str:
+    minutes = round(hours * 60)
+    return f"{minutes // 60}:{minutes % 60:02d}"
+
+def _clock(value) -> str:
+    value = _as_datetime(value)
+    return value.strftime("%H:%M") if value else "—"
+
+def timesheet_rows(month: str, entries: List[dict]) -> List[tuple]:
+    """One row per entry, and a blank row for each day of the month without any"""
+    year, month_number = (int(part) for part in month.split("-"))
+    by_day: Dict[str, List[dict]] = {}
+    for entry in sorted(entries, key=lambda entry: (entry["date"], str(entry.get("check_in")))):
+        by_day.setdefault(entry["date"], []).append(entry)
+    rows = []
+    for day in range(1, monthrange(year, month_number)[1] + 1):
+        current = date(year, month_number, day)
+        day_entries = by_day.get(current.isoformat(), [])
+        weekday = WEEKDAYS[current.weekday()]
+        if not day_entries:
+            rows.append((current.strftime("%d.%m.%Y"), weekday, "—", "—", "", ""))
+        for entry in day_entries:
+            hours = _hours(entry)
+            status = STATUS_LABELS.get(entry.get("status"), entry.get("status") or "")
+            if entry.get("auto_closed"):
+                status += f" ({AUTO_CLOSED_LABEL})"
+            rows.append((current.strftime("%d.%m.%Y"), weekday, _clock(entry.get("check_in")),
+                         _clock(entry.get("check_out")), _format_hours(hours) if hours is not None else "",
+                         status))
+    return rows
+
+def render_timesheet(data: dict) -> bytes:
+    """A PDF timesheet for data = {company, employee, month, entries, generated_at}"""
+    employee = data["employee"]
+    rows = timesheet_rows(data["month"], data["entries"])
+    worked = [hours for hours in (_hours(entry) for entry in data["entries"]) if hours is not None]
+    days_worked = len({entry["date"] for entry in data["entries"]})
+    open_entries = sum(1 for entry in data["entries"] if not entry.get("check_out"))
+
+    rows_per_page = int((TABLE_TOP - ROW_HEIGHT - TABLE_BOTTOM) // ROW_HEIGHT)
+    pages = [rows[start:start + rows_per_page] for start in range(0, len(rows), rows_per_page)] or [[]]
+    # Totals and signatures go under the last rows, or on a page of their own
+    if TABLE_TOP - ROW_HEIGHT * (len(pages[-1]) + 1) - SUMMARY_HEIGHT < TABLE_BOTTOM - 40:
+        pages.append([])
+
+    streams = []
+    for page_number, page_rows in enumerate(pages, start=1):
+        content = bytearray(b"0.5 w\n")
+        content += _text(MARGIN, 790, "Karta czasu pracy", size=16, bold=True)
+        content += _text(MARGIN, 770, f"{data['company']}", size=10)
+        content += _text(MARGIN, 750, f"Pracownik: {employee['name']} {employee['surname']}", size=10)
+        content += _text(MARGIN, 736, f"Numer: {employee['number']}    Stanowisko: {employee.get('position') or ''}",
+                         size=10)
+        content += _text(400, 750, f"Miesiąc: {data['month']}", size=10, bold=True)
+
+        y = TABLE_TOP
+        for x, title in COLUMNS:
+            content += _text(x, y, title, bold=True)
+        content += _line(MARGIN, y - 4, PAGE_WIDTH - MARGIN, y - 4)
+        for row in page_rows:
+            y -= ROW_HEIGHT
+            for (x, _), value in zip(COLUMNS, row):
+                content += _text(x, y, value)
+
+        if page_number == len(pages):
+            y -= 30
+            content += _line(MARGIN, y + 16, PAGE_WIDTH - MARGIN, y + 16)
+            content += _text(MARGIN, y, f"Dni przepracowane: {days_worked}", size=10)
+            content += _text(200, y, f"Suma godzin: {_format_hours(sum(worked))}", size=10, bold=True)
+            if open_entries:
+                content += _text(350, y, f"Niezamknięte zmiany: {open_entries}", size=10)
+            y -= 60
+            content += _line(MARGIN, y, MARGIN + 180, y)
+            content += _line(PAGE_WIDTH - MARGIN - 180, y, PAGE_WIDTH - MARGIN, y)
+            content += _text(MARGIN, y - 12, "Podpis pracownika", size=8)
+            content += _text(PAGE_WIDTH - MARGIN - 180, y - 12, "Podpis pracodawcy", size=8)
+
+        generated_at = data["generated_at"].strftime("%Y-%m-%d %H:%M")
+        content += _text(MARGIN, 40, f"Wygenerowano {generated_at}", size=7)
+        content += _text(PAGE_WIDTH - MARGIN - 50, 40, f"Strona {page_number}/{len(pages)}", size=7)
+        streams.append(bytes(content))
+
+    return _pdf(streams, title=f"Karta czasu pracy {employee['surname']} {data['month']}")
+
+def _pdf(streams: List[bytes], title: str) -> bytes:
+    differences = " ".join(f"/{EXTRA_GLYPHS[char]}" for char in EXTRA_CODES)
+    encoding = f"<< /Type /Encoding /BaseEncoding /WinAnsiEncoding /Differences [128 {differences}] >>".encode()
+    first_page = 6
+    objects = [
+        b"<< /Type /Catalog /Pages 2 0 R >>",
+        b"<< /Type /Pages /Kids [%s] /Count %d >>" % (
+            b" ".join(b"%d 0 R" % (first_page + 2 * index) for index in range(len(streams))), len(streams)
+        ),
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica /Encoding 5 0 R >>",
+        b"<< /Type /Font /Subtype /Type1 /BaseFont /Helvetica-Bold /Encoding 5 0 R >>",
+        encoding,
+    ]
+    for index, stream in enumerate(streams):
+        compressed = zlib.compress(stream)
+        objects.append(b"<< /Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d] "
+                       b"/Resources << /Font << /F1 3 0 R /F2 4 0 R >> >> /Contents %d 0 R >>"
+                       % (PAGE_WIDTH, PAGE_HEIGHT, first_page + 2 * index + 1))
+        objects.append(b"<< /Length %d /Filter /FlateDecode >>\nstream\n%s\nendstream" % (len(compressed), compressed))
+    objects.append(b"<< /Title (%s) /Producer (Time Tracking System) >>" % _encode(title))
+
+    output = bytearray(b"%PDF-1.4\n%\xe2\xe3\xcf\xd3\n")
+    offsets = []
+    for number, body in enumerate(objects, start=1):
+        offsets.append(len(output))
+        output += b"%d 0 obj\n%s\nendobj\n" % (number, body)
+    xref = len(output)
+    output += b"xref\n0 %d\n0000000000 65535 f \n" % (len(objects) + 1)
+    output += b"".join(b"%010d 00000 n \n" % offset for offset in offsets)
+    output += b"trailer\n<< /Size %d /Root 1 0 R /Info %d 0 R >>\nstartxref\n%d\n%%%%EOF\n" % (
+        len(objects) + 1, len(objects), xref
+    )
+    return bytes(output)
+
+def get_pool() -> ProcessPoolExecutor:
+    global _pool
+    if _pool is None:
+        # Spawned, not forked: the API process has the event loop and driver threads running
+        _pool = ProcessPoolExecutor(max_workers=TIMESHEET_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+def shutdown():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+async def render(data: dict) -> bytes:
+    return await asyncio.get_running_loop().run_in_executor(get_pool(), render_timesheet, data)
+
+def month_range(month: str):
+    year, month_number = (int(part) for part in month.split("-"))
+    return f"{month}-01", f"{month}-{monthrange(year, month_number)[1]:02d}"
+
+def filename(employee: dict, month: str) -> str:
+    """An ASCII file name, so it fits a Content-Disposition header as it is"""
+    name = f"{employee['surname']}_{employee['name']}_{employee['number']}".replace("Ł", "L").replace("ł", "l")
+    name = unicodedata.normalize("NFKD", name).encode("ascii", "ignore").decode()
+    name = re.sub(r"[^A-Za-z0-9.-]+", "_", name)
+    return f"karta_{name}_{month}.pdf"
+
+async def month_entries(db, employee_ids: List[str], month: str) -> Dict[str, List[dict]]:
+    """The month's hot and archived entries of each employee"""
+    date_from, date_to = month_range(month)
+    entries = await db.time_entries.find(
+        {"employee_id": {"$in": employee_ids}, "date": {"$gte": date_from, "$lte": date_to}},
+        {"_id": 0, "employee_id": 1, "id": 1, "date": 1, "check_in": 1, "check_out": 1, "status": 1,
+         "auto_closed": 1}
+    ).to_list(None)
+    if archive.reaches_archive(date_from):
+        entries += await archive.find_archived_entries(
+            db, employee_ids, date_from, date_to, exclude_ids=[entry["id"] for entry in entries]
+        )
+    by_employee = {employee_id: [] for employee_id in employee_ids}
+    for entry in entries:
+        by_employee[entry["employee_id"]].append(entry)
+    return by_employee
+
+def timesheet_data(company_name: str, employee: dict, month: str, entries: List[dict]) -> dict:
+    return {
+        "company": company_name,
+        "employee": {field: employee.get(field) for field in ("name", "surname", "number", "position")},
+        "month": month,
+        "entries": entries,
+        "generated_at": datetime.now(),
+    }
+
+class _ZipBuffer:
+    """Write-only file for ZipFile; the stream reads what was written so far with take()"""
+
+    def __init__(self):
+        self.chunks = []
+
+    def write(self, data) -> int:
+        self.chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def take(self) -> bytes:
+        data, self.chunks = b"".join(self.chunks), []
+        return data
+
+async def company_timesheets_zip(db, company_id: str, company_name: str, month: str) -> AsyncIterator[bytes]:
+    """A ZIP with every employee's timesheet, yielded as each batch is rendered"""
+    buffer = _ZipBuffer()
+    last_id = ""
+    # PDF content streams are already compressed; storing keeps the event loop free of deflate work
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_STORED) as bundle:
+        while True:
+            employees = await db.employees.find(
+                {"company_id": company_id, "id": {"$gt": last_id}},
+                {"_id": 0, "id": 1, "name": 1, "surname": 1, "number": 1, "position": 1}
+            ).sort("id", 1).limit(TIMESHEET_BATCH_SIZE).to_list(TIMESHEET_BATCH_SIZE)
+            if not employees:
+                break
+            last_id = employees[-1]["id"]
+            entries = await month_entries(db, [employee["id"] for employee in employees], month)
+            pdfs = await asyncio.gather(*(
+                render(timesheet_data(company_name, employee, month, entries[employee["id"]]))
+                for employee in employees
+            ))
+            for employee, pdf in zip(employees, pdfs):
+                bundle.writestr(filename(employee, month), pdf)
+            yield buffer.take()
+    yield buffer.take()  # The central directory, written on close
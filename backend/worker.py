@@ -0,0 +1,24 @@
+"""Companion worker process for background jobs.
+
+Run next to the API (with JOB_WORKERS_IN_API=false) to move job execution
+out of the request-serving processes:
+
+    python worker.py
+"""
+import asyncio
+import logging
+import signal
+
+from server import connect, ensure_indexes, job_queue
+
+async def main():
+    connect()
+    await ensure_indexes()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, job_queue.request_stop)
+    await job_queue.run_forever()
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(main())
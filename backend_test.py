@@ -1,6 +1,7 @@
 import requests
 import unittest
 import sys
+import time
 from datetime import datetime
 
 class MultiTenantTimeTrackingSystemTest(unittest.TestCase):
@@ -47,11 +48,14 @@ class MultiTenantTimeTrackingSystemTest(unittest.TestCase):
             self.skipTest("Owner token not available")
         
         headers = {"Authorization": f"Bearer {MultiTenantTimeTrackingSystemTest.owner_token}"}
-        response = requests.get(f"{self.base_url}/owner/companies", headers=headers)
+        response = requests.get(f"{self.base_url}/owner/companies", headers=headers,
+                                params={"q": "Testowa Firma"})
         
         self.assertEqual(response.status_code, 200, f"Failed to get companies: {response.text}")
-        companies = response.json()
+        page = response.json()
         
+        self.assertIn("totals", page, "Totals not found in the first page")
+        companies = page["companies"]
         self.assertIsInstance(companies, list, "Companies should be a list")
         
         # Find test company
@@ -242,11 +246,25 @@ class MultiTenantTimeTrackingSystemTest(unittest.TestCase):
             headers=headers
         )
         
-        self.assertEqual(response.status_code, 200, f"Failed to delete company: {response.text}")
+        self.assertEqual(response.status_code, 202, f"Failed to delete company: {response.text}")
         data = response.json()
         
-        self.assertIn("message", data, "Message not found in response")
-        print(f"✅ Deleted company: {data['message']}")
+        self.assertIn("job_id", data, "Job ID not found in response")
+        print(f"✅ Company deletion started: job {data['job_id']}")
+        
+        # The data is deleted in the background; wait for the job to finish
+        company_id = MultiTenantTimeTrackingSystemTest.new_company_id
+        deadline = time.monotonic() + 60
+        while True:
+            job = requests.get(f"{self.base_url}/owner/companies/{company_id}/deletion", headers=headers).json()
+            if job["status"] in ("completed", "failed") or time.monotonic() > deadline:
+                break
+            time.sleep(0.5)
+        self.assertEqual(job["status"], "completed", f"Company deletion did not complete: {job}")
+        
+        response = requests.get(f"{self.base_url}/owner/companies", headers=headers)
+        self.assertNotIn(company_id, [c["id"] for c in response.json()["companies"]], "Company still listed")
+        print(f"✅ Deleted company: {job['progress']}")
 
     def test_11_user_type_access_control(self):
         """Test access control between different user types"""
@@ -0,0 +1,257 @@
+#!/usr/bin/env python3
+"""
+In-process per-endpoint microbenchmarks for the Multi-Tenant Time Tracking System
+
+Drives the FastAPI `app` from backend/server.py through an in-process ASGI
+client against the in-memory FakeDatabase, so what is measured is the CPU
+cost of auth, validation, serialization and hours computation in each
+handler, without network or MongoDB in the way.
+
+Examples:
+    python bench_endpoints.py
+    python bench_endpoints.py --endpoints scan entries --iterations 500
+    python bench_endpoints.py --history bench_history.jsonl   # append and compare to the last run
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import random
+import statistics
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+import httpx
+from dotenv import load_dotenv
+
+from fake_db import FakeDatabase
+
+ROOT_DIR = Path(__file__).parent
+# Every backend module reads its settings at import time
+load_dotenv(ROOT_DIR / "backend" / ".env")
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+
+import admission  # noqa: E402
+import passwords  # noqa: E402
+import server  # noqa: E402
+from search import normalize, search_fields  # noqa: E402
+
+PASSWORD = "bench123"
+
+def percentile(sorted_values, fraction):
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+def seed(db, companies, employees_per_company, days_of_history):
+    """Fill the fake database directly; returns the ids the scenarios need"""
+    password_hash = passwords.hash_password(PASSWORD)
+    now = datetime.utcnow()
+    owner = {"id": str(uuid.uuid4()), "username": "bench_owner", "email": "owner@bench.local",
+             "password_hash": password_hash, "created_at": now}
+    db.owners._documents.append(owner)
+
+    tenants = []
+    for c in range(companies):
+        company_id = str(uuid.uuid4())
+        db.companies._documents.append(
+            {"id": company_id, "name": f"Bench Company {c}", "name_key": normalize(f"Bench Company {c}"),
+             "owner_id": owner["id"], "created_at": now, "last_activity_at": now,
+             "admin_count": 1, "user_count": 2, "employee_count": employees_per_company}
+        )
+        for role in ("admin", "user"):
+            db.users._documents.append({
+                "id": str(uuid.uuid4()), "username": f"bench_{c}_{role}", "email": f"{role}{c}@bench.local",
+                "password_hash": password_hash, "role": role, "company_id": company_id, "created_at": now
+            })
+        employees = []
+        for n in range(employees_per_company):
+            employee = {"id": str(uuid.uuid4()), "name": f"Imie{n}", "surname": f"Nazwisko{n}",
+                        "position": "Pracownik", "number": str(n), "qr_code": "", "company_id": company_id,
+                        "created_at": now}
+            employee.update(search_fields(employee))
+            employees.append(employee)
+            db.employees._documents.append(employee)
+            for day in range(1, days_of_history + 1):
+                check_in = (now - timedelta(days=day)).replace(hour=8, minute=0, second=0, microsecond=0)
+                db.time_entries._documents.append({
+                    "id": str(uuid.uuid4()), "employee_id": employee["id"], "company_id": company_id,
+                    "check_in": check_in,
+                    "check_out": check_in + timedelta(hours=8, minutes=random.randint(0, 59)),
+                    "date": check_in.strftime("%Y-%m-%d"), "status": "completed", "last_scan_time": check_in
+                })
+        tenants.append({"company_id": company_id, "admin": f"bench_{c}_admin", "kiosk": f"bench_{c}_user",
+                        "employees": employees})
+    return tenants
+
+class Scenario:
+    """One endpoint call, built fresh for every iteration by `request`"""
+
+    def __init__(self, name, request):
+        self.name = name
+        self.request = request
+
+def build_scenarios(ctx):
+    tenant = ctx["tenant"]
+    admin = ctx["admin_headers"]
+    kiosk = ctx["kiosk_headers"]
+    owner = ctx["owner_headers"]
+    employee_id = tenant["employees"][0]["id"]
+    badges = [server.badges.sign(tenant["company_id"], emp["id"]) for emp in tenant["employees"]]
+    scan_employee_ids = [emp["id"] for emp in tenant["employees"]]
+    counter = {"scan": 0}
+    month = datetime.now().strftime("%Y-%m")
+
+    def scan():
+        # Cycle through the badges, and back-date the employee's last scan today so the
+        # 5 second cooldown is never hit however many iterations wrap around the badges
+        counter["scan"] += 1
+        index = counter["scan"] % len(badges)
+        today = datetime.now().strftime("%Y-%m-%d")
+        scanned_before = datetime.now() - timedelta(hours=1)
+        for entry in ctx["db"].time_entries._documents:
+            if entry["employee_id"] == scan_employee_ids[index] and entry["date"] == today:
+                entry["last_scan_time"] = scanned_before
+        return "POST", "/api/time/scan", {"json": {"qr_data": badges[index]}, "headers": kiosk}
+
+    def scan_replay():
+        # A kiosk retry: the same key every time, answered from the idempotency store
+        return "POST", "/api/time/scan", {"json": {"qr_data": badges[0]},
+                                          "headers": {**kiosk, "Idempotency-Key": "bench-replay"}}
+
+    def create_entry():
+        return "POST", "/api/time/entries", {"json": {"employee_id": employee_id, "check_in": "08:00",
+                                                      "check_out": "16:00", "date": "2020-01-01"}, "headers": admin}
+
+    def bulk_entries():
+        # A week of shifts for a team in one request, against 20 calls to create_entry
+        return "POST", "/api/time/entries/bulk", {"json": {"operations": [
+            {"action": "create", "employee_id": emp["id"], "check_in": "08:00", "check_out": "16:00",
+             "date": f"2020-01-0{day}"}
+            for emp in tenant["employees"][:4] for day in range(1, 6)
+        ]}, "headers": admin}
+
+    return [
+        Scenario("root", lambda: ("GET", "/api/", {})),
+        Scenario("login", lambda: ("POST", "/api/auth/login",
+                                   {"json": {"username": tenant["admin"], "password": PASSWORD}})),
+        Scenario("me", lambda: ("GET", "/api/auth/me", {"headers": admin})),
+        Scenario("owner_companies", lambda: ("GET", "/api/owner/companies", {"headers": owner})),
+        Scenario("company_users", lambda: ("GET", "/api/company/users", {"headers": admin})),
+        Scenario("employees", lambda: ("GET", "/api/employees", {"headers": admin})),
+        Scenario("employee_search", lambda: ("GET", "/api/employees/search",
+                                             {"params": {"q": "nazwisko4"}, "headers": admin})),
+        Scenario("scan_replay", scan_replay),  # Before "scan", whose cooldowns would fail its first attempt
+        Scenario("scan", scan),
+        Scenario("kiosk_roster", lambda: ("GET", "/api/kiosk/roster", {"headers": kiosk})),
+        Scenario("kiosk_roster_delta", lambda: ("GET", "/api/kiosk/roster", {"params": {"since": 0}, "headers": kiosk})),
+        Scenario("entries", lambda: ("GET", "/api/time/entries", {"headers": admin})),
+        Scenario("employee_entries", lambda: ("GET", f"/api/time/entries/{employee_id}", {"headers": admin})),
+        Scenario("create_entry", create_entry),
+        Scenario("bulk_entries", bulk_entries),
+        Scenario("timesheet", lambda: ("GET", f"/api/employees/{employee_id}/timesheet",
+                                       {"params": {"month": month}, "headers": admin})),
+        Scenario("company_timesheets", lambda: ("GET", "/api/timesheets", {"params": {"month": month}, "headers": admin})),
+    ]
+
+async def login(client, username):
+    response = await client.post("/api/auth/login", json={"username": username, "password": PASSWORD})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+async def run(args):
+    db = FakeDatabase()
+    server.db = server.analytics_db = db
+    server.job_queue.db = server.idempotency_store.db = db
+    admission.ADMISSION_CONTROL = False  # Measure the handlers, not the rate limits
+    tenants = seed(db, args.companies, args.employees, args.days)
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        tenant = tenants[0]
+        ctx = {
+            "db": db,
+            "tenant": tenant,
+            "owner_headers": await login(client, "bench_owner"),
+            "admin_headers": await login(client, tenant["admin"]),
+            "kiosk_headers": await login(client, tenant["kiosk"]),
+        }
+        scenarios = [s for s in build_scenarios(ctx) if not args.endpoints or s.name in args.endpoints]
+
+        results = {}
+        for scenario in scenarios:
+            iterations = args.login_iterations if scenario.name == "login" else args.iterations
+            for _ in range(args.warmup):
+                method, url, kwargs = scenario.request()
+                await client.request(method, url, **kwargs)
+
+            wall, cpu = [], []
+            for _ in range(iterations):
+                method, url, kwargs = scenario.request()
+                wall_started, cpu_started = time.perf_counter(), time.process_time()
+                response = await client.request(method, url, **kwargs)
+                cpu.append(time.process_time() - cpu_started)
+                wall.append(time.perf_counter() - wall_started)
+                if response.status_code >= 400:
+                    raise RuntimeError(f"{scenario.name}: {response.status_code} {response.text}")
+
+            wall.sort()
+            results[scenario.name] = {
+                "iterations": iterations,
+                "mean_us": round(statistics.mean(wall) * 1e6, 1),
+                "p50_us": round(percentile(wall, 0.50) * 1e6, 1),
+                "p95_us": round(percentile(wall, 0.95) * 1e6, 1),
+                "cpu_mean_us": round(statistics.mean(cpu) * 1e6, 1),
+                "ops_per_second": round(iterations / sum(wall), 1)
+            }
+    return results
+
+def git_revision():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def main():
+    parser = argparse.ArgumentParser(description="In-process per-endpoint microbenchmarks")
+    parser.add_argument("--companies", type=int, default=5)
+    parser.add_argument("--employees", type=int, default=100, help="Employees per company")
+    parser.add_argument("--days", type=int, default=5, help="Days of completed shifts per employee")
+    parser.add_argument("--iterations", type=int, default=200)
+    parser.add_argument("--login-iterations", type=int, default=10, help="Login is bcrypt-bound and slow")
+    parser.add_argument("--warmup", type=int, default=5)
+    parser.add_argument("--endpoints", nargs="*", help="Only run these scenarios")
+    parser.add_argument("--history", help="JSON lines file to append results to and compare against")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    random.seed(args.seed)
+    results = asyncio.run(run(args))
+
+    previous = None
+    if args.history and Path(args.history).exists():
+        lines = Path(args.history).read_text().splitlines()
+        previous = json.loads(lines[-1])["results"] if lines else None
+
+    print(f"{'scenario':18} {'iters':>6} {'mean µs':>10} {'p50 µs':>10} {'p95 µs':>10} {'cpu µs':>10} {'ops/s':>9} {'vs last':>8}")
+    for name, stats in results.items():
+        change = ""
+        if previous and name in previous:
+            change = f"{(stats['mean_us'] / previous[name]['mean_us'] - 1):+.0%}"
+        print(f"{name:18} {stats['iterations']:>6} {stats['mean_us']:>10} {stats['p50_us']:>10} "
+              f"{stats['p95_us']:>10} {stats['cpu_mean_us']:>10} {stats['ops_per_second']:>9} {change:>8}")
+
+    if args.history:
+        record = {"created_at": datetime.utcnow().isoformat(), "revision": git_revision(),
+                  "config": {"companies": args.companies, "employees": args.employees, "days": args.days},
+                  "results": results}
+        with open(args.history, "a") as history:
+            history.write(json.dumps(record) + "\n")
+        print(f"\n💾 Appended results to {args.history}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Login throughput of the password hashing configuration
+
+Fires concurrent POST /api/auth/login requests at the FastAPI `app` through an
+in-process ASGI client against the in-memory FakeDatabase, like
+bench_endpoints.py, and reports logins per second and latency at each
+concurrency. The scheme and cost default to the PASSWORD_* settings; pass
+--scheme/--rounds to try another one, and --stored-rounds to seed hashes at an
+older cost and see the rehash on first login.
+
+Examples:
+    python bench_login.py
+    python bench_login.py --concurrency 1 4 16 --logins 64
+    python bench_login.py --scheme pbkdf2_sha256 --rounds 100000
+    python bench_login.py --rounds 10 --stored-rounds 12   # every account is rehashed once
+"""
+
+import argparse
+import asyncio
+import statistics
+import sys
+import time
+from pathlib import Path
+
+import httpx
+from dotenv import load_dotenv
+
+from fake_db import FakeDatabase
+
+ROOT_DIR = Path(__file__).parent
+# PASSWORD_* and the admission settings are read at import, as the server reads them
+load_dotenv(ROOT_DIR / "backend" / ".env")
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+
+import admission  # noqa: E402
+import passwords  # noqa: E402
+import server  # noqa: E402
+from bench_endpoints import PASSWORD, percentile, seed  # noqa: E402
+
+def configure(scheme, rounds):
+    scheme = scheme or passwords.PASSWORD_SCHEMES[0]
+    rounds = rounds or passwords.PASSWORD_ROUNDS.get(scheme, passwords.DEFAULT_ROUNDS[scheme])
+    passwords.PASSWORD_SCHEMES = [scheme] + [s for s in passwords.PASSWORD_SCHEMES if s != scheme]
+    passwords.PASSWORD_ROUNDS = {**passwords.PASSWORD_ROUNDS, scheme: rounds}
+    passwords.context.cache_clear()
+    return scheme, rounds
+
+async def run(args):
+    scheme, rounds = configure(args.scheme, args.rounds)
+    db = FakeDatabase()
+    server.db = server.analytics_db = db
+    server.job_queue.db = server.idempotency_store.db = db
+    admission.ADMISSION_CONTROL = False  # Measure the hashing, not the login rate limit
+    seed(db, args.companies, 0, 0)
+
+    stored_hash = passwords.scheme_context(scheme, args.stored_rounds).hash(PASSWORD) if args.stored_rounds else None
+    usernames = [user["username"] for user in db.users._documents]
+    if stored_hash:
+        for user in db.users._documents + db.owners._documents:
+            user["password_hash"] = stored_hash
+    print(f"{scheme} cost {rounds}, {len(usernames)} accounts, {passwords.PASSWORD_HASH_WORKERS} hash workers"
+          + (f", stored at cost {args.stored_rounds}" if args.stored_rounds else ""))
+
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://bench") as client:
+        async def login(index, timings):
+            started = time.perf_counter()
+            response = await client.post("/api/auth/login", json={
+                "username": usernames[index % len(usernames)], "password": PASSWORD
+            })
+            timings.append(time.perf_counter() - started)
+            if response.status_code != 200:
+                raise RuntimeError(f"login: {response.status_code} {response.text}")
+
+        results = {}
+        for concurrency in args.concurrency:
+            timings = []
+            semaphore = asyncio.Semaphore(concurrency)
+
+            async def limited(index):
+                async with semaphore:
+                    await login(index, timings)
+
+            wall_started, cpu_started = time.perf_counter(), time.process_time()
+            await asyncio.gather(*(limited(index) for index in range(args.logins)))
+            wall = time.perf_counter() - wall_started
+            cpu = time.process_time() - cpu_started
+            timings.sort()
+            results[concurrency] = {
+                "logins_per_second": round(args.logins / wall, 1),
+                "mean_ms": round(statistics.mean(timings) * 1000, 1),
+                "p50_ms": round(percentile(timings, 0.50) * 1000, 1),
+                "p95_ms": round(percentile(timings, 0.95) * 1000, 1),
+                "cpu_ms_per_login": round(cpu / args.logins * 1000, 1),
+            }
+
+    rehashed = sum(1 for user in db.users._documents + db.owners._documents if user["password_hash"] != stored_hash)
+    return results, (rehashed if stored_hash else None)
+
+def main():
+    parser = argparse.ArgumentParser(description="Concurrent login throughput")
+    parser.add_argument("--companies", type=int, default=8, help="Two accounts per company are logged into")
+    parser.add_argument("--concurrency", type=int, nargs="*", default=[1, 4, 16])
+    parser.add_argument("--logins", type=int, default=32, help="Logins per concurrency level")
+    parser.add_argument("--scheme", choices=sorted(passwords.DEFAULT_ROUNDS))
+    parser.add_argument("--rounds", type=int, help="Cost of new hashes (default: the configured one)")
+    parser.add_argument("--stored-rounds", type=int, help="Seed the accounts with hashes of this cost")
+    args = parser.parse_args()
+
+    results, rehashed = asyncio.run(run(args))
+    print(f"{'concurrency':>11} {'logins/s':>9} {'mean ms':>9} {'p50 ms':>9} {'p95 ms':>9} {'cpu ms':>8}")
+    for concurrency, stats in results.items():
+        print(f"{concurrency:>11} {stats['logins_per_second']:>9} {stats['mean_ms']:>9} {stats['p50_ms']:>9} "
+              f"{stats['p95_ms']:>9} {stats['cpu_ms_per_login']:>8}")
+    if rehashed is not None:
+        print(f"\n🔁 Rehashed {rehashed} stored hashes on login")
+
+if __name__ == "__main__":
+    main()
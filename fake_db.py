@@ -0,0 +1,531 @@
+"""In-memory stand-in for the Motor database used by backend/server.py.
+
+Implements the subset of the Motor API the server uses, with plain Python
+dicts as storage, so handlers can be exercised without a MongoDB server.
+Swap it in with `server.db = server.analytics_db = FakeDatabase()`; tenant
+databases are reached through its `client` like with Motor. Used by the
+unit tests and by the in-process benchmarks (bench_endpoints.py,
+bench_login.py).
+"""
+
+import copy
+import re
+from datetime import datetime
+
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import DuplicateKeyError
+
+_MISSING = object()
+
+def _get_path(document, path):
+    value = document
+    for part in path.split("."):
+        if isinstance(value, dict) and part in value:
+            value = value[part]
+        else:
+            return _MISSING
+    return value
+
+def _set_path(document, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.setdefault(part, {})
+    document[parts[-1]] = value
+
+def _unset_path(document, path):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(parts[-1], None)
+
+def _comparable(a, b):
+    return a is not _MISSING and a is not None and b is not None and (
+        type(a) == type(b) or (isinstance(a, (int, float)) and isinstance(b, (int, float)))
+    )
+
+def _match_operator(value, operator, argument):
+    candidates = value if isinstance(value, list) else [value]
+    if operator == "$eq":
+        return _match_value(value, argument)
+    if operator == "$ne":
+        return not _match_value(value, argument)
+    if operator == "$in":
+        if isinstance(argument, frozenset) and not isinstance(value, list):
+            return (None if value is _MISSING else value) in argument
+        return any(_match_value(value, item) for item in argument)
+    if operator == "$nin":
+        return not any(_match_value(value, item) for item in argument)
+    if operator == "$exists":
+        return (value is not _MISSING) == bool(argument)
+    if operator in ("$lt", "$lte", "$gt", "$gte"):
+        for candidate in candidates:
+            if not _comparable(candidate, argument):
+                continue
+            if operator == "$lt" and candidate < argument:
+                return True
+            if operator == "$lte" and candidate <= argument:
+                return True
+            if operator == "$gt" and candidate > argument:
+                return True
+            if operator == "$gte" and candidate >= argument:
+                return True
+        return False
+    if operator == "$regex":
+        pattern = argument if hasattr(argument, "search") else re.compile(argument)
+        return any(isinstance(candidate, str) and pattern.search(candidate) for candidate in candidates)
+    if operator == "$all":
+        return all(_match_value(value, item) for item in argument)
+    if operator == "$size":
+        return isinstance(value, list) and len(value) == argument
+    raise NotImplementedError(f"Query operator {operator} is not supported by FakeDatabase")
+
+def _match_value(value, condition):
+    if isinstance(condition, dict) and condition and all(key.startswith("$") for key in condition):
+        options = condition.get("$options", "")
+        return all(
+            _match_operator(value, operator, re.compile(argument, re.I if "i" in options else 0)
+                            if operator == "$regex" and isinstance(argument, str) else argument)
+            for operator, argument in condition.items() if operator != "$options"
+        )
+    if hasattr(condition, "search"):
+        return _match_operator(value, "$regex", condition)
+    if condition is None:
+        return value is _MISSING or value is None
+    if isinstance(value, list) and not isinstance(condition, list):
+        return condition in value
+    return value is not _MISSING and value == condition
+
+def prepare(query):
+    """Turn hashable $in lists into sets, so matching many documents stays cheap"""
+    if isinstance(query, list):
+        return [prepare(item) for item in query]
+    if not isinstance(query, dict):
+        return query
+    prepared = {}
+    for key, value in query.items():
+        if key == "$in" and isinstance(value, list):
+            try:
+                if not any(isinstance(item, (dict, list)) or hasattr(item, "search") for item in value):
+                    prepared[key] = frozenset(value)
+                    continue
+            except TypeError:
+                pass
+        prepared[key] = prepare(value)
+    return prepared
+
+def matches(document, query):
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(document, sub) for sub in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(document, sub) for sub in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(document, sub) for sub in condition):
+                return False
+        elif not _match_value(_get_path(document, key), condition):
+            return False
+    return True
+
+def _project(document, projection):
+    document = copy.deepcopy(document)
+    if not projection:
+        return document
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    include = {key for key, value in projection.items() if value and key != "_id"}
+    if include:
+        result = {}
+        for path in include:
+            value = _get_path(document, path)
+            if value is not _MISSING:
+                _set_path(result, path, value)
+        if projection.get("_id", 1) and "_id" in document:
+            result["_id"] = document["_id"]
+        return result
+    for key, value in projection.items():
+        if not value:
+            _unset_path(document, key)
+    return document
+
+def _sort_key(value):
+    # Order across types the way MongoDB roughly does: missing/None first
+    if value is _MISSING or value is None:
+        return (0, 0)
+    if isinstance(value, (int, float)):
+        return (1, value)
+    if isinstance(value, str):
+        return (2, value)
+    if isinstance(value, datetime):
+        return (3, value.timestamp())
+    return (4, str(value))
+
+def _sort(documents, sort):
+    for key, direction in reversed(sort):
+        documents.sort(key=lambda document: _sort_key(_get_path(document, key)), reverse=direction < 0)
+    return documents
+
+def _apply_update(document, update, inserting=False):
+    if not any(key.startswith("$") for key in update):
+        preserved = document.get("_id")
+        document.clear()
+        document.update(copy.deepcopy(update))
+        if preserved is not None:
+            document["_id"] = preserved
+        return
+    for operator, fields in update.items():
+        for path, value in fields.items():
+            value = copy.deepcopy(value)
+            if operator == "$set" or (operator == "$setOnInsert" and inserting):
+                _set_path(document, path, value)
+            elif operator == "$setOnInsert":
+                continue
+            elif operator == "$unset":
+                _unset_path(document, path)
+            elif operator == "$inc":
+                current = _get_path(document, path)
+                _set_path(document, path, (0 if current is _MISSING or current is None else current) + value)
+            elif operator in ("$max", "$min"):
+                current = _get_path(document, path)
+                if current is _MISSING or current is None or (value > current if operator == "$max" else value < current):
+                    _set_path(document, path, value)
+            elif operator == "$push":
+                current = _get_path(document, path)
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                _set_path(document, path, (current if isinstance(current, list) else []) + items)
+            elif operator == "$addToSet":
+                current = _get_path(document, path)
+                current = current if isinstance(current, list) else []
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                _set_path(document, path, current + [item for item in items if item not in current])
+            elif operator == "$pull":
+                current = _get_path(document, path)
+                if isinstance(current, list):
+                    _set_path(document, path, [item for item in current if not _match_value(item, value)])
+            else:
+                raise NotImplementedError(f"Update operator {operator} is not supported by FakeDatabase")
+
+class _Result:
+    def __init__(self, **fields):
+        self.__dict__.update(fields)
+        self.acknowledged = True
+
+class FakeCursor:
+    def __init__(self, collection, query, projection):
+        self._collection = collection
+        self._query = prepare(query)
+        self._projection = projection
+        self._sort = []
+        self._skip = 0
+        self._limit = 0
+        self._iterator = None
+
+    def sort(self, key_or_list, direction=1):
+        if isinstance(key_or_list, str):
+            self._sort = [(key_or_list, direction)]
+        else:
+            self._sort = list(key_or_list)
+        return self
+
+    def skip(self, count):
+        self._skip = count
+        return self
+
+    def limit(self, count):
+        self._limit = count
+        return self
+
+    def _results(self):
+        documents = [document for document in self._collection._documents if matches(document, self._query)]
+        if self._sort:
+            documents = _sort(documents, self._sort)
+        documents = documents[self._skip:]
+        if self._limit:
+            documents = documents[:self._limit]
+        return [_project(document, self._projection) for document in documents]
+
+    async def to_list(self, length=None):
+        results = self._results()
+        return results[:length] if length else results
+
+    def __aiter__(self):
+        self._iterator = iter(self._results())
+        return self
+
+    async def __anext__(self):
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+
+class _ListCursor:
+    """Cursor over an already computed result, for aggregate()"""
+
+    def __init__(self, documents):
+        self._documents = documents
+
+    async def to_list(self, length=None):
+        return self._documents[:length] if length else self._documents
+
+def _accumulate(documents, expression):
+    operator, argument = next(iter(expression.items()))
+    values = [_get_path(document, argument[1:]) if isinstance(argument, str) and argument.startswith("$")
+              else argument for document in documents]
+    values = [value for value in values if value is not _MISSING and value is not None]
+    if operator == "$sum":
+        return sum(value for value in values if isinstance(value, (int, float)))
+    if operator == "$max":
+        return max(values, default=None)
+    if operator == "$min":
+        return min(values, default=None)
+    raise NotImplementedError(f"Accumulator {operator} is not supported by FakeDatabase")
+
+class FakeCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self._documents = []
+        self._unique = []
+
+    def __getitem__(self, name):
+        return self.database[f"{self.name}.{name}"]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self.database[f"{self.name}.{name}"]
+
+    def _check_unique(self, document, ignore=None):
+        for keys in self._unique:
+            values = tuple(_get_path(document, key) for key in keys)
+            if all(value is _MISSING for value in values):
+                continue
+            for other in self._documents:
+                if other is not ignore and tuple(_get_path(other, key) for key in keys) == values:
+                    raise DuplicateKeyError(f"E11000 duplicate key on {self.name} {keys}")
+
+    async def create_index(self, keys, unique=False, **kwargs):
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        if unique:
+            self._unique.append(tuple(key for key, _ in keys))
+        return "_".join(f"{key}_{direction}" for key, direction in keys)
+
+    async def drop(self):
+        self._documents = []
+
+    def find(self, query=None, projection=None, **kwargs):
+        cursor = FakeCursor(self, query or {}, projection)
+        if kwargs.get("sort"):
+            cursor.sort(kwargs["sort"])
+        if kwargs.get("limit"):
+            cursor.limit(kwargs["limit"])
+        return cursor
+
+    async def find_one(self, query=None, projection=None, sort=None):
+        cursor = self.find(query, projection).limit(1)
+        if sort:
+            cursor.sort(sort)
+        results = await cursor.to_list(1)
+        return results[0] if results else None
+
+    async def count_documents(self, query, **kwargs):
+        return sum(1 for document in self._documents if matches(document, query))
+
+    def aggregate(self, pipeline, **kwargs):
+        """$match, $group (with $sum/$max/$min), $sort and $limit stages"""
+        documents = list(self._documents)
+        for stage in pipeline:
+            name, argument = next(iter(stage.items()))
+            if name == "$match":
+                query = prepare(argument)
+                documents = [document for document in documents if matches(document, query)]
+            elif name == "$group":
+                key = argument["_id"]
+                groups = {}
+                for document in documents:
+                    group_key = _get_path(document, key[1:]) if isinstance(key, str) and key.startswith("$") else key
+                    groups.setdefault(group_key if group_key is not _MISSING else None, []).append(document)
+                documents = [
+                    {"_id": group_key, **{field: _accumulate(members, expression)
+                                          for field, expression in argument.items() if field != "_id"}}
+                    for group_key, members in groups.items()
+                ]
+            elif name == "$sort":
+                documents = _sort(documents, list(argument.items()))
+            elif name == "$limit":
+                documents = documents[:argument]
+            else:
+                raise NotImplementedError(f"Pipeline stage {name} is not supported by FakeDatabase")
+        return _ListCursor(documents)
+
+    async def estimated_document_count(self):
+        return len(self._documents)
+
+    async def distinct(self, key, query=None):
+        values = []
+        for document in self._documents:
+            if matches(document, query or {}):
+                value = _get_path(document, key)
+                if value is not _MISSING and value not in values:
+                    values.append(value)
+        return values
+
+    async def insert_one(self, document):
+        if "_id" in document and any(other["_id"] == document["_id"] for other in self._documents):
+            raise DuplicateKeyError(f"E11000 duplicate key on {self.name} _id")
+        document.setdefault("_id", ObjectId())
+        stored = copy.deepcopy(document)
+        self._check_unique(stored)
+        self._documents.append(stored)
+        return _Result(inserted_id=document["_id"])
+
+    async def insert_many(self, documents, ordered=True):
+        ids = []
+        for document in documents:
+            ids.append((await self.insert_one(document)).inserted_id)
+        return _Result(inserted_ids=ids)
+
+    def _upsert_document(self, query, update):
+        document = {key: copy.deepcopy(value) for key, value in query.items()
+                    if not key.startswith("$") and not isinstance(value, dict)}
+        _apply_update(document, update, inserting=True)
+        document.setdefault("_id", ObjectId())
+        self._check_unique(document)
+        self._documents.append(document)
+        return document
+
+    async def _update(self, query, update, upsert, many):
+        matched = [document for document in self._documents if matches(document, query)]
+        if not many:
+            matched = matched[:1]
+        modified = 0
+        for document in matched:
+            before = copy.deepcopy(document)
+            _apply_update(document, update)
+            self._check_unique(document, ignore=document)
+            modified += document != before
+        if not matched and upsert:
+            document = self._upsert_document(query, update)
+            return _Result(matched_count=0, modified_count=0, upserted_id=document["_id"])
+        return _Result(matched_count=len(matched), modified_count=modified, upserted_id=None)
+
+    async def update_one(self, query, update, upsert=False, **kwargs):
+        return await self._update(query, update, upsert, many=False)
+
+    async def update_many(self, query, update, upsert=False, **kwargs):
+        return await self._update(query, update, upsert, many=True)
+
+    async def replace_one(self, query, replacement, upsert=False, **kwargs):
+        return await self._update(query, replacement, upsert, many=False)
+
+    async def find_one_and_update(self, query, update, projection=None, sort=None, upsert=False,
+                                  return_document=ReturnDocument.BEFORE, **kwargs):
+        documents = [document for document in self._documents if matches(document, query)]
+        if sort:
+            documents = _sort(documents, list(sort))
+        if not documents:
+            if not upsert:
+                return None
+            document = self._upsert_document(query, update)
+            return _project(document, projection) if return_document else None
+        document = documents[0]
+        before = _project(document, projection)
+        _apply_update(document, update)
+        return _project(document, projection) if return_document else before
+
+    async def find_one_and_delete(self, query, projection=None, sort=None, **kwargs):
+        documents = [document for document in self._documents if matches(document, query)]
+        if sort:
+            documents = _sort(documents, list(sort))
+        if not documents:
+            return None
+        self._documents.remove(documents[0])
+        return _project(documents[0], projection)
+
+    async def _delete(self, query, many):
+        matched = [document for document in self._documents if matches(document, query)]
+        if not many:
+            matched = matched[:1]
+        for document in matched:
+            self._documents.remove(document)
+        return _Result(deleted_count=len(matched))
+
+    async def delete_one(self, query, **kwargs):
+        return await self._delete(query, many=False)
+
+    async def delete_many(self, query, **kwargs):
+        return await self._delete(query, many=True)
+
+    async def bulk_write(self, requests, ordered=True, **kwargs):
+        counts = {"inserted_count": 0, "matched_count": 0, "modified_count": 0, "deleted_count": 0,
+                  "upserted_count": 0}
+        for request in requests:
+            if isinstance(request, InsertOne):
+                await self.insert_one(request._doc)
+                counts["inserted_count"] += 1
+            elif isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+                result = await self._update(request._filter, request._doc, request._upsert,
+                                            many=isinstance(request, UpdateMany))
+                counts["matched_count"] += result.matched_count
+                counts["modified_count"] += result.modified_count
+                counts["upserted_count"] += 1 if result.upserted_id is not None else 0
+            elif isinstance(request, (DeleteOne, DeleteMany)):
+                result = await self._delete(request._filter, many=isinstance(request, DeleteMany))
+                counts["deleted_count"] += result.deleted_count
+            else:
+                raise NotImplementedError(f"Bulk operation {type(request).__name__} is not supported")
+        return _Result(**counts)
+
+class FakeClient:
+    """Holds the FakeDatabases reachable through `db.client`, one per name"""
+
+    def __init__(self):
+        self._databases = {}
+
+    def __getitem__(self, name):
+        return self.get_database(name)
+
+    def get_database(self, name, **kwargs):
+        if name not in self._databases:
+            self._databases[name] = FakeDatabase(name, client=self)
+        return self._databases[name]
+
+    async def list_database_names(self):
+        return list(self._databases)
+
+    async def drop_database(self, name):
+        self._databases.pop(getattr(name, "name", name), None)
+
+class FakeDatabase:
+    def __init__(self, name="fake", client=None):
+        self.name = name
+        self.read_preference = None
+        self.client = client or FakeClient()
+        self.client._databases.setdefault(name, self)
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = FakeCollection(self, name)
+        return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name, **kwargs):
+        return self[name]
+
+    async def list_collection_names(self):
+        return list(self._collections)
+
+    async def command(self, command, **kwargs):
+        if command == "ping" or (isinstance(command, dict) and "ping" in command):
+            return {"ok": 1}
+        raise NotImplementedError(f"Command {command} is not supported by FakeDatabase")
@@ -0,0 +1,76 @@
+// Kiosk roster: the company's employees by badge key, kept in localStorage and
+// brought up to date with signed deltas, so a scan can show who it is at once
+const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
+const STORAGE_KEY = 'kioskRoster';
+
+const fromBase64 = (text) => Uint8Array.from(atob(text), (char) => char.charCodeAt(0));
+
+const loadStored = () => {
+  try {
+    return JSON.parse(localStorage.getItem(STORAGE_KEY)) || null;
+  } catch {
+    return null;
+  }
+};
+
+// Browsers without Ed25519 in WebCrypto skip the check; the server still decides every scan
+const verifySignature = async (publicKey, signature, body) => {
+  if (!signature || !publicKey) return false;
+  if (!window.crypto?.subtle) return true;
+  try {
+    const key = await window.crypto.subtle.importKey('raw', fromBase64(publicKey), { name: 'Ed25519' }, false, ['verify']);
+    return await window.crypto.subtle.verify({ name: 'Ed25519' }, key, fromBase64(signature), body);
+  } catch (error) {
+    if (error.name === 'NotSupportedError') return true;
+    throw error;
+  }
+};
+
+export const refreshRoster = async (companyId, retried = false) => {
+  const token = localStorage.getItem('token');
+  const headers = { 'Authorization': `Bearer ${token}` };
+  let stored = loadStored();
+  if (!stored || stored.companyId !== companyId) {
+    const keyResponse = await fetch(`${BACKEND_URL}/api/kiosk/roster/key`, { headers });
+    if (!keyResponse.ok) return stored;
+    stored = { companyId, publicKey: (await keyResponse.json()).public_key, version: null, employees: {} };
+  }
+
+  const query = stored.version === null ? '' : `?since=${stored.version}`;
+  const response = await fetch(`${BACKEND_URL}/api/kiosk/roster${query}`, { headers });
+  if (!response.ok) return stored;
+  const body = await response.arrayBuffer();
+  if (!(await verifySignature(stored.publicKey, response.headers.get('X-Roster-Signature'), body))) {
+    // The stored key may be one the server has since rotated out: start over once with a fresh key
+    if (!retried) {
+      localStorage.removeItem(STORAGE_KEY);
+      return refreshRoster(companyId, true);
+    }
+    console.error('Nieprawidłowy podpis listy pracowników');
+    return stored;
+  }
+
+  const roster = JSON.parse(new TextDecoder().decode(body));
+  const employees = roster.full ? {} : { ...stored.employees };
+  roster.employees.forEach((employee) => { employees[employee.key] = employee; });
+  roster.removed.forEach((key) => { delete employees[key]; });
+  stored = { ...stored, version: roster.version, employees };
+  localStorage.setItem(STORAGE_KEY, JSON.stringify(stored));
+  return stored;
+};
+
+// The roster entry of a scanned badge: signed badges by their key, legacy EMP_ badges by number
+export const lookupBadge = (stored, qrData) => {
+  if (!stored) return null;
+  const parts = qrData.split('.');
+  if (parts.length === 4 && parts[0] === 'E1') {
+    return stored.employees[parts[2]] || null;
+  }
+  if (qrData.startsWith('EMP_') && qrData.split('_')[1] === stored.companyId) {
+    const number = qrData.split('_')[2];
+    return Object.values(stored.employees).find((employee) => employee.number === number) || null;
+  }
+  return null;
+};
+
+export const storedRoster = loadStored;
@@ -4,6 +4,10 @@ const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 
 function OwnerDashboard({ user, onLogout }) {
   const [companies, setCompanies] = useState([]);
+  const [totals, setTotals] = useState({ companies: 0, users: 0, employees: 0 });
+  const [nextCursor, setNextCursor] = useState(null);
+  const [search, setSearch] = useState('');
+  const [sort, setSort] = useState('name:asc');
   const [loading, setLoading] = useState(true);
   const [error, setError] = useState('');
   const [showCreateForm, setShowCreateForm] = useState(false);
@@ -16,13 +20,20 @@ function OwnerDashboard({ user, onLogout }) {
   const [createLoading, setCreateLoading] = useState(false);
 
   useEffect(() => {
-    fetchCompanies();
-  }, []);
+    // Debounce typing in the search box
+    const timeout = setTimeout(() => fetchCompanies(), 250);
+    return () => clearTimeout(timeout);
+  }, [search, sort]);
 
-  const fetchCompanies = async () => {
+  // Without a cursor the first page is loaded and replaces the list; with one the next page is appended
+  const fetchCompanies = async (cursor = null) => {
     try {
       const token = localStorage.getItem('token');
-      const response = await fetch(`${BACKEND_URL}/api/owner/companies`, {
+      const [sortField, order] = sort.split(':');
+      const params = new URLSearchParams({ sort: sortField, order, limit: '50' });
+      if (search) params.set('q', search);
+      if (cursor) params.set('cursor', cursor);
+      const response = await fetch(`${BACKEND_URL}/api/owner/companies?${params}`, {
         headers: {
           'Authorization': `Bearer ${token}`
         }
@@ -30,7 +41,9 @@ function OwnerDashboard({ user, onLogout }) {
 
       if (response.ok) {
         const data = await response.json();
-        setCompanies(data);
+        setCompanies(cursor ? [...companies, ...data.companies] : data.companies);
+        setNextCursor(data.next_cursor);
+        if (data.totals) setTotals(data.totals);
       } else {
         setError('Błąd pobierania firm');
       }
@@ -164,7 +177,7 @@ function OwnerDashboard({ user, onLogout }) {
               </div>
               <div className="ml-4">
                 <p className="text-sm font-medium text-gray-600">Liczba firm</p>
-                <p className="text-2xl font-semibold text-gray-900">{companies.length}</p>
+                <p className="text-2xl font-semibold text-gray-900">{totals.companies}</p>
               </div>
             </div>
           </div>
@@ -177,7 +190,7 @@ function OwnerDashboard({ user, onLogout }) {
               <div className="ml-4">
                 <p className="text-sm font-medium text-gray-600">Łączna liczba użytkowników</p>
                 <p className="text-2xl font-semibold text-gray-900">
-                  {companies.reduce((total, company) => total + company.user_count, 0)}
+                  {totals.users}
                 </p>
               </div>
             </div>
@@ -191,7 +204,7 @@ function OwnerDashboard({ user, onLogout }) {
               <div className="ml-4">
                 <p className="text-sm font-medium text-gray-600">Łączna liczba pracowników</p>
                 <p className="text-2xl font-semibold text-gray-900">
-                  {companies.reduce((total, company) => total + company.employee_count, 0)}
+                  {totals.employees}
                 </p>
               </div>
             </div>
@@ -295,13 +308,34 @@ function OwnerDashboard({ user, onLogout }) {
 
         {/* Companies List */}
         <div className="bg-white rounded-lg shadow">
-          <div className="px-6 py-4 border-b border-gray-200">
+          <div className="px-6 py-4 border-b border-gray-200 flex flex-col md:flex-row md:items-center md:justify-between gap-4">
             <h2 className="text-lg font-medium text-gray-900">Firmy w systemie</h2>
+            <div className="flex gap-4">
+              <input
+                type="text"
+                value={search}
+                onChange={(e) => setSearch(e.target.value)}
+                placeholder="Szukaj po nazwie..."
+                className="px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500"
+              />
+              <select
+                value={sort}
+                onChange={(e) => setSort(e.target.value)}
+                className="px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500"
+              >
+                <option value="name:asc">Nazwa (A-Z)</option>
+                <option value="size:desc">Najwięcej pracowników</option>
+                <option value="activity:desc">Ostatnia aktywność</option>
+                <option value="created:desc">Najnowsze</option>
+              </select>
+            </div>
           </div>
           
           {companies.length === 0 ? (
             <div className="px-6 py-8 text-center text-gray-500">
-              Brak firm w systemie. Utwórz pierwszą firmę klikając przycisk powyżej.
+              {search
+                ? 'Brak firm pasujących do wyszukiwania.'
+                : 'Brak firm w systemie. Utwórz pierwszą firmę klikając przycisk powyżej.'}
             </div>
           ) : (
             <div className="overflow-x-auto">
@@ -323,6 +357,9 @@ function OwnerDashboard({ user, onLogout }) {
                     <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">
                       Data utworzenia
                     </th>
+                    <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">
+                      Ostatnia aktywność
+                    </th>
                     <th className="px-6 py-3 text-left text-xs font-medium text-gray-500 uppercase tracking-wider">
                       Akcje
                     </th>
@@ -351,6 +388,11 @@ function OwnerDashboard({ user, onLogout }) {
                       <td className="px-6 py-4 whitespace-nowrap text-sm text-gray-500">
                         {new Date(company.created_at).toLocaleDateString('pl-PL')}
                       </td>
+                      <td className="px-6 py-4 whitespace-nowrap text-sm text-gray-500">
+                        {company.last_activity_at
+                          ? new Date(company.last_activity_at).toLocaleString('pl-PL')
+                          : '-'}
+                      </td>
                       <td className="px-6 py-4 whitespace-nowrap text-sm font-medium">
                         <button
                           onClick={() => handleDeleteCompany(company.id, company.name)}
@@ -363,6 +405,16 @@ function OwnerDashboard({ user, onLogout }) {
                   ))}
                 </tbody>
               </table>
+              {nextCursor && (
+                <div className="px-6 py-4 text-center border-t border-gray-200">
+                  <button
+                    onClick={() => fetchCompanies(nextCursor)}
+                    className="text-blue-600 hover:text-blue-800 font-medium transition duration-200"
+                  >
+                    Załaduj więcej
+                  </button>
+                </div>
+              )}
             </div>
           )}
         </div>
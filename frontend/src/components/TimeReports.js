@@ -9,6 +9,8 @@ function TimeReports() {
   const [loading, setLoading] = useState(true);
   const [showForm, setShowForm] = useState(false);
   const [editingEntry, setEditingEntry] = useState(null);
+  const [timesheetMonth, setTimesheetMonth] = useState(new Date().toISOString().slice(0, 7));
+  const [downloading, setDownloading] = useState(false);
   const [filters, setFilters] = useState({
     employee: '',
     dateFrom: '',
@@ -57,6 +59,33 @@ function TimeReports() {
     setShowForm(true);
   };
 
+  const downloadTimesheets = async () => {
+    // One employee's PDF when the filter picks an employee, otherwise a ZIP for the whole company
+    const url = filters.employee
+      ? `${BACKEND_URL}/api/employees/${filters.employee}/timesheet?month=${timesheetMonth}`
+      : `${BACKEND_URL}/api/timesheets?month=${timesheetMonth}`;
+    setDownloading(true);
+    try {
+      const token = localStorage.getItem('token');
+      const response = await fetch(url, { headers: { 'Authorization': `Bearer ${token}` } });
+      if (!response.ok) {
+        alert('Nie udało się wygenerować kart czasu pracy');
+        return;
+      }
+      const disposition = response.headers.get('Content-Disposition') || '';
+      const match = disposition.match(/filename="([^"]+)"/);
+      const link = document.createElement('a');
+      link.href = URL.createObjectURL(await response.blob());
+      link.download = match ? match[1] : `karty_czasu_pracy_${timesheetMonth}`;
+      link.click();
+      URL.revokeObjectURL(link.href);
+    } catch (error) {
+      console.error('Error downloading timesheets:', error);
+    } finally {
+      setDownloading(false);
+    }
+  };
+
   const handleDeleteEntry = async (entryId) => {
     if (!window.confirm('Czy na pewno chcesz usunąć ten wpis?')) {
       return;
@@ -149,6 +178,12 @@ function TimeReports() {
           W trakcie
         </span>
       );
+    } else if (status === 'unclosed') {
+      return (
+        <span className={`${baseClasses} bg-red-100 text-red-800`} title="Zmiana nie została zamknięta - uzupełnij godzinę wyjścia">
+          Niezamknięte
+        </span>
+      );
     }
     
     return (
@@ -268,10 +303,34 @@ function TimeReports() {
               <option value="">Wszystkie statusy</option>
               <option value="working">W trakcie</option>
               <option value="completed">Zakończone</option>
+              <option value="unclosed">Niezamknięte</option>
             </select>
           </div>
         </div>
 
+        <div className="mt-4 flex flex-col md:flex-row md:items-end gap-4">
+          <div>
+            <label className="block text-sm font-medium text-gray-700 mb-1">
+              Karta czasu pracy za miesiąc
+            </label>
+            <input
+              type="month"
+              value={timesheetMonth}
+              onChange={(e) => setTimesheetMonth(e.target.value)}
+              className="px-3 py-2 border border-gray-300 rounded-md focus:outline-none focus:ring-2 focus:ring-blue-500"
+            />
+          </div>
+          <button
+            onClick={downloadTimesheets}
+            disabled={downloading || !timesheetMonth}
+            className="bg-gray-700 text-white px-4 py-2 rounded-md hover:bg-gray-800 disabled:opacity-50"
+          >
+            {downloading
+              ? 'Generowanie...'
+              : filters.employee ? 'Pobierz kartę (PDF)' : 'Pobierz karty wszystkich (ZIP)'}
+          </button>
+        </div>
+
         {(filters.employee || filters.dateFrom || filters.dateTo || filters.status) && (
           <div className="mt-4">
             <button
@@ -359,6 +418,12 @@ function TimeReports() {
                     </td>
                     <td className="px-6 py-4 whitespace-nowrap">
                       {getStatusBadge(entry.status)}
+                      {entry.auto_closed && (
+                        <span className="ml-2 text-xs text-gray-500" title="Wyjście ustawione automatycznie">auto</span>
+                      )}
+                      {entry.archived && (
+                        <span className="ml-2 text-xs text-gray-500" title="Wpis przeniesiony do archiwum">archiwum</span>
+                      )}
                     </td>
                     <td className="px-6 py-4 whitespace-nowrap text-sm font-medium space-x-2">
                       <button
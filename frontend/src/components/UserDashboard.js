@@ -1,5 +1,6 @@
 import React, { useState, useEffect } from 'react';
 import QRScanner from './QRScanner';
+import { lookupBadge, refreshRoster, storedRoster } from '../api/roster';
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 
@@ -7,11 +8,23 @@ function UserDashboard({ user, onLogout }) {
   const [scanResult, setScanResult] = useState(null);
   const [loading, setLoading] = useState(false);
   const [companyInfo, setCompanyInfo] = useState(null);
+  const [roster, setRoster] = useState(storedRoster);
 
   useEffect(() => {
     fetchCompanyInfo();
   }, []);
 
+  // Keep the local roster current; the cached copy keeps working while the server is unreachable
+  useEffect(() => {
+    if (!companyInfo) return undefined;
+    const update = () => refreshRoster(companyInfo.id)
+      .then(setRoster)
+      .catch((error) => console.error('Błąd aktualizacji listy pracowników:', error));
+    update();
+    const interval = setInterval(update, 60000);
+    return () => clearInterval(interval);
+  }, [companyInfo]);
+
   const fetchCompanyInfo = async () => {
     try {
       const token = localStorage.getItem('token');
@@ -28,20 +41,36 @@ function UserDashboard({ user, onLogout }) {
     }
   };
 
+  // One key per scan: retries after a dropped connection get the first answer back instead of a second scan
+  const postScan = async (qrData, attempts = 3) => {
+    const token = localStorage.getItem('token');
+    const idempotencyKey = window.crypto?.randomUUID?.() || `${Date.now()}-${Math.random().toString(36).slice(2)}`;
+    for (let attempt = 1; ; attempt++) {
+      try {
+        return await fetch(`${BACKEND_URL}/api/time/scan`, {
+          method: 'POST',
+          headers: {
+            'Content-Type': 'application/json',
+            'Authorization': `Bearer ${token}`,
+            'Idempotency-Key': idempotencyKey
+          },
+          body: JSON.stringify({ qr_data: qrData }),
+        });
+      } catch (error) {
+        if (attempt >= attempts) throw error;
+        await new Promise((resolve) => setTimeout(resolve, 500 * attempt));
+      }
+    }
+  };
+
   const handleQRScan = async (qrData) => {
     setLoading(true);
-    setScanResult(null);
+    // Greet a known employee straight away; the server's answer replaces this
+    const known = lookupBadge(roster, qrData);
+    setScanResult(known ? { pending: true, employee: known.name } : null);
 
     try {
-      const token = localStorage.getItem('token');
-      const response = await fetch(`${BACKEND_URL}/api/time/scan`, {
-        method: 'POST',
-        headers: {
-          'Content-Type': 'application/json',
-          'Authorization': `Bearer ${token}`
-        },
-        body: JSON.stringify({ qr_data: qrData }),
-      });
+      const response = await postScan(qrData);
 
       const data = await response.json();
 
@@ -163,7 +192,9 @@ function UserDashboard({ user, onLogout }) {
         {/* Scan Result */}
         {scanResult && (
           <div className={`rounded-lg p-4 mb-6 ${
-            scanResult.success 
+            scanResult.pending
+              ? 'bg-blue-50 border border-blue-200'
+              : scanResult.success 
               ? 'bg-green-50 border border-green-200' 
               : scanResult.isCooldown
               ? 'bg-orange-50 border border-orange-200'
@@ -173,7 +204,12 @@ function UserDashboard({ user, onLogout }) {
           }`}>
             <div className="flex justify-between items-start">
               <div className="flex-1">
-                {scanResult.success ? (
+                {scanResult.pending ? (
+                  <div>
+                    <h3 className="text-lg font-semibold text-blue-800 mb-2">{scanResult.employee}</h3>
+                    <p className="text-sm text-blue-700">Rejestrowanie skanowania...</p>
+                  </div>
+                ) : scanResult.success ? (
                   <div>
                     <div className="flex items-center mb-2">
                       <svg className="w-5 h-5 text-green-600 mr-2" fill="currentColor" viewBox="0 0 20 20">
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Generate synthetic multi-tenant data for scale testing
+
+Creates companies of realistic, skewed sizes (a few very large tenants, many
+small ones) with admins, kiosk users, employees and years of shift history:
+day and night shifts, weekends off, absences, shifts still open and entries
+corrected by an admin. Every company is generated from its own seeded random
+generator, so a given --seed always produces the same data regardless of
+--processes.
+
+Examples:
+    python generate_data.py --companies 20 --employees 50 --years 1
+    python generate_data.py --db-name scale_test --companies 300 --employees 150 --years 3 --processes 8
+"""
+
+import argparse
+import os
+import random
+import sys
+import time
+import uuid
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from dotenv import load_dotenv
+from pymongo import MongoClient
+
+ROOT_DIR = Path(__file__).parent / "backend"
+load_dotenv(ROOT_DIR / '.env')
+sys.path.insert(0, str(ROOT_DIR))
+
+from passwords import hash_password  # noqa: E402
+from search import normalize, search_fields  # noqa: E402
+
+FIRST_NAMES = ["Anna", "Piotr", "Katarzyna", "Tomasz", "Magdalena", "Paweł", "Agnieszka", "Michał", "Joanna",
+               "Krzysztof", "Ewa", "Marcin", "Monika", "Jakub", "Aleksandra", "Łukasz", "Zofia", "Grzegorz"]
+SURNAMES = ["Nowak", "Kowalski", "Wiśniewski", "Wójcik", "Kowalczyk", "Kamiński", "Lewandowski", "Zieliński",
+            "Szymański", "Woźniak", "Dąbrowski", "Kozłowski", "Jankowski", "Mazur", "Krawczyk", "Piotrowski"]
+POSITIONS = ["Magazynier", "Operator", "Kierowca", "Sprzedawca", "Księgowa", "Kierownik zmiany", "Technik",
+             "Sprzątanie", "Ochrona", "Kucharz"]
+# (start hour, length in hours); the last one crosses midnight
+SHIFTS = [(6, 8), (14, 8), (22, 8)]
+
+def rng_uuid(rng):
+    return str(uuid.UUID(int=rng.getrandbits(128), version=4))
+
+def company_size(rng, mean_employees):
+    """Pareto-distributed company sizes around the requested mean"""
+    alpha = 1.6
+    size = int(mean_employees * (alpha - 1) / alpha * rng.paretovariate(alpha))
+    return max(1, min(size, mean_employees * 40))
+
+def generate_shifts(rng, employee_id, start, now, night_share, open_share, edit_share, absence_share):
+    """Yield time entries for one employee from start until now"""
+    shift_start, shift_length = rng.choice(SHIFTS[:2]) if rng.random() >= night_share else SHIFTS[2]
+    day = start
+    while day <= now:
+        if day.weekday() < 5 and rng.random() >= absence_share:
+            check_in = day.replace(hour=shift_start) + timedelta(minutes=rng.gauss(0, 7))
+            check_out = check_in + timedelta(hours=shift_length, minutes=rng.gauss(5, 20))
+            entry = {
+                "id": rng_uuid(rng),
+                "employee_id": employee_id,
+                "check_in": check_in,
+                "check_out": check_out,
+                "date": check_in.strftime("%Y-%m-%d"),
+                "status": "completed",
+                "last_scan_time": check_out
+            }
+            if check_out > now or rng.random() < open_share:
+                # Still at work, or forgot to scan out
+                entry.update({"check_out": None, "status": "working", "last_scan_time": check_in})
+            elif rng.random() < edit_share:
+                # Corrected by an admin: whole minutes, scanned long after the fact
+                entry["check_in"] = check_in.replace(second=0, microsecond=0)
+                entry["check_out"] = check_out.replace(second=0, microsecond=0)
+                entry["last_scan_time"] = check_out + timedelta(days=rng.randint(1, 5))
+            if check_in <= now:
+                yield entry
+        day += timedelta(days=1)
+
+def generate_company(index, args, owner_id, password_hash):
+    """Generate and insert one company; runs in a worker process with its own client"""
+    rng = random.Random(f"{args.seed}:{index}")
+    client = MongoClient(args.mongo_url)
+    db = client[args.db_name]
+    now = datetime.now().replace(microsecond=0)
+    created_at = now - timedelta(days=int(365 * args.years))
+
+    company_id = rng_uuid(rng)
+    name = f"Firma {index:05d} {rng.choice(SURNAMES)}"
+    db.companies.insert_one({
+        "id": company_id,
+        "name": name,
+        "name_key": normalize(name),
+        "owner_id": owner_id,
+        "created_at": created_at
+    })
+
+    users = [
+        {
+            "id": rng_uuid(rng),
+            "username": f"c{index:05d}_{role}{n}",
+            "email": f"c{index:05d}_{role}{n}@example.com",
+            "password_hash": password_hash,
+            "role": role,
+            "company_id": company_id,
+            "created_at": created_at
+        }
+        for role, count in (("admin", args.admins_per_company), ("user", args.kiosks_per_company))
+        for n in range(count)
+    ]
+    db.users.insert_many(users, ordered=False)
+
+    employees = []
+    for number in range(1, company_size(rng, args.employees) + 1):
+        employee = {
+            "id": rng_uuid(rng),
+            "name": rng.choice(FIRST_NAMES),
+            "surname": rng.choice(SURNAMES),
+            "position": rng.choice(POSITIONS),
+            "number": str(number),
+            "qr_code": "",
+            "company_id": company_id,
+            "created_at": created_at
+        }
+        employee.update(search_fields(employee))
+        employees.append(employee)
+    db.employees.insert_many(employees, ordered=False)
+
+    entries_inserted = 0
+    batch = []
+    for employee in employees:
+        # Most employees are there from the start, the rest join over the company's lifetime
+        joined = created_at
+        if rng.random() < 0.3:
+            joined += timedelta(days=rng.randint(0, max(0, (now - created_at).days - 1)))
+        joined = joined.replace(hour=0, minute=0, second=0)
+        for entry in generate_shifts(rng, employee["id"], joined, now, args.night_share, args.open_share,
+                                     args.edit_share, args.absence_share):
+            batch.append({**entry, "company_id": company_id})
+            if len(batch) >= args.batch_size:
+                db.time_entries.insert_many(batch, ordered=False)
+                entries_inserted += len(batch)
+                batch = []
+    if batch:
+        db.time_entries.insert_many(batch, ordered=False)
+        entries_inserted += len(batch)
+
+    # What the API maintains on write for the owner directory
+    latest = db.time_entries.find_one({"employee_id": {"$in": [emp["id"] for emp in employees]}},
+                                      sort=[("date", -1)], projection={"last_scan_time": 1})
+    db.companies.update_one({"id": company_id}, {"$set": {
+        "admin_count": args.admins_per_company,
+        "user_count": len(users),
+        "employee_count": len(employees),
+        "last_activity_at": latest["last_scan_time"] if latest else created_at
+    }})
+
+    client.close()
+    return {"company_id": company_id, "employees": len(employees), "users": len(users), "entries": entries_inserted}
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate synthetic tenants, employees and shift history")
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default=os.environ.get("DB_NAME", "test_database"))
+    parser.add_argument("--companies", type=int, default=20)
+    parser.add_argument("--employees", type=int, default=50, help="Mean employees per company (sizes are skewed)")
+    parser.add_argument("--admins-per-company", type=int, default=2)
+    parser.add_argument("--kiosks-per-company", type=int, default=1)
+    parser.add_argument("--years", type=float, default=1, help="Years of shift history")
+    parser.add_argument("--night-share", type=float, default=0.15, help="Share of employees on night shifts")
+    parser.add_argument("--open-share", type=float, default=0.003, help="Share of shifts never scanned out")
+    parser.add_argument("--edit-share", type=float, default=0.02, help="Share of shifts corrected by an admin")
+    parser.add_argument("--absence-share", type=float, default=0.08, help="Share of workdays missed")
+    parser.add_argument("--batch-size", type=int, default=5000, help="Documents per insert_many")
+    parser.add_argument("--processes", type=int, default=os.cpu_count(), help="Companies generated in parallel")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--password", default="test123", help="Password of every generated user")
+    parser.add_argument("--drop", action="store_true", help="Drop the database first")
+    args = parser.parse_args()
+
+    client = MongoClient(args.mongo_url)
+    db = client[args.db_name]
+    if args.drop:
+        client.drop_database(args.db_name)
+        print(f"🗑️  Dropped {args.db_name}")
+
+    owner = db.owners.find_one({"username": "owner"})
+    if not owner:
+        owner = {
+            "id": str(uuid.uuid4()),
+            "username": "owner",
+            "email": "owner@system.com",
+            "password_hash": hash_password("owner123"),
+            "created_at": datetime.utcnow()
+        }
+        db.owners.insert_one(owner)
+    password_hash = hash_password(args.password)
+    client.close()
+
+    print(f"🏭 Generating {args.companies} companies (~{args.employees} employees each, {args.years} years) "
+          f"into {args.db_name} with {args.processes} processes")
+    started = time.monotonic()
+    totals = {"employees": 0, "users": 0, "entries": 0}
+    with ProcessPoolExecutor(max_workers=args.processes) as pool:
+        futures = [pool.submit(generate_company, index, args, owner["id"], password_hash)
+                   for index in range(args.companies)]
+        for done, future in enumerate(as_completed(futures), 1):
+            result = future.result()
+            for key in totals:
+                totals[key] += result[key]
+            elapsed = time.monotonic() - started
+            print(f"   {done}/{args.companies} companies, {totals['entries']:,} entries "
+                  f"({totals['entries'] / elapsed:,.0f}/s)", end="\r")
+
+    elapsed = time.monotonic() - started
+    print(f"\n✅ Generated {args.companies} companies, {totals['users']:,} users, {totals['employees']:,} employees "
+          f"and {totals['entries']:,} time entries in {elapsed:.1f}s")
+    print(f"🔑 Users log in as c00000_admin0 / c00000_user0 with password '{args.password}'")
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -6,9 +6,9 @@ Initialize owner account for Multi-Tenant Time Tracking System
 import asyncio
 import os
 from motor.motor_asyncio import AsyncIOMotorClient
-from passlib.context import CryptContext
 from dotenv import load_dotenv
 from pathlib import Path
+import sys
 import uuid
 from datetime import datetime
 
@@ -21,11 +21,9 @@ mongo_url = os.environ['MONGO_URL']
 client = AsyncIOMotorClient(mongo_url)
 db = client[os.environ['DB_NAME']]
 
-# Password hashing
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
-
-def get_password_hash(password: str) -> str:
-    return pwd_context.hash(password)
+# Password hashing, with the schemes and costs configured for the API
+sys.path.insert(0, str(ROOT_DIR))
+from passwords import hash_password  # noqa: E402
 
 async def create_owner_account():
     """Create initial owner account"""
@@ -43,7 +41,7 @@ async def create_owner_account():
         "id": str(uuid.uuid4()),
         "username": "owner",
         "email": "owner@system.com",
-        "password_hash": get_password_hash("owner123"),
+        "password_hash": hash_password("owner123"),
         "created_at": datetime.utcnow()
     }
     
@@ -0,0 +1,326 @@
+#!/usr/bin/env python3
+"""
+Load test scenarios for the Multi-Tenant Time Tracking System
+
+Simulates a shift change: many kiosks scanning badges at once, while admins
+open reports and owners load the company list. Seeds its own tenants into a
+local MongoDB, runs against an existing server or starts uvicorn itself, and
+reports throughput and p50/p95/p99 latency per endpoint.
+
+Examples:
+    # Start a server against a throwaway database and save a baseline
+    python load_test.py --start-server --save-baseline baselines/load.json
+
+    # Compare a new run with the baseline; exits 1 on a regression over 20%
+    python load_test.py --start-server --baseline baselines/load.json --max-regression 0.2
+"""
+
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import subprocess
+import sys
+import time
+import uuid
+from datetime import datetime
+from pathlib import Path
+
+import httpx
+from dotenv import load_dotenv
+from motor.motor_asyncio import AsyncIOMotorClient
+
+ROOT_DIR = Path(__file__).parent
+# Badges and password hashes follow the settings the server reads from backend/.env
+load_dotenv(ROOT_DIR / "backend" / ".env")
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+
+import badges  # noqa: E402
+import passwords  # noqa: E402
+
+PASSWORD = "load123"
+
+def percentile(sorted_values, fraction):
+    if not sorted_values:
+        return None
+    # Nearest-rank percentile
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+class Recorder:
+    """Collects latency samples and status codes per endpoint"""
+
+    def __init__(self):
+        self.samples = {}
+        self.statuses = {}
+
+    def record(self, endpoint, seconds, status_code):
+        self.samples.setdefault(endpoint, []).append(seconds)
+        statuses = self.statuses.setdefault(endpoint, {})
+        statuses[str(status_code)] = statuses.get(str(status_code), 0) + 1
+
+    def summary(self, duration):
+        result = {}
+        for endpoint, samples in sorted(self.samples.items()):
+            ordered = sorted(samples)
+            statuses = self.statuses[endpoint]
+            errors = sum(count for code, count in statuses.items() if code == "error" or code.startswith("5"))
+            result[endpoint] = {
+                "requests": len(ordered),
+                "throughput_rps": round(len(ordered) / duration, 2),
+                "p50_ms": round(percentile(ordered, 0.50) * 1000, 2),
+                "p95_ms": round(percentile(ordered, 0.95) * 1000, 2),
+                "p99_ms": round(percentile(ordered, 0.99) * 1000, 2),
+                "max_ms": round(ordered[-1] * 1000, 2),
+                "errors": errors,
+                "statuses": statuses
+            }
+        return result
+
+async def timed(client, recorder, endpoint, method, url, **kwargs):
+    started = time.perf_counter()
+    try:
+        response = await client.request(method, url, **kwargs)
+        status_code = response.status_code
+    except httpx.HTTPError:
+        response = None
+        status_code = "error"
+    recorder.record(endpoint, time.perf_counter() - started, status_code)
+    return response
+
+async def seed(db, companies, employees_per_company, admins_per_company):
+    """Insert an owner and synthetic tenants directly; returns what the scenarios need"""
+    password_hash = passwords.hash_password(PASSWORD)
+    now = datetime.utcnow()
+    owner = {
+        "id": str(uuid.uuid4()),
+        "username": f"load_owner_{uuid.uuid4().hex[:8]}",
+        "email": "load_owner@example.com",
+        "password_hash": password_hash,
+        "created_at": now
+    }
+    await db.owners.insert_one(owner)
+
+    tenants = []
+    for c in range(companies):
+        company_id = str(uuid.uuid4())
+        await db.companies.insert_one({
+            "id": company_id, "name": f"Load Company {c} {company_id[:8]}", "owner_id": owner["id"], "created_at": now,
+            "roster_version": employees_per_company
+        })
+        users = [
+            {
+                "id": str(uuid.uuid4()),
+                "username": f"load_{company_id[:8]}_{role}_{i}",
+                "email": f"load_{company_id[:8]}_{role}_{i}@example.com",
+                "password_hash": password_hash,
+                "role": role,
+                "company_id": company_id,
+                "created_at": now
+            }
+            for role, count in (("admin", admins_per_company), ("user", 1))
+            for i in range(count)
+        ]
+        await db.users.insert_many(users)
+        employees = [
+            {
+                "id": str(uuid.uuid4()),
+                "name": f"Imie{n}",
+                "surname": f"Nazwisko{n}",
+                "position": "Pracownik",
+                "number": str(n),
+                "qr_code": "",
+                "badge_kid": badges.QR_SIGNING_KID,
+                "company_id": company_id,
+                "roster_version": n + 1,
+                "created_at": now
+            }
+            for n in range(employees_per_company)
+        ]
+        await db.employees.insert_many(employees)
+        tenants.append({
+            "company_id": company_id,
+            "admins": [u["username"] for u in users if u["role"] == "admin"],
+            "kiosk_user": next(u["username"] for u in users if u["role"] == "user"),
+            "qr_codes": [badges.sign(company_id, emp["id"]) for emp in employees]
+        })
+    return owner["username"], tenants
+
+async def login(client, username):
+    response = await client.post("/api/auth/login", json={"username": username, "password": PASSWORD})
+    response.raise_for_status()
+    return {"Authorization": f"Bearer {response.json()['access_token']}"}
+
+async def kiosk(client, recorder, headers, qr_codes, stop_at, think_time):
+    """One kiosk at the door: badges come in back to back during the peak"""
+    payloads = list(qr_codes)
+    random.shuffle(payloads)
+    position = 0
+    while time.monotonic() < stop_at:
+        qr_data = payloads[position % len(payloads)]
+        position += 1
+        await timed(client, recorder, "POST /api/time/scan", "POST", "/api/time/scan",
+                    json={"qr_data": qr_data}, headers=headers)
+        await asyncio.sleep(random.uniform(0, think_time))
+
+async def admin(client, recorder, headers, stop_at, think_time):
+    while time.monotonic() < stop_at:
+        await timed(client, recorder, "GET /api/time/entries", "GET", "/api/time/entries", headers=headers)
+        await timed(client, recorder, "GET /api/employees", "GET", "/api/employees", headers=headers)
+        await asyncio.sleep(random.uniform(think_time / 2, think_time))
+
+async def owner(client, recorder, headers, stop_at, think_time):
+    while time.monotonic() < stop_at:
+        await timed(client, recorder, "GET /api/owner/companies", "GET", "/api/owner/companies", headers=headers)
+        await asyncio.sleep(random.uniform(think_time / 2, think_time))
+
+async def run_scenario(args, base_url, owner_username, tenants):
+    recorder = Recorder()
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=base_url, timeout=args.timeout, limits=limits) as client:
+        owner_headers = await login(client, owner_username)
+        kiosk_headers = [await login(client, tenant["kiosk_user"]) for tenant in tenants]
+        admin_headers = [await login(client, username) for tenant in tenants for username in tenant["admins"]]
+
+        print(f"🚀 Running {args.kiosks} kiosks, {len(admin_headers)} admins, {args.owners} owners "
+              f"for {args.duration}s against {base_url}")
+        stop_at = time.monotonic() + args.duration
+        tasks = []
+        for k in range(args.kiosks):
+            tenant_index = k % len(tenants)
+            # Kiosks of one company split its badges between them, as at separate doors
+            tenant = tenants[tenant_index]
+            kiosks_of_tenant = len(range(tenant_index, args.kiosks, len(tenants)))
+            share = tenant["qr_codes"][k // len(tenants)::kiosks_of_tenant] or tenant["qr_codes"]
+            tasks.append(kiosk(client, recorder, kiosk_headers[tenant_index], share, stop_at, args.kiosk_think_time))
+        tasks += [admin(client, recorder, headers, stop_at, args.admin_think_time) for headers in admin_headers]
+        tasks += [owner(client, recorder, owner_headers, stop_at, args.owner_think_time) for _ in range(args.owners)]
+
+        started = time.monotonic()
+        await asyncio.gather(*tasks)
+        return recorder.summary(time.monotonic() - started)
+
+def compare(results, baseline, max_regression):
+    """Return human-readable regressions of p95/p99 latency and throughput against a baseline"""
+    regressions = []
+    for endpoint, current in results["endpoints"].items():
+        previous = baseline.get("endpoints", {}).get(endpoint)
+        if not previous:
+            continue
+        for metric in ("p95_ms", "p99_ms"):
+            if previous[metric] and current[metric] > previous[metric] * (1 + max_regression):
+                regressions.append(f"{endpoint} {metric}: {previous[metric]} -> {current[metric]}")
+        if previous["throughput_rps"] and current["throughput_rps"] < previous["throughput_rps"] * (1 - max_regression):
+            regressions.append(
+                f"{endpoint} throughput_rps: {previous['throughput_rps']} -> {current['throughput_rps']}"
+            )
+        if current["errors"] > previous["errors"]:
+            regressions.append(f"{endpoint} errors: {previous['errors']} -> {current['errors']}")
+    return regressions
+
+def start_server(args):
+    env = {**os.environ, "MONGO_URL": args.mongo_url, "DB_NAME": args.db_name}
+    process = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "server:app", "--host", "127.0.0.1", "--port", str(args.port),
+         "--workers", str(args.workers), "--log-level", "warning"],
+        cwd=ROOT_DIR / "backend",
+        env=env
+    )
+    base_url = f"http://127.0.0.1:{args.port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{base_url}/api/").status_code == 200:
+                return process, base_url
+        except httpx.HTTPError:
+            pass
+        if process.poll() is not None:
+            raise RuntimeError("Server exited during startup")
+        time.sleep(0.2)
+    process.terminate()
+    raise RuntimeError("Server did not become ready within 30s")
+
+def print_results(endpoints):
+    print(f"\n{'endpoint':32} {'reqs':>7} {'rps':>8} {'p50':>8} {'p95':>8} {'p99':>8} {'errors':>7}")
+    for endpoint, stats in endpoints.items():
+        print(f"{endpoint:32} {stats['requests']:>7} {stats['throughput_rps']:>8} {stats['p50_ms']:>8} "
+              f"{stats['p95_ms']:>8} {stats['p99_ms']:>8} {stats['errors']:>7}")
+
+async def main(args):
+    mongo = AsyncIOMotorClient(args.mongo_url)
+    db = mongo[args.db_name]
+    process = None
+    try:
+        print(f"🌱 Seeding {args.companies} companies x {args.employees} employees into {args.db_name}")
+        owner_username, tenants = await seed(db, args.companies, args.employees, args.admins_per_company)
+
+        if args.start_server:
+            process, base_url = start_server(args)
+        else:
+            base_url = args.base_url
+        endpoints = await run_scenario(args, base_url, owner_username, tenants)
+    finally:
+        if process:
+            process.terminate()
+            process.wait()
+        if args.start_server and not args.keep_data:
+            await mongo.drop_database(args.db_name)
+        mongo.close()
+
+    results = {
+        "created_at": datetime.utcnow().isoformat(),
+        "config": {
+            key: getattr(args, key)
+            for key in ("companies", "employees", "kiosks", "admins_per_company", "owners", "duration", "workers")
+        },
+        "endpoints": endpoints
+    }
+    print_results(endpoints)
+
+    if args.save_baseline:
+        Path(args.save_baseline).parent.mkdir(parents=True, exist_ok=True)
+        Path(args.save_baseline).write_text(json.dumps(results, indent=2))
+        print(f"\n💾 Saved results to {args.save_baseline}")
+
+    if args.baseline:
+        baseline = json.loads(Path(args.baseline).read_text())
+        regressions = compare(results, baseline, args.max_regression)
+        if regressions:
+            print(f"\n❌ Regressions over {args.max_regression:.0%} against {args.baseline}:")
+            for regression in regressions:
+                print(f"   {regression}")
+            return 1
+        print(f"\n✅ No regressions over {args.max_regression:.0%} against {args.baseline}")
+    return 0
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Kiosk shift-change load test")
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default=f"loadtest_{uuid.uuid4().hex[:8]}")
+    parser.add_argument("--base-url", default="http://localhost:8001",
+                        help="Server to test; must use the same database as --db-name")
+    parser.add_argument("--start-server", action="store_true", help="Start uvicorn against --db-name")
+    parser.add_argument("--port", type=int, default=8011)
+    parser.add_argument("--workers", type=int, default=1)
+    parser.add_argument("--keep-data", action="store_true", help="Do not drop the seeded database afterwards")
+    parser.add_argument("--companies", type=int, default=10)
+    parser.add_argument("--employees", type=int, default=200, help="Employees per company")
+    parser.add_argument("--admins-per-company", type=int, default=1)
+    parser.add_argument("--kiosks", type=int, default=200)
+    parser.add_argument("--owners", type=int, default=1)
+    parser.add_argument("--duration", type=float, default=30, help="Seconds of peak traffic")
+    parser.add_argument("--kiosk-think-time", type=float, default=1.0)
+    parser.add_argument("--admin-think-time", type=float, default=5.0)
+    parser.add_argument("--owner-think-time", type=float, default=10.0)
+    parser.add_argument("--timeout", type=float, default=30.0)
+    parser.add_argument("--max-connections", type=int, default=500)
+    parser.add_argument("--save-baseline", help="Write results as JSON to this path")
+    parser.add_argument("--baseline", help="Compare against this JSON baseline")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="Allowed relative increase of p95/p99 latency (and drop in throughput)")
+    return parser.parse_args()
+
+if __name__ == "__main__":
+    sys.exit(asyncio.run(main(parse_args())))
@@ -0,0 +1,138 @@
+"""
+Per-company admission control: limits, fair turns between companies, priority
+lanes and rejection
+"""
+
+import asyncio
+import sys
+import time
+import unittest
+from pathlib import Path
+
+import jwt
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+import admission  # noqa: E402
+
+SECRET = "admission-test-secret-of-32-bytes"
+
+class AdmissionControllerTest(unittest.TestCase):
+    def test_companies_take_turns_when_the_process_is_saturated(self):
+        async def run():
+            controller = admission.AdmissionController(max_concurrency=1, tenant_concurrency=10, rate=1000,
+                                                       burst=1000)
+            order = []
+
+            async def request(company_id, label):
+                await controller.acquire(company_id)
+                order.append(label)
+                await asyncio.sleep(0.001)
+                controller.release(company_id)
+
+            noisy = [asyncio.create_task(request("noisy", f"noisy{i}")) for i in range(6)]
+            await asyncio.sleep(0)
+            quiet = asyncio.create_task(request("quiet", "quiet"))
+            await asyncio.gather(*noisy, quiet)
+            # The first noisy request was running; the quiet one is next after one more noisy turn at most
+            self.assertLessEqual(order.index("quiet"), 2)
+        asyncio.run(run())
+
+    def test_token_bucket_delays_bursts(self):
+        async def run():
+            controller = admission.AdmissionController(rate=20, burst=2)
+            started = time.monotonic()
+            for _ in range(3):
+                await controller.acquire("acme")
+                controller.release("acme")
+            return time.monotonic() - started
+        self.assertGreaterEqual(asyncio.run(run()), 0.04)
+
+    def test_tenant_concurrency_limit(self):
+        async def run():
+            controller = admission.AdmissionController(tenant_concurrency=2, rate=1000, burst=1000)
+            await controller.acquire("acme")
+            await controller.acquire("acme")
+            waiting = asyncio.create_task(controller.acquire("acme"))
+            await asyncio.sleep(0.01)
+            self.assertFalse(waiting.done())
+            await controller.acquire("other")  # Other companies are not held up
+            controller.release("acme")
+            await asyncio.wait_for(waiting, 1)
+            self.assertEqual(controller.tenants["acme"].in_flight, 2)
+        asyncio.run(run())
+
+    def test_full_queue_and_timeout_are_rejected(self):
+        async def run():
+            controller = admission.AdmissionController(tenant_concurrency=1, max_queue=1, queue_timeout=0.05)
+            await controller.acquire("acme")
+            waiting = asyncio.create_task(controller.acquire("acme"))
+            await asyncio.sleep(0)
+            with self.assertRaises(admission.AdmissionRejected) as full:
+                await controller.acquire("acme")
+            self.assertEqual(full.exception.reason, "queue_full")
+            with self.assertRaises(admission.AdmissionRejected) as timeout:
+                await waiting
+            self.assertEqual(timeout.exception.reason, "timeout")
+            controller.release("acme")
+            self.assertEqual((controller.in_flight, controller.snapshot()["queued"]), (0, 0))
+        asyncio.run(run())
+
+class LanesTest(unittest.TestCase):
+    def lanes(self, **kwargs):
+        return admission.Lanes({
+            "scan": admission.AdmissionController("scan", max_concurrency=2, queue_timeout=0.05),
+            "report": admission.AdmissionController("report", max_concurrency=1, queue_timeout=0.05),
+            "default": admission.AdmissionController("default", max_concurrency=4),
+        }, **kwargs)
+
+    def test_routes_map_to_lanes(self):
+        self.assertEqual(admission.Lanes.lane_for("POST", "/api/time/scan"), "scan")
+        self.assertEqual(admission.Lanes.lane_for("GET", "/api/time/entries"), "report")
+        self.assertEqual(admission.Lanes.lane_for("GET", "/api/time/entries/emp-1"), "report")
+        self.assertEqual(admission.Lanes.lane_for("POST", "/api/time/entries"), "default")
+        self.assertEqual(admission.Lanes.lane_for("GET", "/api/employees"), "default")
+
+    def test_scans_keep_their_capacity_while_reports_are_saturated(self):
+        async def run():
+            lanes = self.lanes()
+            await lanes.acquire("report", "noisy")
+            with self.assertRaises(admission.AdmissionRejected):
+                await lanes.acquire("report", "quiet")
+            await lanes.acquire("scan", "quiet")
+            await lanes.acquire("scan", "noisy")
+        asyncio.run(run())
+
+    def test_reports_are_shed_while_scans_miss_their_objective(self):
+        async def run():
+            lanes = self.lanes(scan_slo_ms=100)
+            for _ in range(admission.SCAN_LATENCY_MIN_SAMPLES):
+                lanes.scan_latency.observe(0.01)
+            await lanes.acquire("report", "acme")
+            lanes.release("report", "acme")
+
+            for _ in range(admission.SCAN_LATENCY_MIN_SAMPLES):
+                lanes.scan_latency.observe(0.5)
+            with self.assertRaises(admission.AdmissionRejected) as shed:
+                await lanes.acquire("report", "acme")
+            self.assertEqual(shed.exception.reason, "shed")
+            self.assertTrue(lanes.snapshot()["shedding"])
+            await lanes.acquire("scan", "acme")  # Scans and other work are still admitted
+            await lanes.acquire("default", "acme")
+        asyncio.run(run())
+
+class CompanyFromScopeTest(unittest.TestCase):
+    def scope(self, token):
+        return {"headers": [(b"authorization", f"Bearer {token}".encode())]}
+
+    def test_only_valid_company_user_tokens_are_limited(self):
+        user = jwt.encode({"sub": "admin", "company_id": "acme", "type": "user"}, SECRET, algorithm="HS256")
+        owner = jwt.encode({"sub": "owner", "type": "owner"}, SECRET, algorithm="HS256")
+        forged = jwt.encode({"sub": "admin", "company_id": "acme"}, "a-different-secret-of-32-bytes-xx", algorithm="HS256")
+        self.assertEqual(admission.company_from_scope(self.scope(user), SECRET, "HS256"), "acme")
+        self.assertIsNone(admission.company_from_scope(self.scope(owner), SECRET, "HS256"))
+        self.assertIsNone(admission.company_from_scope(self.scope(forged), SECRET, "HS256"))
+        self.assertIsNone(admission.company_from_scope({"headers": []}, SECRET, "HS256"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,77 @@
+"""
+Archived time entries: bounded reads, edits and deletes in their monthly buckets
+"""
+
+import asyncio
+import sys
+import unittest
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import archive  # noqa: E402
+import timesheets  # noqa: E402
+from fake_db import FakeDatabase  # noqa: E402
+
+def entry(entry_id, employee_id, date):
+    check_in = datetime.fromisoformat(f"{date}T08:00")
+    return {"id": entry_id, "employee_id": employee_id, "date": date, "check_in": check_in,
+            "check_out": check_in.replace(hour=16), "status": "completed", "last_scan_time": check_in}
+
+class ArchiveTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, archive, "ARCHIVE_BATCH_PAUSE_SECONDS", archive.ARCHIVE_BATCH_PAUSE_SECONDS)
+        archive.ARCHIVE_BATCH_PAUSE_SECONDS = 0
+        self.db = FakeDatabase()
+
+    def archived(self, entries):
+        async def run():
+            await self.db.employees.insert_many([{"id": "anna", "company_id": "acme"},
+                                                 {"id": "piotr", "company_id": "acme"}])
+            await self.db.time_entries.insert_many(entries)
+            await archive.archive_completed_entries(self.db, horizon="2024-06-01")
+        asyncio.run(run())
+
+    def test_reads_stop_at_the_month_that_fills_the_limit(self):
+        self.archived([entry(f"{employee}-{month}", employee, f"2024-{month:02d}-10")
+                       for employee in ("anna", "piotr") for month in range(1, 6)])
+
+        found = asyncio.run(archive.find_archived_entries(
+            self.db, ["anna", "piotr"], limit=3, exclude_ids=["piotr-5"]
+        ))
+        self.assertEqual([item["id"] for item in found], ["anna-5", "anna-4", "piotr-4"])
+        self.assertTrue(all(item["archived"] for item in found))
+
+    def test_archived_entries_are_edited_and_deleted_in_place(self):
+        self.archived([entry("march", "anna", "2024-03-10"), entry("april", "anna", "2024-04-10")])
+
+        async def run():
+            found = await archive.find_archived_by_ids(self.db, ["march", "april", "missing"])
+            same_month = await archive.update_archived_entry(
+                self.db, found["march"], {"check_out": datetime(2024, 3, 10, 18, 0)}
+            )
+            moved = await archive.update_archived_entry(self.db, found["april"], {"date": "2024-02-01"})
+            deleted = await archive.delete_archived_entry(self.db, {**found["march"], **same_month})
+            buckets = await self.db.time_entries_archive.find({}, {"_id": 0}).to_list(None)
+            return found, same_month, moved, deleted, {bucket["month"]: bucket for bucket in buckets}
+
+        found, same_month, moved, deleted, buckets = asyncio.run(run())
+        self.assertEqual(set(found), {"march", "april"})
+        self.assertEqual(same_month["check_out"], datetime(2024, 3, 10, 18, 0))
+        self.assertTrue(deleted)
+        self.assertEqual((buckets["2024-03"]["entries"], buckets["2024-03"]["entry_ids"]), ({}, []))
+        self.assertEqual(buckets["2024-04"]["entry_ids"], [])
+        self.assertEqual(buckets["2024-02"]["entry_ids"], ["april"])
+        self.assertEqual(buckets["2024-02"]["entries"]["april"]["date"], moved["date"])
+
+    def test_auto_closed_flag_reaches_the_timesheet(self):
+        self.archived([{**entry("swept", "anna", "2024-03-10"), "auto_closed": True}])
+
+        found = asyncio.run(timesheets.month_entries(self.db, ["anna"], "2024-03"))["anna"]
+        self.assertTrue(found[0]["auto_closed"])
+        self.assertIn("zakończona (auto)", timesheets.timesheet_rows("2024-03", found)[9])
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,97 @@
+"""
+Signed employee badges: verification, key rotation and reissue
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+import uuid
+from pathlib import Path
+from unittest import mock
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import badges  # noqa: E402
+from fake_db import FakeDatabase  # noqa: E402
+
+COMPANY = str(uuid.uuid4())
+EMPLOYEE = str(uuid.uuid4())
+
+class SigningKeysMixin:
+    def use_keys(self, keys, kid):
+        self.addCleanup(setattr, badges, "SIGNING_KEYS", badges.SIGNING_KEYS)
+        self.addCleanup(setattr, badges, "QR_SIGNING_KID", badges.QR_SIGNING_KID)
+        badges.SIGNING_KEYS, badges.QR_SIGNING_KID = keys, kid
+
+class VerifyTest(SigningKeysMixin, unittest.TestCase):
+    def setUp(self):
+        self.use_keys({"k1": b"first-secret", "k2": b"second-secret"}, "k1")
+
+    def test_badge_names_the_employee(self):
+        payload = badges.sign(COMPANY, EMPLOYEE)
+        self.assertTrue(badges.is_signed(payload))
+        self.assertLess(len(payload), 80)
+        self.assertEqual(badges.verify(payload, COMPANY), EMPLOYEE)
+
+    def test_forged_badges_are_refused(self):
+        payload = badges.sign(COMPANY, EMPLOYEE)
+        prefix, kid, ids, signature = payload.split(".")
+        other_ids = badges.sign(COMPANY, str(uuid.uuid4())).split(".")[2]
+        for forged in (f"{prefix}.{kid}.{other_ids}.{signature}",
+                       f"{prefix}.{kid}.{ids}.{signature[:-1]}{'B' if signature.endswith('A') else 'A'}",
+                       f"{prefix}.k2.{ids}.{signature}",
+                       f"{prefix}.k9.{ids}.{signature}",
+                       "E1.k1.not-base64!.x"):
+            with self.assertRaises(badges.InvalidBadge, msg=forged):
+                badges.verify(forged, COMPANY)
+
+    def test_badge_of_another_company_is_foreign(self):
+        with self.assertRaises(badges.ForeignBadge):
+            badges.verify(badges.sign(str(uuid.uuid4()), EMPLOYEE), COMPANY)
+
+    def test_old_key_verifies_until_it_is_dropped(self):
+        payload = badges.sign(COMPANY, EMPLOYEE)
+        badges.QR_SIGNING_KID = "k2"
+        self.assertEqual(badges.verify(payload, COMPANY), EMPLOYEE)
+        badges.SIGNING_KEYS = {"k2": b"second-secret"}
+        with self.assertRaises(badges.InvalidBadge):
+            badges.verify(payload, COMPANY)
+
+    def test_key_derived_from_the_jwt_secret_is_warned_about(self):
+        with mock.patch.dict(os.environ, {"QR_SIGNING_KEYS": ""}), self.assertLogs("badges", "WARNING"):
+            self.assertEqual(list(badges._load_keys()), ["0"])
+        with mock.patch.dict(os.environ, {"QR_SIGNING_KEYS": "k1:first-secret"}), \
+                self.assertNoLogs("badges", "WARNING"):
+            self.assertEqual(badges._load_keys(), {"k1": b"first-secret"})
+
+    def test_legacy_badges_parse(self):
+        self.assertEqual(badges.parse_legacy(f"EMP_{COMPANY}_17_ab12cd34"), (COMPANY, "17"))
+        with self.assertRaises(badges.InvalidBadge):
+            badges.parse_legacy("EMP_only")
+
+class ReissueTest(SigningKeysMixin, unittest.TestCase):
+    def test_badges_of_other_keys_and_legacy_badges_are_redrawn(self):
+        self.use_keys({"k1": b"first-secret", "k2": b"second-secret"}, "k2")
+        self.addCleanup(setattr, badges, "BADGE_REISSUE_BATCH_PAUSE_SECONDS", badges.BADGE_REISSUE_BATCH_PAUSE_SECONDS)
+        badges.BADGE_REISSUE_BATCH_PAUSE_SECONDS = 0
+
+        async def run():
+            db = FakeDatabase()
+            await db.employees.insert_many([
+                {"id": str(uuid.uuid4()), "company_id": COMPANY, "qr_code": "old", "badge_kid": "k1"},
+                {"id": str(uuid.uuid4()), "company_id": COMPANY, "qr_code": "legacy"},
+                {"id": str(uuid.uuid4()), "company_id": COMPANY, "qr_code": "current", "badge_kid": "k2"},
+            ])
+            reissued = await badges.reissue(db)
+            return reissued, await db.employees.find({}, {"_id": 0}).to_list(None)
+
+        reissued, employees = asyncio.run(run())
+        self.assertEqual(reissued, 2)
+        self.assertEqual({employee["badge_kid"] for employee in employees}, {"k2"})
+        self.assertTrue(all(employee["qr_code"].startswith("data:image/png;base64,")
+                            for employee in employees if employee["qr_code"] != "current"))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,69 @@
+"""
+Motor client configuration and analytics read routing
+
+The routing test needs a replica set (a single host is enough, see
+backend/database.py) at MONGO_URL and is skipped otherwise.
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+import unittest.mock
+import uuid
+from pathlib import Path
+
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+from pymongo.read_preferences import ReadPreference
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+
+import database  # noqa: E402
+
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+
+def replica_set_available():
+    try:
+        hello = MongoClient(MONGO_URL, serverSelectionTimeoutMS=1000).admin.command("hello")
+        return "setName" in hello
+    except PyMongoError:
+        return False
+
+class ClientOptionsTest(unittest.TestCase):
+    def test_unavailable_compressors_are_skipped(self):
+        self.assertEqual(database.available_compressors("zlib"), ["zlib"])
+        self.assertEqual(database.available_compressors(""), [])
+        with unittest.mock.patch.object(database, "find_spec", return_value=None):
+            self.assertEqual(database.available_compressors("zstd,snappy,zlib"), ["zlib"])
+
+    def test_explicit_settings_override_environment(self):
+        client = database.create_client(MONGO_URL, maxPoolSize=7, connect=False)
+        self.assertEqual(client.delegate.options.pool_options.max_pool_size, 7)
+        self.assertEqual(client.delegate.options.pool_options.min_pool_size, database.MONGO_MIN_POOL_SIZE)
+
+    def test_analytics_reads_prefer_bounded_secondaries(self):
+        client = database.create_client(MONGO_URL, connect=False)
+        analytics = database.analytics_database(client, "test")
+        self.assertEqual(analytics.read_preference.mode, ReadPreference.SECONDARY_PREFERRED.mode)
+        self.assertEqual(analytics.read_preference.max_staleness, database.MONGO_ANALYTICS_MAX_STALENESS_SECONDS)
+        self.assertEqual(client["test"].read_preference, ReadPreference.PRIMARY)
+
+@unittest.skipUnless(replica_set_available(), f"No replica set reachable at {MONGO_URL}")
+class ReplicaSetRoutingTest(unittest.TestCase):
+    def test_writes_on_primary_are_readable_through_analytics(self):
+        async def run():
+            client = database.create_client(MONGO_URL)
+            name = f"routing_test_{uuid.uuid4().hex[:8]}"
+            try:
+                await client[name].time_entries.insert_one({"id": "e1", "employee_id": "emp"})
+                found = await database.analytics_database(client, name).time_entries.find_one({"id": "e1"})
+                self.assertEqual(found["employee_id"], "emp")
+            finally:
+                await client.drop_database(name)
+                client.close()
+
+        asyncio.run(run())
+
+if __name__ == "__main__":
+    unittest.main()
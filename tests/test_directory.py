@@ -0,0 +1,43 @@
+"""
+Owner company directory: keyset pages over companies missing their sort field
+"""
+
+import asyncio
+import sys
+import unittest
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import directory  # noqa: E402
+from fake_db import FakeDatabase  # noqa: E402
+
+class DirectoryTest(unittest.TestCase):
+    def setUp(self):
+        self.db = FakeDatabase()
+        asyncio.run(self.db.companies.insert_many([
+            {"id": "a", "name": "Alfa", "last_activity_at": datetime(2024, 5, 1)},
+            {"id": "b", "name": "Beta"},
+            {"id": "c", "name": "Gamma", "last_activity_at": None},
+            {"id": "d", "name": "Delta", "last_activity_at": datetime(2024, 3, 1)},
+        ]))
+
+    def pages(self, order):
+        async def run():
+            ids, cursor = [], None
+            while True:
+                page = await directory.list_companies(self.db, None, "activity", order, 1, cursor)
+                ids += [company["id"] for company in page["companies"]]
+                cursor = page["next_cursor"]
+                if not cursor:
+                    return ids
+        return asyncio.run(run())
+
+    def test_pages_run_through_companies_without_activity(self):
+        self.assertEqual(self.pages("asc"), ["b", "c", "d", "a"])
+        self.assertEqual(self.pages("desc"), ["a", "d", "c", "b"])
+
+if __name__ == "__main__":
+    unittest.main()
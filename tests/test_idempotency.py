@@ -0,0 +1,131 @@
+"""
+Idempotency-Key replays: stores and the middleware in front of the scan endpoint
+"""
+
+import asyncio
+import json
+import sys
+import unittest
+from pathlib import Path
+
+import httpx
+import jwt
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import idempotency  # noqa: E402
+from fake_db import FakeDatabase  # noqa: E402
+
+SECRET = "idempotency-test-secret-of-32-bytes"
+
+def token(company_id):
+    return jwt.encode({"sub": "kiosk", "company_id": company_id, "type": "user"}, SECRET, algorithm="HS256")
+
+class StoreTestMixin:
+    """Tests shared by the stores; their setUp sets self.store"""
+
+    def test_completed_response_is_replayed(self):
+        async def run():
+            self.assertIsNone(await self.store.begin("acme:k1", "body"))
+            await self.store.complete("acme:k1", (200, [["content-type", "application/json"]], b'{"ok":1}'))
+            self.assertEqual(await self.store.begin("acme:k1", "body"),
+                             (200, [["content-type", "application/json"]], b'{"ok":1}'))
+        asyncio.run(run())
+
+    def test_key_reused_with_other_body_is_refused(self):
+        async def run():
+            await self.store.begin("acme:k1", "body")
+            with self.assertRaises(idempotency.IdempotencyConflict) as conflict:
+                await self.store.begin("acme:k1", "other body")
+            self.assertEqual(conflict.exception.status_code, 422)
+        asyncio.run(run())
+
+    def test_retry_waits_for_the_first_attempt(self):
+        async def run():
+            await self.store.begin("acme:k1", "body")
+            retry = asyncio.create_task(self.store.begin("acme:k1", "body"))
+            await asyncio.sleep(0.01)
+            self.assertFalse(retry.done())
+            await self.store.complete("acme:k1", (200, [], b"first"))
+            self.assertEqual((await retry)[2], b"first")
+        asyncio.run(run())
+
+    def test_abandoned_key_runs_again(self):
+        async def run():
+            await self.store.begin("acme:k1", "body")
+            await self.store.abandon("acme:k1")
+            self.assertIsNone(await self.store.begin("acme:k1", "body"))
+        asyncio.run(run())
+
+class MemoryStoreTest(StoreTestMixin, unittest.TestCase):
+    def setUp(self):
+        self.store = idempotency.MemoryStore(window=60, max_keys=100, wait=1)
+
+    def test_oldest_keys_are_evicted(self):
+        async def run():
+            store = idempotency.MemoryStore(window=60, max_keys=2, wait=1)
+            for key in ("a", "b", "c"):
+                await store.begin(key, "body")
+                await store.complete(key, (200, [], key.encode()))
+            self.assertIsNone(await store.begin("a", "body"))
+            self.assertEqual((await store.begin("c", "body"))[2], b"c")
+        asyncio.run(run())
+
+class MongoStoreTest(StoreTestMixin, unittest.TestCase):
+    def setUp(self):
+        self.store = idempotency.MongoStore(FakeDatabase(), window=60, wait=1)
+
+class IdempotencyMiddlewareTest(unittest.TestCase):
+    def setUp(self):
+        self.calls = 0
+
+        async def app(scope, receive, send):
+            self.calls += 1
+            body = json.loads((await receive())["body"])
+            status = 200 if body.get("ok", True) else 400
+            payload = json.dumps({"call": self.calls}).encode()
+            await send({"type": "http.response.start", "status": status,
+                        "headers": [(b"content-type", b"application/json")]})
+            await send({"type": "http.response.body", "body": payload})
+
+        self.app = idempotency.IdempotencyMiddleware(
+            app, idempotency.MemoryStore(window=60, max_keys=100, wait=1), {("POST", "/api/time/scan")},
+            SECRET, "HS256"
+        )
+
+    def post(self, json_body, key=None, company_id="acme"):
+        async def run():
+            headers = {"Authorization": f"Bearer {token(company_id)}"}
+            if key:
+                headers["Idempotency-Key"] = key
+            transport = httpx.ASGITransport(app=self.app)
+            async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+                return await client.post("/api/time/scan", json=json_body, headers=headers)
+        return asyncio.run(run())
+
+    def test_retry_gets_the_original_response(self):
+        first = self.post({"qr_data": "EMP_acme_1_x"}, key="k1")
+        retry = self.post({"qr_data": "EMP_acme_1_x"}, key="k1")
+        self.assertEqual(retry.json(), first.json())
+        self.assertEqual(retry.headers["idempotent-replayed"], "true")
+        self.assertEqual(self.calls, 1)
+
+    def test_keys_are_scoped_to_the_company(self):
+        self.post({"qr_data": "x"}, key="k1", company_id="acme")
+        self.post({"qr_data": "x"}, key="k1", company_id="other")
+        self.assertEqual(self.calls, 2)
+
+    def test_errors_and_keyless_requests_are_not_kept(self):
+        self.post({"ok": False}, key="k1")
+        self.post({"ok": False}, key="k1")
+        self.post({"qr_data": "x"})
+        self.post({"qr_data": "x"})
+        self.assertEqual(self.calls, 4)
+
+    def test_key_reused_for_another_scan_is_refused(self):
+        self.post({"qr_data": "EMP_acme_1_x"}, key="k1")
+        self.assertEqual(self.post({"qr_data": "EMP_acme_2_x"}, key="k1").status_code, 422)
+
+if __name__ == "__main__":
+    unittest.main()
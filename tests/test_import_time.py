@@ -0,0 +1,45 @@
+"""
+Import-time budget for backend/server.py
+
+Each check imports the server in a fresh interpreter, so nothing cached by
+the test runner hides the cost. IMPORT_BUDGET_MS (default 2000) bounds the
+total; heavy dependencies that are only needed by some requests must not be
+imported at all.
+"""
+
+import json
+import os
+import subprocess
+import sys
+import unittest
+from pathlib import Path
+
+BACKEND_DIR = Path(__file__).parent.parent / "backend"
+IMPORT_BUDGET_MS = float(os.environ.get("IMPORT_BUDGET_MS", 2000))
+# Loaded on first use: badges, password hashing, the Motor client
+LAZY_MODULES = ["qrcode", "PIL", "passlib", "motor", "email_validator"]
+
+def import_server(code):
+    output = subprocess.check_output([sys.executable, "-c", code], cwd=BACKEND_DIR, text=True)
+    return json.loads(output.strip().splitlines()[-1])
+
+class ImportTimeTest(unittest.TestCase):
+    def test_heavy_dependencies_are_lazy(self):
+        loaded = import_server(
+            "import json, sys, server; "
+            f"print(json.dumps([m for m in {LAZY_MODULES!r} if m in sys.modules]))"
+        )
+        self.assertEqual(loaded, [], f"Imported eagerly by server.py: {', '.join(loaded)}")
+
+    def test_import_within_budget(self):
+        # Best of three, so one slow run on a busy machine does not fail the build
+        timings = [
+            import_server("import json, time; started = time.perf_counter(); import server; "
+                          "print(json.dumps((time.perf_counter() - started) * 1000))")
+            for _ in range(3)
+        ]
+        self.assertLess(min(timings), IMPORT_BUDGET_MS,
+                        f"Importing server took {min(timings):.0f} ms, budget is {IMPORT_BUDGET_MS:.0f} ms")
+
+if __name__ == "__main__":
+    unittest.main()
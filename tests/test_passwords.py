@@ -0,0 +1,62 @@
+"""
+Password hashing: configured schemes and costs, rehash on login, calibration
+"""
+
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import passwords  # noqa: E402
+from fake_db import FakeDatabase  # noqa: E402
+
+class PasswordsTest(unittest.TestCase):
+    def configure(self, schemes, rounds):
+        self.addCleanup(passwords.context.cache_clear)
+        self.addCleanup(setattr, passwords, "PASSWORD_SCHEMES", passwords.PASSWORD_SCHEMES)
+        self.addCleanup(setattr, passwords, "PASSWORD_ROUNDS", passwords.PASSWORD_ROUNDS)
+        passwords.PASSWORD_SCHEMES, passwords.PASSWORD_ROUNDS = schemes, rounds
+        passwords.context.cache_clear()
+
+    def setUp(self):
+        self.configure(["bcrypt", "pbkdf2_sha256"], {"bcrypt": 5, "pbkdf2_sha256": 1000})
+        self.addCleanup(passwords.shutdown)
+
+    def check(self, password_hash, password="secret"):
+        async def run():
+            db = FakeDatabase()
+            await db.users.insert_one({"id": "u1", "password_hash": password_hash})
+            ok = await passwords.check_password(db.users, await db.users.find_one({"id": "u1"}), password)
+            return ok, (await db.users.find_one({"id": "u1"}))["password_hash"]
+        return asyncio.run(run())
+
+    def test_current_hashes_are_kept(self):
+        password_hash = passwords.hash_password("secret")
+        self.assertTrue(password_hash.startswith("$2b$05$"))
+        self.assertEqual(self.check(password_hash), (True, password_hash))
+
+    def test_hashes_of_another_cost_or_scheme_are_replaced_on_login(self):
+        for old_hash in (passwords.scheme_context("bcrypt", 4).hash("secret"),
+                         passwords.scheme_context("bcrypt", 6).hash("secret"),
+                         passwords.scheme_context("pbkdf2_sha256", 1000).hash("secret")):
+            ok, stored = self.check(old_hash)
+            self.assertTrue(ok)
+            self.assertTrue(stored.startswith("$2b$05$"), stored)
+            self.assertTrue(passwords.verify_password("secret", stored))
+
+    def test_wrong_password_leaves_the_hash_alone(self):
+        old_hash = passwords.scheme_context("bcrypt", 4).hash("secret")
+        self.assertEqual(self.check(old_hash, password="wrong"), (False, old_hash))
+
+    def test_calibration_stays_within_the_target(self):
+        rounds, verify_ms = passwords.calibrate("pbkdf2_sha256", target_ms=5, samples=1)
+        self.assertGreaterEqual(rounds, 1)
+        self.assertLessEqual(verify_ms, 5)
+        # bcrypt never goes below its minimum cost, even when that is over the target
+        self.assertEqual(passwords.calibrate("bcrypt", target_ms=0.01, samples=1)[0], 4)
+
+if __name__ == "__main__":
+    unittest.main()
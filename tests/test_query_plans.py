@@ -0,0 +1,297 @@
+"""
+Query plan regression tests
+
+Seeds a throwaway database on a local MongoDB with generate_data.py, drives
+every route of backend/server.py (and every background job handler) through
+an in-process ASGI client, with the scenario's company moved to a dedicated
+database first, captures each command it issues through command
+monitoring and runs explain() on it. Fails when a query scans a whole
+collection that is above QUERY_PLAN_COLLECTION_THRESHOLD documents, or
+examines more than QUERY_PLAN_MAX_EXAMINED_RATIO times the documents it
+returns.
+
+Skipped when no MongoDB answers at MONGO_URL (default mongodb://localhost:27017).
+"""
+
+import asyncio
+import os
+import sys
+import threading
+import unittest
+import uuid
+from argparse import Namespace
+from pathlib import Path
+
+import httpx
+from pymongo import MongoClient, monitoring
+from pymongo.errors import PyMongoError
+
+ROOT_DIR = Path(__file__).parent.parent
+sys.path.insert(0, str(ROOT_DIR))
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+COLLECTION_THRESHOLD = int(os.environ.get("QUERY_PLAN_COLLECTION_THRESHOLD", 1000))
+MAX_EXAMINED_RATIO = float(os.environ.get("QUERY_PLAN_MAX_EXAMINED_RATIO", 10))
+
+EXPLAINED_COMMANDS = {"find", "aggregate", "count", "distinct", "update", "delete", "findAndModify"}
+# Routes that never touch MongoDB
+ROUTES_WITHOUT_QUERIES = {"/api/", "/api/metrics", "/api/owner/slow-queries", "/api/owner/admission",
+                          "/api/kiosk/roster/key"}
+
+def mongo_available():
+    try:
+        MongoClient(MONGO_URL, serverSelectionTimeoutMS=1000).admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+
+class CommandCapture(monitoring.CommandListener):
+    def __init__(self):
+        self.commands = []
+        self._lock = threading.Lock()
+
+    def started(self, event):
+        if event.command_name in EXPLAINED_COMMANDS:
+            with self._lock:
+                self.commands.append((event.database_name, event.command_name, event.command))
+
+    def succeeded(self, event):
+        pass
+
+    def failed(self, event):
+        pass
+
+    def take(self):
+        with self._lock:
+            commands, self.commands = self.commands, []
+        return commands
+
+@unittest.skipUnless(mongo_available(), f"No MongoDB reachable at {MONGO_URL}")
+class QueryPlanTest(unittest.TestCase):
+    """Every query issued by the API must be index-backed"""
+
+    db_name = f"query_plan_test_{uuid.uuid4().hex[:8]}"
+    plans = []  # (label, collection, collection size, command name, explain summary)
+    exercised_routes = set()
+
+    @classmethod
+    def setUpClass(cls):
+        import generate_data
+
+        seed_args = Namespace(
+            mongo_url=MONGO_URL, db_name=cls.db_name, employees=60, admins_per_company=2, kiosks_per_company=1,
+            years=0.5, night_share=0.15, open_share=0.01, edit_share=0.02, absence_share=0.08, batch_size=5000,
+            seed=7
+        )
+        client = MongoClient(MONGO_URL)
+        client[cls.db_name].owners.insert_one({
+            "id": str(uuid.uuid4()), "username": "owner", "email": "owner@system.com",
+            "password_hash": generate_data.CryptContext(schemes=["bcrypt"]).hash("owner123")
+        })
+        client.close()
+        password_hash = generate_data.CryptContext(schemes=["bcrypt"]).hash("test123")
+        cls.companies = [generate_data.generate_company(index, seed_args, "owner", password_hash)
+                         for index in range(3)]
+
+        asyncio.run(cls._exercise())
+
+    @classmethod
+    def tearDownClass(cls):
+        client = MongoClient(MONGO_URL)
+        for name in client.list_database_names():
+            if name.startswith(cls.db_name):
+                client.drop_database(name)
+
+    @classmethod
+    async def _exercise(cls):
+        import database
+        import server
+        import tenancy
+        from slowlog import explain_command, summarize_explain
+
+        capture = CommandCapture()
+        client = database.create_client(MONGO_URL, event_listeners=[capture])
+        db = client[cls.db_name]
+        server.db = db
+        server.analytics_db = database.analytics_database(client, cls.db_name)
+        server.job_queue.db = server.idempotency_store.db = db
+        await server.ensure_indexes()
+        tenancy.clear_cache()
+        await tenancy.migrate_company(db, cls.companies[0]["company_id"], "dedicated", propagation_seconds=0,
+                                      report=lambda message: None)
+        capture.take()
+
+        sizes = {}
+
+        async def record(label):
+            for database_name, command_name, command in capture.take():
+                collection = command.get(command_name)
+                if (database_name, collection) not in sizes:
+                    sizes[database_name, collection] = \
+                        await client[database_name][collection].estimated_document_count()
+                explain = await client[database_name].command(
+                    {"explain": explain_command(command), "verbosity": "executionStats"}
+                )
+                cls.plans.append((label, collection, sizes[database_name, collection], command_name, summarize_explain(explain)))
+
+        transport = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as http:
+            async def call(method, url, expected=(200,), **kwargs):
+                response = await http.request(method, url, **kwargs)
+                assert response.status_code in expected, f"{method} {url}: {response.status_code} {response.text}"
+                await record(f"{method} {url}")
+                return response
+
+            # Route templates are recorded through the ASGI scope the metrics middleware sees
+            original_route_template = server.metrics.route_template
+
+            def tracking_route_template(scope):
+                template = original_route_template(scope)
+                cls.exercised_routes.add((scope["method"], template))
+                return template
+            server.metrics.route_template = tracking_route_template
+
+            try:
+                await cls._scenario(call)
+            finally:
+                server.metrics.route_template = original_route_template
+
+        # Background jobs enqueued by the scenario, plus the scheduled ones
+        await server.job_queue.enqueue("archive_time_entries")
+        await server.job_queue.enqueue("retention_purge")
+        await server.job_queue.enqueue("employee_search_backfill")
+        await server.job_queue.enqueue("company_directory_reconcile")
+        await server.job_queue.enqueue("close_open_shifts")
+        await server.job_queue.enqueue("roster_tombstone_prune")
+        capture.take()
+        while True:
+            job = await server.job_queue.claim()
+            if not job:
+                break
+            await server.job_queue.run_job(job)
+            await record(f"job {job['type']}")
+        client.close()
+
+    @classmethod
+    async def _scenario(cls, call):
+        import badges
+
+        owner = (await call("POST", "/api/owner/login", json={"username": "owner", "password": "owner123"})).json()
+        owner_headers = {"Authorization": f"Bearer {owner['access_token']}"}
+        await call("POST", "/api/auth/login", json={"username": "owner", "password": "owner123"})
+        admin = (await call("POST", "/api/auth/login", json={"username": "c00000_admin0", "password": "test123"})).json()
+        admin_headers = {"Authorization": f"Bearer {admin['access_token']}"}
+        kiosk = (await call("POST", "/api/auth/login", json={"username": "c00000_user0", "password": "test123"})).json()
+        kiosk_headers = {"Authorization": f"Bearer {kiosk['access_token']}"}
+        company_id = admin["user"]["company_id"]
+
+        await call("GET", "/api/")
+        await call("GET", "/api/metrics")
+        await call("GET", "/api/auth/me", headers=admin_headers)
+        first_page = (await call("GET", "/api/owner/companies", headers=owner_headers,
+                                 params={"sort": "activity", "order": "desc", "limit": 2})).json()
+        await call("GET", "/api/owner/companies", headers=owner_headers,
+                   params={"sort": "activity", "order": "desc", "limit": 2, "cursor": first_page["next_cursor"]})
+        await call("GET", "/api/owner/companies", headers=owner_headers, params={"q": "firma 0000", "sort": "size"})
+        await call("GET", "/api/owner/slow-queries", headers=owner_headers)
+        await call("GET", "/api/owner/admission", headers=owner_headers)
+        await call("GET", "/api/company/info", headers=admin_headers)
+        await call("GET", "/api/company/users", headers=admin_headers)
+        await call("GET", "/api/company/shift-policy", headers=admin_headers)
+        await call("PUT", "/api/company/shift-policy", headers=admin_headers,
+                   json={"max_shift_hours": 12, "default_check_out": "16:00", "action": "close"})
+        user = (await call("POST", "/api/company/users", headers=admin_headers, json={
+            "username": f"planuser_{uuid.uuid4().hex[:6]}", "email": "plan@example.com", "password": "x"
+        })).json()
+        await call("DELETE", f"/api/company/users/{user['id']}", headers=admin_headers)
+
+        employees = (await call("GET", "/api/employees", headers=admin_headers)).json()
+        employee = (await call("POST", "/api/employees", headers=admin_headers, json={
+            "name": "Plan", "surname": "Test", "position": "Tester", "number": "P-1"
+        })).json()
+        await call("PUT", f"/api/employees/{employee['id']}", headers=admin_headers, json={"number": "P-2"})
+        await call("GET", "/api/employees/search", headers=admin_headers, params={"q": "kowal"})
+        await call("GET", "/api/employees/search", headers=admin_headers, params={"q": "kowlaski"})
+
+        await call("POST", "/api/time/scan", headers=kiosk_headers, json={"qr_data": f"EMP_{company_id}_P-2_x"})
+        await call("POST", "/api/time/scan", headers=kiosk_headers,
+                   json={"qr_data": badges.sign(company_id, employees[0]["id"])})
+        kiosk_roster = (await call("GET", "/api/kiosk/roster", headers=kiosk_headers)).json()
+        await call("GET", "/api/kiosk/roster", headers=kiosk_headers, params={"since": kiosk_roster["version"]})
+        await call("GET", "/api/kiosk/roster/key", headers=kiosk_headers)
+        await call("GET", f"/api/time/entries/{employees[0]['id']}", headers=admin_headers)
+        await call("GET", f"/api/time/entries/{employees[0]['id']}", headers=admin_headers,
+                   params={"date_from": "2000-01-01", "date_to": "2000-12-31"})
+        entries = (await call("GET", "/api/time/entries", headers=admin_headers)).json()
+        await call("GET", "/api/time/entries", headers=admin_headers, params={"date_from": entries[0]["date"]})
+        entry = (await call("POST", "/api/time/entries", headers=admin_headers, json={
+            "employee_id": employee["id"], "check_in": "08:00", "check_out": "16:00", "date": "2024-01-02"
+        })).json()
+        await call("PUT", f"/api/time/entries/{entry['id']}", headers=admin_headers, json={"check_out": "17:00"})
+        await call("POST", "/api/time/entries/bulk", headers=admin_headers, json={"operations": [
+            {"action": "update", "id": entry["id"], "check_out": "18:00"},
+            {"action": "create", "employee_id": employee["id"], "date": "2024-01-03", "check_in": "08:00"},
+            {"action": "delete", "id": "missing"},
+        ]})
+        await call("GET", f"/api/employees/{employees[0]['id']}/timesheet", headers=admin_headers,
+                   params={"month": entries[0]["date"][:7]})
+        await call("GET", "/api/timesheets", headers=admin_headers, params={"month": "2024-01"})
+        await call("DELETE", f"/api/time/entries/{entry['id']}", headers=admin_headers)
+        await call("DELETE", f"/api/employees/{employee['id']}", headers=admin_headers)
+
+        other_company = cls.companies[1]["company_id"]
+        await call("POST", "/api/owner/badges/reissue", headers=owner_headers, expected=(202,))
+        await call("GET", f"/api/owner/companies/{other_company}/retention", headers=owner_headers)
+        await call("PUT", f"/api/owner/companies/{other_company}/retention", headers=owner_headers,
+                   json={"retention_years": 1})
+        purge = (await call("POST", f"/api/owner/companies/{other_company}/retention/purge", headers=owner_headers,
+                            expected=(202,))).json()
+        await call("GET", f"/api/jobs/{purge['job_id']}", headers=owner_headers)
+        await call("GET", f"/api/jobs/{purge['job_id']}/result", headers=owner_headers, expected=(409,))
+
+        created = (await call("POST", "/api/owner/companies", headers=owner_headers, json={
+            "name": f"Plan Company {uuid.uuid4().hex[:6]}", "admin_username": f"planadmin_{uuid.uuid4().hex[:6]}",
+            "admin_email": "planadmin@example.com", "admin_password": "x"
+        })).json()
+        await call("DELETE", f"/api/owner/companies/{created['company']['id']}", headers=owner_headers,
+                   expected=(202,))
+        await call("GET", f"/api/owner/companies/{created['company']['id']}/deletion", headers=owner_headers)
+        await call("POST", "/api/auth/register-company", json={
+            "company_name": f"Plan Registered {uuid.uuid4().hex[:6]}",
+            "admin_username": f"planreg_{uuid.uuid4().hex[:6]}", "admin_email": "planreg@example.com",
+            "admin_password": "x"
+        })
+
+    def test_no_collection_scans_on_large_collections(self):
+        scans = [
+            f"{label}: {command} on {collection} ({size} docs)"
+            for label, collection, size, command, summary in self.plans
+            if summary["plan"] == "COLLSCAN" and size > COLLECTION_THRESHOLD
+        ]
+        self.assertEqual(scans, [], "Queries scanning whole collections:\n" + "\n".join(scans))
+
+    def test_documents_examined_per_returned(self):
+        wasteful = [
+            f"{label}: {command} on {collection} examined {summary['docs_examined']} "
+            f"for {summary['returned']} returned (index {summary['index']})"
+            for label, collection, size, command, summary in self.plans
+            if size > COLLECTION_THRESHOLD and summary["docs_examined"] is not None
+            and summary["docs_examined"] > MAX_EXAMINED_RATIO * max(summary["returned"] or 0, 1)
+        ]
+        self.assertEqual(wasteful, [], "Queries examining too many documents:\n" + "\n".join(wasteful))
+
+    def test_every_route_exercised(self):
+        import server
+
+        routes = {
+            (method, route.path)
+            for route in server.app.routes if hasattr(route, "methods") and route.path.startswith("/api")
+            for method in route.methods if method != "HEAD"
+        }
+        missing = sorted(f"{method} {path}" for method, path in routes - self.exercised_routes
+                         if path not in ROUTES_WITHOUT_QUERIES)
+        self.assertEqual(missing, [], "Routes not covered by the query plan scenario:\n" + "\n".join(missing))
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+"""
+Retention purge by company and date, and entries without a company
+"""
+
+import asyncio
+import sys
+import unittest
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import retention  # noqa: E402
+from fake_db import FakeDatabase  # noqa: E402
+
+def entry(entry_id, employee_id, date, **fields):
+    return {"id": entry_id, "employee_id": employee_id, "date": date, "status": "completed", **fields}
+
+class RetentionTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, retention, "RETENTION_MIN_PAUSE_SECONDS", retention.RETENTION_MIN_PAUSE_SECONDS)
+        retention.RETENTION_MIN_PAUSE_SECONDS = 0
+        self.db = FakeDatabase()
+
+    def test_unowned_entries_are_stamped_or_purged_with_their_employee(self):
+        async def run():
+            await self.db.employees.insert_one({"id": "anna", "company_id": "acme"})
+            await self.db.time_entries.insert_many([
+                entry("legacy", "anna", "2015-01-10"),
+                entry("orphan", "gone", "2023-05-10"),
+                entry("migrating", "moving", "2015-01-10"),
+            ])
+            await self.db.time_entries_archive.insert_many([
+                {"id": "anna:2014-12", "employee_id": "anna", "company_id": None, "month": "2014-12", "entries": {}},
+                {"id": "gone:2014-12", "employee_id": "gone", "company_id": None, "month": "2014-12", "entries": {}},
+            ])
+            settled = await retention.settle_unowned(self.db, exclude_employee_ids=["moving"])
+            purged = await retention.purge_company(self.db, "acme", "2020-01-01")
+            remaining = await self.db.time_entries.distinct("id")
+            buckets = await self.db.time_entries_archive.distinct("id")
+            return settled, purged, remaining, buckets
+
+        settled, purged, remaining, buckets = asyncio.run(run())
+        self.assertEqual(settled, {"entries_stamped": 1, "buckets_stamped": 1,
+                                   "orphan_entries_purged": 1, "orphan_buckets_deleted": 1})
+        self.assertEqual((purged["entries_purged"], purged["buckets_deleted"]), (1, 1))
+        self.assertEqual(remaining, ["migrating"])
+        self.assertEqual(buckets, [])
+
+    def test_purge_keeps_entries_of_other_companies_and_recent_ones(self):
+        async def run():
+            await self.db.time_entries.insert_many([
+                entry("old", "anna", "2015-01-10", company_id="acme"),
+                entry("recent", "anna", "2023-01-10", company_id="acme"),
+                entry("other", "jan", "2015-01-10", company_id="globex"),
+            ])
+            await self.db.time_entries_archive.insert_one({
+                "id": "anna:2020-01", "employee_id": "anna", "company_id": "acme", "month": "2020-01",
+                "entries": {"a": {"id": "a", "date": "2020-01-05"}, "b": {"id": "b", "date": "2020-01-20"}},
+                "entry_ids": ["a", "b"]
+            })
+            stats = await retention.purge_company(self.db, "acme", "2020-01-10")
+            bucket = await self.db.time_entries_archive.find_one({"id": "anna:2020-01"})
+            return stats, sorted(await self.db.time_entries.distinct("id")), bucket
+
+        stats, remaining, bucket = asyncio.run(run())
+        self.assertEqual(remaining, ["other", "recent"])
+        self.assertEqual((stats["entries_purged"], stats["archived_entries_purged"]), (1, 1))
+        self.assertEqual((list(bucket["entries"]), bucket["entry_ids"]), (["b"], ["b"]))
+
+if __name__ == "__main__":
+    unittest.main()
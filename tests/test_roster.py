@@ -0,0 +1,93 @@
+"""
+Kiosk rosters: versions, deltas, tombstones and signatures
+"""
+
+import asyncio
+import base64
+import sys
+import unittest
+import uuid
+from datetime import datetime, timedelta
+from pathlib import Path
+
+from cryptography.exceptions import InvalidSignature
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PublicKey
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import badges  # noqa: E402
+import roster  # noqa: E402
+from fake_db import FakeDatabase  # noqa: E402
+
+COMPANY = str(uuid.uuid4())
+
+class RosterTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, roster, "ROSTER_DELTA_OVERLAP", roster.ROSTER_DELTA_OVERLAP)
+        roster.ROSTER_DELTA_OVERLAP = 0
+        self.db = FakeDatabase()
+
+    async def add_employee(self, name, number):
+        employee = {"id": str(uuid.uuid4()), "company_id": COMPANY, "name": name, "surname": "Nowak",
+                    "number": number, "roster_version": await roster.next_version(self.db, COMPANY)}
+        await self.db.employees.insert_one(employee)
+        return employee
+
+    def test_deltas_carry_changes_and_removals_since_a_version(self):
+        async def run():
+            await self.db.companies.insert_one({"id": COMPANY, "name": "Acme"})
+            anna = await self.add_employee("Anna", "1")
+            piotr = await self.add_employee("Piotr", "2")
+            first = await roster.roster(self.db, self.db, COMPANY)
+
+            await self.db.employees.update_one({"id": anna["id"]}, {"$set": {
+                "number": "7", "roster_version": await roster.next_version(self.db, COMPANY)
+            }})
+            await self.db.employees.delete_one({"id": piotr["id"]})
+            await roster.record_removal(self.db, self.db, piotr)
+            delta = await roster.roster(self.db, self.db, COMPANY, since=first["version"])
+            unchanged = await roster.roster(self.db, self.db, COMPANY, since=delta["version"])
+            return anna, piotr, first, delta, unchanged
+
+        anna, piotr, first, delta, unchanged = asyncio.run(run())
+        self.assertTrue(first["full"])
+        self.assertEqual(first["version"], 2)
+        self.assertEqual({entry["name"] for entry in first["employees"]}, {"Anna Nowak", "Piotr Nowak"})
+        self.assertEqual(first["employees"][0]["key"], badges.badge_key(COMPANY, anna["id"]))
+
+        self.assertFalse(delta["full"])
+        self.assertEqual(delta["version"], 4)
+        self.assertEqual([(entry["name"], entry["number"]) for entry in delta["employees"]], [("Anna Nowak", "7")])
+        self.assertEqual(delta["removed"], [badges.badge_key(COMPANY, piotr["id"])])
+        self.assertEqual((unchanged["employees"], unchanged["removed"]), ([], []))
+
+    def test_kiosks_behind_pruned_tombstones_get_the_full_roster(self):
+        async def run():
+            await self.db.companies.insert_one({"id": COMPANY, "name": "Acme"})
+            anna = await self.add_employee("Anna", "1")
+            await self.db.employees.delete_one({"id": anna["id"]})
+            await roster.record_removal(self.db, self.db, anna)
+            await self.add_employee("Ewa", "2")
+            pruned = await roster.prune_tombstones(
+                self.db, self.db, now=datetime.utcnow() + timedelta(days=roster.ROSTER_TOMBSTONE_DAYS + 1)
+            )
+            behind = await roster.roster(self.db, self.db, COMPANY, since=1)
+            current = await roster.roster(self.db, self.db, COMPANY, since=2)
+            return pruned, behind, current
+
+        pruned, behind, current = asyncio.run(run())
+        self.assertEqual(pruned, 1)
+        self.assertTrue(behind["full"])
+        self.assertEqual([entry["name"] for entry in behind["employees"]], ["Ewa Nowak"])
+        self.assertFalse(current["full"])
+
+    def test_body_signature_verifies_with_the_public_key(self):
+        body = roster.encode({"company_id": COMPANY, "version": 1, "employees": []})
+        public_key = Ed25519PublicKey.from_public_bytes(base64.b64decode(roster.public_key()))
+        public_key.verify(base64.b64decode(roster.sign(body)), body)
+        with self.assertRaises(InvalidSignature):
+            public_key.verify(base64.b64decode(roster.sign(body)), body + b" ")
+
+if __name__ == "__main__":
+    unittest.main()
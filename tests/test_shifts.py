@@ -0,0 +1,89 @@
+"""
+Auto-close of forgotten open shifts
+"""
+
+import asyncio
+import sys
+import unittest
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import shifts  # noqa: E402
+from fake_db import FakeDatabase  # noqa: E402
+
+NOW = datetime(2024, 3, 10, 12, 0)
+
+def entry(entry_id, employee_id, check_in, status="working"):
+    return {"id": entry_id, "employee_id": employee_id, "check_in": check_in, "check_out": None,
+            "date": check_in.strftime("%Y-%m-%d"), "status": status}
+
+class SweepOpenShiftsTest(unittest.TestCase):
+    def setUp(self):
+        self.addCleanup(setattr, shifts, "SHIFT_SWEEP_BATCH_PAUSE_SECONDS", shifts.SHIFT_SWEEP_BATCH_PAUSE_SECONDS)
+        shifts.SHIFT_SWEEP_BATCH_PAUSE_SECONDS = 0
+        self.db = FakeDatabase()
+
+    def sweep(self, policies, **kwargs):
+        async def run():
+            await self.db.employees.insert_many([
+                {"id": "closer", "company_id": "acme"},
+                {"id": "flagger", "company_id": "globex"},
+            ])
+            await self.db.time_entries.insert_many(self.entries)
+            stats = await shifts.sweep_open_shifts(self.db, policies, now=NOW, **kwargs)
+            entries = await self.db.time_entries.find({}, {"_id": 0}).to_list(None)
+            return stats, {entry["id"]: entry for entry in entries}
+        return asyncio.run(run())
+
+    def test_stale_shifts_are_closed_or_flagged_per_company(self):
+        self.entries = [
+            entry("yesterday", "closer", datetime(2024, 3, 9, 8, 0)),
+            entry("night", "closer", datetime(2024, 3, 8, 22, 0)),
+            entry("running", "closer", datetime(2024, 3, 10, 7, 0)),
+            entry("forgotten", "flagger", datetime(2024, 3, 9, 8, 0)),
+        ]
+        policies = {
+            "acme": shifts.shift_policy({"shift_policy": {"action": "close", "max_shift_hours": 10,
+                                                          "default_check_out": "16:00"}}),
+            "globex": shifts.shift_policy({}),
+        }
+        stats, entries = self.sweep(policies)
+
+        self.assertEqual(entries["yesterday"]["check_out"], datetime(2024, 3, 9, 16, 0))
+        self.assertTrue(entries["yesterday"]["auto_closed"])
+        # 16:00 on the day of a night shift is before it started; it ends after the maximum length
+        self.assertEqual(entries["night"]["check_out"], datetime(2024, 3, 9, 8, 0))
+        self.assertEqual(entries["running"]["status"], "working")
+        self.assertEqual(entries["forgotten"]["status"], "unclosed")
+        self.assertIsNone(entries["forgotten"]["check_out"])
+        self.assertEqual((stats["entries_closed"], stats["entries_flagged"]), (2, 1))
+
+    def test_paging_moves_past_shifts_that_are_not_stale_yet(self):
+        shifts.SHIFT_SWEEP_BATCH_SIZE, original_batch_size = 2, shifts.SHIFT_SWEEP_BATCH_SIZE
+        self.addCleanup(setattr, shifts, "SHIFT_SWEEP_BATCH_SIZE", original_batch_size)
+        # The short policy of one company brings the other company's long shifts into the scan
+        self.entries = [entry(f"long{hour}", "flagger", datetime(2024, 3, 10, hour, 0)) for hour in range(6)]
+        self.entries.append(entry("stale", "closer", datetime(2024, 3, 10, 6, 0)))
+        policies = {"acme": shifts.shift_policy({"shift_policy": {"action": "close", "max_shift_hours": 1}}),
+                    "globex": shifts.shift_policy({"shift_policy": {"max_shift_hours": 24}})}
+        stats, entries = self.sweep(policies)
+        self.assertEqual(entries["stale"]["check_out"], datetime(2024, 3, 10, 7, 0))
+        self.assertEqual(stats["entries_checked"], 7)
+        self.assertEqual(stats["entries_flagged"], 0)
+
+    def test_completed_and_excluded_entries_are_left_alone(self):
+        self.entries = [
+            entry("done", "closer", datetime(2024, 3, 1, 8, 0), status="completed"),
+            entry("migrating", "flagger", datetime(2024, 3, 1, 8, 0)),
+        ]
+        stats, entries = self.sweep({"acme": shifts.shift_policy({}), "globex": shifts.shift_policy({})},
+                                    exclude_employee_ids=["flagger"])
+        self.assertEqual(entries["done"]["status"], "completed")
+        self.assertEqual(entries["migrating"]["status"], "working")
+        self.assertEqual(stats["entries_checked"], 1)
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,182 @@
+"""
+Tenant routing and online migration between shared and dedicated databases
+
+Runs against the in-memory FakeDatabase, and again against a local MongoDB
+at MONGO_URL when one answers (a single mongod is enough).
+"""
+
+import asyncio
+import os
+import sys
+import unittest
+import uuid
+from pathlib import Path
+
+from pymongo import MongoClient
+from pymongo.errors import PyMongoError
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import tenancy  # noqa: E402
+from fake_db import FakeDatabase  # noqa: E402
+
+MONGO_URL = os.environ.get("MONGO_URL", "mongodb://localhost:27017")
+
+def mongo_available():
+    try:
+        MongoClient(MONGO_URL, serverSelectionTimeoutMS=1000).admin.command("ping")
+        return True
+    except PyMongoError:
+        return False
+
+async def seed(db, company_id, employees=3, entries_per_employee=4):
+    await db.companies.insert_one({"id": company_id, "name": company_id, "deleted_at": None})
+    for number in range(employees):
+        employee_id = f"{company_id}-emp{number}"
+        await db.employees.insert_one({"id": employee_id, "company_id": company_id, "number": str(number)})
+        await db.time_entries.insert_many([
+            {"id": f"{employee_id}-{day}", "employee_id": employee_id, "date": f"2024-01-{day + 1:02d}",
+             "status": "completed"}
+            for day in range(entries_per_employee)
+        ])
+        await db.time_entries_archive.insert_one(
+            {"id": f"{employee_id}:2023-12", "employee_id": employee_id, "company_id": company_id,
+             "month": "2023-12", "entries": {}}
+        )
+
+async def tenant_counts(db, company_id):
+    employee_ids = await db.employees.distinct("id", {"company_id": company_id})
+    return (
+        len(employee_ids),
+        await db.time_entries.count_documents({"employee_id": {"$in": employee_ids}}),
+        await db.time_entries_archive.count_documents({"company_id": company_id}),
+    )
+
+class TenancyTestMixin:
+    """Tests shared by the database variants; their setUp sets self.db"""
+
+    def run_async(self, coroutine):
+        return asyncio.run(coroutine)
+
+    def migrate(self, company_id, placement, **kwargs):
+        return tenancy.migrate_company(self.db, company_id, placement, propagation_seconds=0,
+                                       report=kwargs.pop("report", lambda message: None), **kwargs)
+
+    def test_unregistered_companies_stay_shared(self):
+        async def run():
+            await seed(self.db, "acme")
+            self.assertEqual((await tenancy.tenant_database(self.db, "acme")).name, self.db.name)
+            self.assertEqual([tdb.name for tdb in await tenancy.tenant_databases(self.db)], [self.db.name])
+        self.run_async(run())
+
+    def test_migration_to_dedicated_and_back(self):
+        async def run():
+            await seed(self.db, "acme")
+            await seed(self.db, "other")
+
+            result = await self.migrate("acme", "dedicated")
+            dedicated = await tenancy.tenant_database(self.db, "acme")
+            self.assertEqual(dedicated.name, result["target"])
+            self.assertNotEqual(dedicated.name, self.db.name)
+            self.assertEqual(await tenant_counts(dedicated, "acme"), (3, 12, 3))
+            self.assertEqual(await tenant_counts(self.db, "acme"), (0, 0, 0))
+            self.assertEqual(await tenant_counts(self.db, "other"), (3, 12, 3))
+            self.assertEqual([tdb.name for tdb in await tenancy.tenant_databases(self.db)],
+                             [self.db.name, dedicated.name])
+
+            await self.migrate("acme", "shared")
+            self.assertEqual((await tenancy.tenant_database(self.db, "acme")).name, self.db.name)
+            self.assertEqual(await tenant_counts(self.db, "acme"), (3, 12, 3))
+            self.assertEqual(await tenant_counts(dedicated, "acme"), (0, 0, 0))
+        self.run_async(run())
+
+    def test_writes_during_copy_reach_the_target(self):
+        async def run():
+            await seed(self.db, "acme")
+
+            async def write_before_freeze():
+                await self.db.time_entries.insert_one(
+                    {"id": "late", "employee_id": "acme-emp0", "date": "2024-02-01", "status": "working"}
+                )
+                await self.db.time_entries.delete_one({"id": "acme-emp1-0"})
+                await self.db.employees.update_one({"id": "acme-emp2"}, {"$set": {"number": "99"}})
+
+            pending = []
+            def report(message):
+                # The freeze is announced after the first pass, while the source is still authoritative
+                if message.startswith("Writes frozen"):
+                    pending.append(asyncio.ensure_future(write_before_freeze()))
+
+            async def sleep_and_flush(seconds):
+                await asyncio.gather(*pending)
+
+            original_sleep = tenancy.asyncio.sleep
+            tenancy.asyncio.sleep = sleep_and_flush
+            try:
+                await self.migrate("acme", "dedicated", report=report)
+            finally:
+                tenancy.asyncio.sleep = original_sleep
+
+            dedicated = await tenancy.tenant_database(self.db, "acme")
+            self.assertIsNotNone(await dedicated.time_entries.find_one({"id": "late"}))
+            self.assertIsNone(await dedicated.time_entries.find_one({"id": "acme-emp1-0"}))
+            self.assertEqual((await dedicated.employees.find_one({"id": "acme-emp2"}))["number"], "99")
+        self.run_async(run())
+
+    def test_frozen_company_refuses_writes_only(self):
+        async def run():
+            await seed(self.db, "acme")
+            await self.db.tenants.insert_one({"company_id": "acme", "placement": "shared", "state": "frozen"})
+            self.assertEqual((await tenancy.tenant_database(self.db, "acme")).name, self.db.name)
+            with self.assertRaises(tenancy.TenantFrozen):
+                await tenancy.tenant_database(self.db, "acme", write=True)
+            self.assertEqual(await tenancy.migrating_companies(self.db), ["acme"])
+            with self.assertRaises(tenancy.MigrationError):
+                await self.migrate("acme", "dedicated")
+        self.run_async(run())
+
+    def test_failed_migration_rolls_back(self):
+        async def run():
+            await seed(self.db, "acme")
+
+            def report(message):
+                if message.startswith("Writes frozen"):
+                    raise RuntimeError("interrupted")
+
+            with self.assertRaises(RuntimeError):
+                await self.migrate("acme", "dedicated", report=report)
+            entry = await tenancy.registry_entry(self.db, "acme", fresh=True)
+            self.assertEqual((entry["placement"], entry["state"]), ("shared", "active"))
+            self.assertEqual((await tenancy.tenant_database(self.db, "acme", write=True)).name, self.db.name)
+            self.assertEqual(await tenant_counts(self.db, "acme"), (3, 12, 3))
+            target = self.db.client.get_database(tenancy.dedicated_database_name(self.db, "acme"))
+            self.assertEqual(await tenant_counts(target, "acme"), (0, 0, 0))
+        self.run_async(run())
+
+class FakeDatabaseTenancyTest(TenancyTestMixin, unittest.TestCase):
+    def setUp(self):
+        tenancy.clear_cache()
+        self.db = FakeDatabase(f"tenancy_{uuid.uuid4().hex[:8]}")
+
+@unittest.skipUnless(mongo_available(), f"No MongoDB reachable at {MONGO_URL}")
+class MongoTenancyTest(TenancyTestMixin, unittest.TestCase):
+    def setUp(self):
+        import database
+        tenancy.clear_cache()
+        self.client = database.create_client(MONGO_URL)
+        self.db = self.client[f"tenancy_test_{uuid.uuid4().hex[:8]}"]
+
+    def run_async(self, coroutine):
+        async def run():
+            # Motor binds the client to the running loop on first use
+            try:
+                return await coroutine
+            finally:
+                for name in await self.client.list_database_names():
+                    if name.startswith(self.db.name):
+                        await self.client.drop_database(name)
+        return asyncio.run(run())
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,99 @@
+"""
+Monthly timesheet PDFs and the company ZIP
+"""
+
+import asyncio
+import io
+import re
+import sys
+import unittest
+import zipfile
+import zlib
+from datetime import datetime
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "backend"))
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import timesheets  # noqa: E402
+from fake_db import FakeDatabase  # noqa: E402
+
+def employee(number, **fields):
+    return {"id": f"emp-{number}", "company_id": "acme", "name": "Łucja", "surname": f"Żak{number}",
+            "number": str(number), "position": "Magazynier", **fields}
+
+def entry(employee_id, day, check_in, check_out=None):
+    date = f"2024-02-{day:02d}"
+    return {
+        "id": f"{employee_id}-{day}", "employee_id": employee_id, "date": date,
+        "check_in": datetime.fromisoformat(f"{date}T{check_in}"),
+        "check_out": datetime.fromisoformat(f"{date}T{check_out}") if check_out else None,
+        "status": "completed" if check_out else "working",
+    }
+
+def page_texts(pdf):
+    streams = re.findall(rb"stream\n(.*?)\nendstream", pdf, re.S)
+    return [zlib.decompress(stream) for stream in streams]
+
+class RenderTimesheetTest(unittest.TestCase):
+    def render(self, entries):
+        return timesheets.render_timesheet(
+            timesheets.timesheet_data("Acme", employee(1), "2024-02", entries)
+        )
+
+    def test_pdf_is_well_formed(self):
+        pdf = self.render([entry("emp-1", 1, "08:00", "16:30")])
+        self.assertTrue(pdf.startswith(b"%PDF-1.4"))
+        self.assertTrue(pdf.endswith(b"%%EOF\n"))
+        xref = int(re.search(rb"startxref\n(\d+)", pdf).group(1))
+        self.assertTrue(pdf[xref:].startswith(b"xref"))
+        # Every object sits at the offset the cross-reference table gives for it
+        offsets = re.findall(rb"(\d{10}) 00000 n", pdf[xref:])
+        for number, offset in enumerate(offsets, start=1):
+            self.assertTrue(pdf[int(offset):].startswith(b"%d 0 obj" % number))
+
+    def test_every_day_of_the_month_and_the_totals_are_listed(self):
+        pdf = self.render([entry("emp-1", 1, "08:00", "16:30"), entry("emp-1", 1, "18:00", "19:00"),
+                           entry("emp-1", 2, "08:00")])
+        text = b"".join(page_texts(pdf))
+        self.assertIn(b"(29.02.2024)", text)
+        self.assertIn(b"(8:30)", text)
+        self.assertIn(b"Suma godzin: 9:30", text)
+        self.assertIn(b"Dni przepracowane: 2", text)
+        # Polish letters use the codes given in the font's /Differences
+        self.assertIn(bytes([timesheets.EXTRA_CODES["Ł"]]) + b"ucja", text)
+
+    def test_long_months_continue_on_more_pages(self):
+        entries = [entry("emp-1", day, "08:00", "12:00") for day in range(1, 30)]
+        entries += [entry("emp-1", day, "13:00", "17:00") for day in range(1, 30)]
+        pdf = self.render(entries)
+        pages = int(re.search(rb"/Type /Pages /Kids \[[^\]]*\] /Count (\d+)", pdf).group(1))
+        self.assertGreater(pages, 1)
+        self.assertIn(b"Podpis pracodawcy", page_texts(pdf)[-1])
+
+class CompanyZipTest(unittest.TestCase):
+    def test_zip_has_one_timesheet_per_employee(self):
+        async def run():
+            db = FakeDatabase()
+            await db.employees.insert_many([employee(number) for number in range(1, 4)])
+            await db.employees.insert_one({**employee(9), "company_id": "other"})
+            await db.time_entries.insert_many([entry("emp-1", 5, "08:00", "16:00"),
+                                               entry("emp-9", 5, "08:00", "16:00")])
+            chunks = [chunk async for chunk in timesheets.company_timesheets_zip(db, "acme", "Acme", "2024-02")]
+            return b"".join(chunks)
+
+        original_batch_size = timesheets.TIMESHEET_BATCH_SIZE
+        timesheets.TIMESHEET_BATCH_SIZE = 2
+        try:
+            bundle = zipfile.ZipFile(io.BytesIO(asyncio.run(run())))
+        finally:
+            timesheets.TIMESHEET_BATCH_SIZE = original_batch_size
+            timesheets.shutdown()
+        names = sorted(bundle.namelist())
+        self.assertEqual(len(names), 3)
+        self.assertTrue(all(name.endswith("_2024-02.pdf") for name in names))
+        for name in names:
+            self.assertTrue(bundle.read(name).startswith(b"%PDF-1.4"))
+
+if __name__ == "__main__":
+    unittest.main()